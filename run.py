@@ -8,7 +8,8 @@ warnings.filterwarnings("ignore")
 import os
 import sys
 import time
-from typing import Dict
+from datetime import date
+from typing import Dict, Union
 
 import orjson
 import typer
@@ -18,13 +19,18 @@ from pydantic import PositiveInt
 from rich import progress
 
 from src import (
+    CheckpointPolicy,
+    CheckpointWriter,
     FinMemAgent,
     MarketEnv,
+    OpenAIEmbedding,
     RunMode,
     TaskType,
     ensure_path,
+    get_latest_checkpoint_path,
     output_metric_summary_multi,
     output_metrics_summary_single,
+    write_checkpoint_ops,
 )
 
 app = typer.Typer()
@@ -47,6 +53,66 @@ class RequestTimeSleep:
             time.sleep(self.sleep_time)
 
 
+def get_checkpoint_writer(config: Dict) -> Union[CheckpointWriter, None]:
+    if not config["meta_config"].get("checkpoint_async", False):
+        return None
+    logger.info("SYS-Checkpoints are written in the background")
+    return CheckpointWriter(max_pending=config["meta_config"]["checkpoint_max_pending"])
+
+
+def get_checkpoint_policy(config: Dict, path: str) -> CheckpointPolicy:
+    keep_last = config["meta_config"].get("checkpoint_keep_last")
+    # the log is appended next to the last snapshot, every checkpoint of a ring
+    # goes to a new directory and would always be a full snapshot
+    if (
+        keep_last is not None
+        and config["agent_config"]["memory_db_config"].get(
+            "memory_checkpoint_wal_interval"
+        )
+        is not None
+    ):
+        raise ValueError(
+            "memory_checkpoint_wal_interval cannot be combined with checkpoint_keep_last"
+        )
+    return CheckpointPolicy(
+        path=path,
+        every_n_steps=config["meta_config"].get("checkpoint_every_n_steps", 1),
+        every_seconds=config["meta_config"].get("checkpoint_every_seconds"),
+        on_signal=config["meta_config"].get("checkpoint_on_signal", False),
+        keep_last=keep_last,
+    )
+
+
+def save_step_checkpoint(
+    agent: FinMemAgent,
+    env: MarketEnv,
+    cur_date: date,
+    checkpoint_policy: CheckpointPolicy,
+    checkpoint_writer: Union[CheckpointWriter, None],
+) -> None:
+    if not checkpoint_policy.step():
+        return
+    # the ops hold a snapshot of the step state, so the writer can persist them
+    # while the next step runs
+    path = checkpoint_policy.get_checkpoint_path(cur_date=cur_date)
+    ops = (
+        agent.checkpoint_ops(os.path.join(path, "agent"))
+        + env.checkpoint_ops(os.path.join(path, "env"))
+        + checkpoint_policy.retention_ops(cur_date=cur_date)
+    )
+    if checkpoint_writer is None:
+        write_checkpoint_ops(ops)
+    else:
+        checkpoint_writer.submit(ops)
+
+    # stop once the checkpoint is on disk when asked to terminate
+    if checkpoint_policy.received_signal is not None:
+        if checkpoint_writer is not None:
+            checkpoint_writer.close()
+        logger.warning(f"SYS-Checkpoint saved to {path}, stopping")
+        raise typer.Exit(code=128 + checkpoint_policy.received_signal)
+
+
 @app.command(name="warmup")
 def warmup_up_func(
     config_path: str = typer.Option(
@@ -86,6 +152,12 @@ def warmup_up_func(
             ],
         )
 
+    # checkpoint writer and policy
+    checkpoint_writer = get_checkpoint_writer(config=config)
+    checkpoint_policy = get_checkpoint_policy(
+        config=config, path=config["meta_config"]["warmup_checkpoint_save_path"]
+    )
+
     # log
     logger.info("SYS-Warmup function started")
     logger.info(f"CONFIG-Config path: {config_path}")
@@ -152,16 +224,12 @@ def warmup_up_func(
             agent.step(market_info=obs, run_mode=RunMode.WARMUP, task_type=task_type)
 
             # save checkpoint
-            agent.save_checkpoint(
-                path=os.path.join(
-                    config["meta_config"]["warmup_checkpoint_save_path"], "agent"
-                )
-            )
-
-            env.save_checkpoint(
-                path=os.path.join(
-                    config["meta_config"]["warmup_checkpoint_save_path"], "env"
-                )
+            save_step_checkpoint(
+                agent=agent,
+                env=env,
+                cur_date=obs.cur_date,  # type: ignore
+                checkpoint_policy=checkpoint_policy,
+                checkpoint_writer=checkpoint_writer,
             )
 
             # request time sleep
@@ -175,6 +243,10 @@ def warmup_up_func(
                 description=f"Warmup remaining steps: {task.remaining}",
             )
 
+    # wait for pending checkpoints
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+
     # save warmup results
     agent.save_checkpoint(
         path=os.path.join(config["meta_config"]["warmup_output_save_path"], "agent")
@@ -183,6 +255,9 @@ def warmup_up_func(
         path=os.path.join(config["meta_config"]["warmup_output_save_path"], "env")
     )
 
+    # close the embedding client
+    agent.close()
+
 
 @app.command(name="warmup-checkpoint")
 def warmup_checkpoint_func(
@@ -218,20 +293,23 @@ def warmup_checkpoint_func(
             ],
         )
 
+    # checkpoint writer and policy
+    checkpoint_writer = get_checkpoint_writer(config=config)
+    checkpoint_policy = get_checkpoint_policy(
+        config=config, path=config["meta_config"]["warmup_checkpoint_save_path"]
+    )
+
     # log
     logger.info("SYS-Warmup checkpoint function started")
     logger.info(f"CONFIG-Config path: {config_path}")
     logger.info(f"CONFIG-Config: {config}")
 
     # load env and agent
-    agent = FinMemAgent.load_checkpoint(
-        path=os.path.join(
-            config["meta_config"]["warmup_checkpoint_save_path"], "agent"
-        ),
-    )
-    env = MarketEnv.load_checkpoint(
-        path=os.path.join(config["meta_config"]["warmup_checkpoint_save_path"], "env")
+    checkpoint_path = get_latest_checkpoint_path(
+        path=config["meta_config"]["warmup_checkpoint_save_path"]
     )
+    agent = FinMemAgent.load_checkpoint(path=os.path.join(checkpoint_path, "agent"))
+    env = MarketEnv.load_checkpoint(path=os.path.join(checkpoint_path, "env"))
 
     # env + agent loop
     total_steps = env.simulation_length
@@ -270,15 +348,12 @@ def warmup_checkpoint_func(
             )
 
             # save checkpoint
-            agent.save_checkpoint(
-                path=os.path.join(
-                    config["meta_config"]["warmup_checkpoint_save_path"], "agent"
-                )
-            )
-            env.save_checkpoint(
-                path=os.path.join(
-                    config["meta_config"]["warmup_checkpoint_save_path"], "env"
-                )
+            save_step_checkpoint(
+                agent=agent,
+                env=env,
+                cur_date=obs.cur_date,  # type: ignore
+                checkpoint_policy=checkpoint_policy,
+                checkpoint_writer=checkpoint_writer,
             )
 
             # request time sleep
@@ -291,6 +366,10 @@ def warmup_checkpoint_func(
                 advance=1,
                 description=f"Warmup remaining steps: {task.remaining}",
             )
+    # wait for pending checkpoints
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+
     # save warmup results
     agent.save_checkpoint(
         path=os.path.join(config["meta_config"]["warmup_output_save_path"], "agent")
@@ -299,6 +378,9 @@ def warmup_checkpoint_func(
         path=os.path.join(config["meta_config"]["warmup_output_save_path"], "env")
     )
 
+    # close the embedding client
+    agent.close()
+
 
 @app.command(name="test")
 def test_func(
@@ -334,6 +416,12 @@ def test_func(
             ],
         )
 
+    # checkpoint writer and policy
+    checkpoint_writer = get_checkpoint_writer(config=config)
+    checkpoint_policy = get_checkpoint_policy(
+        config=config, path=config["meta_config"]["test_checkpoint_save_path"]
+    )
+
     # log
     logger.info("SYS-test function started")
     logger.info(f"CONFIG-Config path: {config_path}")
@@ -395,15 +483,12 @@ def test_func(
             agent.step(market_info=obs, run_mode=RunMode.TEST, task_type=task_type)
 
             # save checkpoint
-            agent.save_checkpoint(
-                path=os.path.join(
-                    config["meta_config"]["test_checkpoint_save_path"], "agent"
-                )
-            )
-            env.save_checkpoint(
-                path=os.path.join(
-                    config["meta_config"]["test_checkpoint_save_path"], "env"
-                )
+            save_step_checkpoint(
+                agent=agent,
+                env=env,
+                cur_date=obs.cur_date,  # type: ignore
+                checkpoint_policy=checkpoint_policy,
+                checkpoint_writer=checkpoint_writer,
             )
 
             # request time sleep
@@ -416,6 +501,10 @@ def test_func(
                 advance=1,
                 description=f"Warmup remaining steps: {task.remaining}",
             )
+    # wait for pending checkpoints
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+
     # save results
     agent.save_checkpoint(
         path=os.path.join(config["meta_config"]["test_output_save_path"], "agent")
@@ -429,6 +518,9 @@ def test_func(
         path=os.path.join(config["meta_config"]["result_save_path"], "agent")
     )
 
+    # close the embedding client
+    agent.close()
+
 
 @app.command(name="test-checkpoint")
 def test_checkpoint_func(
@@ -456,12 +548,11 @@ def test_checkpoint_func(
     logger.add(sys.stdout, level="INFO", format="{time} {level} {message}")
 
     # load env and agent
-    agent = FinMemAgent.load_checkpoint(
-        path=os.path.join(config["meta_config"]["test_checkpoint_save_path"], "agent"),
-    )
-    env = MarketEnv.load_checkpoint(
-        path=os.path.join(config["meta_config"]["test_checkpoint_save_path"], "env"),
+    checkpoint_path = get_latest_checkpoint_path(
+        path=config["meta_config"]["test_checkpoint_save_path"]
     )
+    agent = FinMemAgent.load_checkpoint(path=os.path.join(checkpoint_path, "agent"))
+    env = MarketEnv.load_checkpoint(path=os.path.join(checkpoint_path, "env"))
 
     # chat request sleep
     if "chat_request_sleep" in config["chat_config"]:
@@ -472,6 +563,12 @@ def test_checkpoint_func(
             ],
         )
 
+    # checkpoint writer and policy
+    checkpoint_writer = get_checkpoint_writer(config=config)
+    checkpoint_policy = get_checkpoint_policy(
+        config=config, path=config["meta_config"]["test_checkpoint_save_path"]
+    )
+
     logger.info("SYS-test checkpoint function started")
     logger.info(f"CONFIG-Config path: {config_path}")
     logger.info(f"CONFIG-Config: {config}")
@@ -513,15 +610,12 @@ def test_checkpoint_func(
             )
 
             # save checkpoint
-            agent.save_checkpoint(
-                path=os.path.join(
-                    config["meta_config"]["test_checkpoint_save_path"], "agent"
-                )
-            )
-            env.save_checkpoint(
-                path=os.path.join(
-                    config["meta_config"]["test_checkpoint_save_path"], "env"
-                )
+            save_step_checkpoint(
+                agent=agent,
+                env=env,
+                cur_date=obs.cur_date,  # type: ignore
+                checkpoint_policy=checkpoint_policy,
+                checkpoint_writer=checkpoint_writer,
             )
 
             # request time sleep
@@ -534,6 +628,10 @@ def test_checkpoint_func(
                 advance=1,
                 description=f"Warmup remaining steps: {task.remaining}",
             )
+    # wait for pending checkpoints
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+
     # save results
     agent.save_checkpoint(
         path=os.path.join(config["meta_config"]["test_output_save_path"], "agent")
@@ -547,6 +645,56 @@ def test_checkpoint_func(
         path=os.path.join(config["meta_config"]["result_save_path"], "agent")
     )
 
+    # close the embedding client
+    agent.close()
+
+
+@app.command(name="embed-corpus")
+def embed_corpus_func(
+    config_path: str = typer.Option(
+        os.path.join("configs", "main.json"), "--config-path", "-c"
+    ),
+    batch_size: int = typer.Option(256, "--batch-size", "-b"),
+    num_workers: int = typer.Option(8, "--num-workers", "-w"),
+):
+    # load config
+    config = load_config(path=config_path)
+    if not config["emb_config"].get("embedding_cache_path"):
+        raise ValueError("embedding_cache_path must be set to precompute the corpus")
+    if config["emb_config"].get("emb_backend", "openai") != "openai":
+        raise ValueError("Only embeddings of the OpenAI api are precomputed")
+
+    # log
+    logger.info("SYS-Embed corpus function started")
+    logger.info(f"CONFIG-Config path: {config_path}")
+
+    # collect the news of the whole warmup + test window, deduplicated
+    start_date = config["env_config"]["warmup_start_time"]
+    end_date = config["env_config"]["test_end_time"]
+    news_texts = {}
+    for symbol, data_path in config["env_config"]["env_data_path"].items():
+        with open(data_path, "rb") as f:
+            env_data = orjson.loads(f.read())
+        for cur_date, cur_data in env_data.items():
+            if start_date <= cur_date <= end_date and cur_data.get("news"):
+                news_texts.update(dict.fromkeys(cur_data["news"]))
+        logger.info(f"SYS-Collected news for {symbol}, total texts: {len(news_texts)}")
+
+    # embed
+    emb_model = OpenAIEmbedding(emb_config=config["emb_config"])
+    with progress.Progress() as progress_bar:
+        task_id = progress_bar.add_task("Embedding corpus", total=len(news_texts))
+        num_embedded = emb_model.fill_cache(
+            texts=list(news_texts),
+            batch_size=batch_size,
+            num_workers=num_workers,
+            progress_callback=lambda n: progress_bar.update(task_id, advance=n),
+        )
+    emb_model.close()
+    logger.info(
+        f"SYS-Embedded {num_embedded} new texts into {config['emb_config']['embedding_cache_path']}"
+    )
+
 
 @app.command(name="eval")
 def eval_func(
@@ -0,0 +1,101 @@
+"""Measure the throughput of the local CPU embedding backend.
+
+Embeds news of the data files with ``ONNXEmbedding`` for each thread count
+and batch size and reports texts per second after one warm-up batch. The
+model is any sentence encoder with an ONNX export, by default the
+all-MiniLM-L6-v2 entry of ``configs/embedding.pkl``.
+
+    python -m scripts.bench_local_embedding --threads 1,2,4,8 --batch-sizes 16,32,64
+    python -m scripts.bench_local_embedding --model-path BAAI/bge-small-en-v1.5 \\
+        --pooling cls --max-length 512
+"""
+
+import glob
+import os
+import time
+from typing import List
+
+import orjson
+import typer
+from loguru import logger
+from rich.console import Console
+from rich.table import Table
+
+from src import ONNXEmbedding
+
+app = typer.Typer()
+
+
+def load_news(data_glob: str, num_texts: int) -> List[str]:
+    texts = {}
+    for data_path in sorted(glob.glob(data_glob)):
+        with open(data_path, "rb") as f:
+            env_data = orjson.loads(f.read())
+        for cur_data in env_data.values():
+            texts.update(dict.fromkeys(cur_data.get("news") or []))
+            if len(texts) >= num_texts:
+                return list(texts)[:num_texts]
+    return list(texts)
+
+
+@app.command()
+def main(
+    model_path: str = typer.Option(
+        "sentence-transformers/all-MiniLM-L6-v2", "--model-path"
+    ),
+    onnx_file: str = typer.Option("onnx/model.onnx", "--onnx-file"),
+    emb_size: int = typer.Option(384, "--emb-size"),
+    pooling: str = typer.Option("mean", "--pooling"),
+    max_length: int = typer.Option(256, "--max-length"),
+    threads: str = typer.Option("1,2,4", "--threads"),
+    batch_sizes: str = typer.Option("16,32,64", "--batch-sizes"),
+    num_texts: int = typer.Option(1000, "--num-texts", "-n"),
+    data_glob: str = typer.Option(os.path.join("data", "*.json"), "--data"),
+):
+    logger.remove()
+    texts = load_news(data_glob=data_glob, num_texts=num_texts)
+    if not texts:
+        raise typer.BadParameter(f"No news found in {data_glob}")
+
+    table = Table(
+        title=f"{model_path}, {len(texts)} news, "
+        f"{sum(len(t) for t in texts) / len(texts):.0f} characters on average"
+    )
+    table.add_column("threads", justify="right")
+    table.add_column("batch size", justify="right")
+    table.add_column("load s", justify="right")
+    table.add_column("texts per s", justify="right")
+    table.add_column("ms per text", justify="right")
+    for num_threads in [int(t) for t in threads.split(",")]:
+        for batch_size in [int(b) for b in batch_sizes.split(",")]:
+            start = time.perf_counter()
+            emb_model = ONNXEmbedding(
+                emb_config={
+                    "emb_model_name": os.path.basename(model_path),
+                    "emb_backend": "onnx",
+                    "emb_model_path": model_path,
+                    "emb_onnx_file": onnx_file,
+                    "emb_size": emb_size,
+                    "emb_pooling": pooling,
+                    "emb_max_length": max_length,
+                    "embedding_num_threads": num_threads,
+                    "embedding_local_batch_size": batch_size,
+                }
+            )
+            load_time = time.perf_counter() - start
+            emb_model(texts[:batch_size])
+            start = time.perf_counter()
+            emb_model(texts)
+            elapsed = time.perf_counter() - start
+            table.add_row(
+                str(num_threads),
+                str(batch_size),
+                f"{load_time:.2f}",
+                f"{len(texts) / elapsed:.1f}",
+                f"{elapsed / len(texts) * 1000:.2f}",
+            )
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,291 @@
+"""Benchmark MemoryDB operations across Qdrant deployments.
+
+Replays a synthetic warmup (news added to the short layer, a query of every
+layer per symbol, access feedback, decay, clean up and memory flow) against
+each mode and reports the time spent per operation. Embeddings are random
+vectors derived from the text, so no embedding API is called.
+
+    python -m scripts.bench_memory_db --modes server,memory,disk
+    python -m scripts.bench_memory_db --modes server,grpc --max-keepalive 16
+"""
+
+import hashlib
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import orjson
+import typer
+from loguru import logger
+from rich.console import Console
+from rich.table import Table
+
+# embeddings are generated locally, the key is never used
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+from src import (  # noqa: E402
+    AccessFeedback,
+    AccessSingle,
+    ConstantAccessCounterUpdateFunction,
+    ConstantImportanceInitialization,
+    ConstantRecencyInitialization,
+    ImportanceDecay,
+    LinearCompoundScore,
+    MemoryDBBase,
+    Queries,
+    QuerySingle,
+    RecencyDecay,
+    construct_memory_db,
+)
+from src.embedding import EmbeddingModel  # noqa: E402
+
+app = typer.Typer()
+
+MEMORY_LAYERS = ["short", "mid", "long", "reflection"]
+OPERATIONS = ["add", "query", "feedback", "decay", "clean_up", "memory_flow"]
+
+
+class RandomEmbedding(EmbeddingModel):
+    def __init__(self, config: Dict[str, Any]) -> None:
+        self.emb_size = config["emb_size"]
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        return np.array(
+            [
+                np.random.default_rng(
+                    int.from_bytes(
+                        hashlib.sha256(t.encode("utf-8")).digest()[:8], "big"
+                    )
+                ).standard_normal(self.emb_size, dtype=np.float32)
+                for t in texts
+            ],
+            dtype=np.float32,
+        ).reshape(len(texts), self.emb_size)
+
+
+def get_mode_config(
+    mode: str,
+    memory_db_config: Dict[str, Any],
+    endpoint: str,
+    tmp_path: str,
+    server_options: Dict[str, Any],
+) -> Dict[str, Any]:
+    memory_db_config = dict(memory_db_config, memory_db_backend="qdrant")
+    # server modes talk to the same Qdrant, over REST or gRPC
+    if mode == "server":
+        return dict(
+            memory_db_config,
+            memory_db_endpoint=endpoint,
+            memory_db_prefer_grpc=False,
+            **server_options,
+        )
+    if mode == "grpc":
+        return dict(
+            memory_db_config,
+            memory_db_endpoint=endpoint,
+            memory_db_prefer_grpc=True,
+            **server_options,
+        )
+    if mode == "memory":
+        return dict(memory_db_config, memory_db_local_path=":memory:")
+    if mode == "disk":
+        return dict(memory_db_config, memory_db_local_path=tmp_path)
+    raise ValueError(f"Unknown mode {mode}")
+
+
+def run_workload(
+    memory_db: MemoryDBBase,
+    memory_db_config: Dict[str, Any],
+    symbols: List[str],
+    steps: int,
+    news_per_step: int,
+    top_k: int,
+    seed: int,
+) -> Dict[str, float]:
+    rng = random.Random(seed)
+    timings: Dict[str, float] = defaultdict(float)
+    queries = Queries(
+        query_records=[
+            QuerySingle(query_text=f"character {s}", k=top_k, symbol=s) for s in symbols
+        ]
+    )
+    query_vectors = memory_db.emb_model([q.query_text for q in queries.query_records])
+    compound_score = LinearCompoundScore(
+        upper_bound=memory_db_config["memory_importance_upper_bound"]
+    )
+    access_update = ConstantAccessCounterUpdateFunction(
+        update_step=memory_db_config["memory_importance_score_update_step"]
+    )
+    jump_threshold_dict = {
+        "short": {"upper": memory_db_config["short"]["jump_upper_threshold"]},
+        "mid": {
+            "upper": memory_db_config["mid"]["jump_upper_threshold"],
+            "lower": memory_db_config["mid"]["jump_lower_threshold"],
+        },
+        "long": {"lower": memory_db_config["long"]["jump_lower_threshold"]},
+    }
+    next_id = 0
+    for step in range(steps):
+        cur_date = date(2020, 1, 1) + timedelta(days=step)
+        memories = []
+        for symbol in symbols:
+            for i in range(news_per_step):
+                memories.append(
+                    {
+                        "id": next_id,
+                        "symbol": symbol,
+                        "date": cur_date,
+                        "text": f"{symbol} news {step} {i} {rng.random()}",
+                    }
+                )
+                next_id += 1
+        start = time.perf_counter()
+        memory_db.add_memory(
+            memory_input=memories,
+            layer="short",
+            importance_init_func=ConstantImportanceInitialization(
+                init_val=memory_db_config["short"]["importance_init_val"]
+            ),
+            recency_init_func=ConstantRecencyInitialization(),
+        )
+        timings["add"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        queried = memory_db.query_layers(
+            query_input=queries,
+            layers=MEMORY_LAYERS,
+            linear_compound_func=compound_score,
+            query_vectors=query_vectors,
+        )
+        timings["query"] += time.perf_counter() - start
+
+        queried_ids = sorted(
+            {i for layer in MEMORY_LAYERS for _, ids in queried[layer] for i in ids}
+        )
+        feedback = AccessFeedback(
+            access_counter_records=[
+                AccessSingle(id=i, feedback=rng.choice([1, -1]))
+                for i in rng.sample(queried_ids, min(len(queried_ids), 2 * top_k))
+            ]
+        )
+        start = time.perf_counter()
+        memory_db.update_access_counter_with_feedback(
+            access_feedback=feedback, access_counter_update_func=access_update
+        )
+        timings["feedback"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for layer in MEMORY_LAYERS:
+            memory_db.decay(
+                importance_decay_func=ImportanceDecay(
+                    decay_rate=memory_db_config[layer]["decay_importance_factor"]
+                ),
+                recency_decay_func=RecencyDecay(
+                    recency_factor=memory_db_config[layer]["decay_recency_factor"]
+                ),
+                layer=layer,
+            )
+        timings["decay"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for layer in MEMORY_LAYERS:
+            memory_db.clean_up(
+                importance_threshold=memory_db_config[layer][
+                    "clean_up_importance_threshold"
+                ],
+                recency_threshold=memory_db_config[layer]["clean_up_recency_threshold"],
+                layer=layer,
+            )
+        timings["clean_up"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        memory_db.memory_flow(
+            jump_threshold_dict=jump_threshold_dict,
+            mid_recency_init_func=ConstantRecencyInitialization(),
+            long_recency_init_func=ConstantRecencyInitialization(),
+        )
+        timings["memory_flow"] += time.perf_counter() - start
+    return timings
+
+
+@app.command()
+def main(
+    config_path: str = typer.Option(
+        os.path.join("configs", "main.json"), "--config-path", "-c"
+    ),
+    modes: str = typer.Option("server,memory,disk", "--modes", "-m"),
+    endpoint: str = typer.Option("http://localhost:6333", "--endpoint", "-e"),
+    grpc_port: int = typer.Option(6334, "--grpc-port"),
+    timeout: Optional[int] = typer.Option(None, "--timeout"),
+    max_connections: Optional[int] = typer.Option(None, "--max-connections"),
+    max_keepalive: Optional[int] = typer.Option(None, "--max-keepalive"),
+    steps: int = typer.Option(60, "--steps", "-s"),
+    news_per_step: int = typer.Option(10, "--news-per-step", "-n"),
+    emb_size: int = typer.Option(3072, "--emb-size"),
+    seed: int = typer.Option(0, "--seed"),
+):
+    logger.remove()
+    with open(config_path, "rb") as f:
+        config = orjson.loads(f.read())
+    agent_config = config["agent_config"]
+    emb_config = dict(config["emb_config"], emb_size=emb_size)
+    symbols = agent_config["trading_symbols"]
+
+    table = Table(
+        title=f"MemoryDB ms per step, {steps} steps, {news_per_step} news per symbol and step, "
+        f"{len(symbols)} symbols, {emb_size} dims"
+    )
+    table.add_column("mode")
+    for op in OPERATIONS:
+        table.add_column(op, justify="right")
+    table.add_column("total s", justify="right")
+    for mode in modes.split(","):
+        with tempfile.TemporaryDirectory() as tmp_path:
+            memory_db_config = get_mode_config(
+                mode=mode,
+                memory_db_config=agent_config["memory_db_config"],
+                endpoint=endpoint,
+                tmp_path=tmp_path,
+                server_options={
+                    "memory_db_grpc_port": grpc_port,
+                    "memory_db_timeout": timeout,
+                    "memory_db_max_connections": max_connections,
+                    "memory_db_max_keepalive_connections": max_keepalive,
+                },
+            )
+            try:
+                memory_db = construct_memory_db(
+                    agent_config=dict(agent_config, memory_db_config=memory_db_config),
+                    emb_config=emb_config,
+                )
+            except Exception as e:
+                typer.echo(f"Skipping {mode}: {e}")
+                continue
+            memory_db.emb_model = RandomEmbedding(emb_config)
+            timings = run_workload(
+                memory_db=memory_db,
+                memory_db_config=memory_db_config,
+                symbols=symbols,
+                steps=steps,
+                news_per_step=news_per_step,
+                top_k=agent_config["top_k"],
+                seed=seed,
+            )
+            memory_db.connection_client.close()  # type: ignore
+        table.add_row(
+            mode,
+            *[f"{timings[op] / steps * 1000:.2f}" for op in OPERATIONS],
+            f"{sum(timings.values()):.2f}",
+        )
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,185 @@
+"""Benchmark filtered MemoryDB operations with and without payload indexes.
+
+Fills a Qdrant collection with memories spread over the configured symbols
+and all layers, then times the operations that filter on payload fields:
+the symbol and layer filtered search of a query, the same filter in the
+near-duplicate check of reflections, and the importance and recency range
+scans of jumps and clean up (with thresholds that move or delete nothing).
+Payload indexes only exist on a Qdrant server, local mode ignores them.
+
+    python -m scripts.bench_payload_index --sizes 1000,10000,100000
+"""
+
+import os
+import random
+import tempfile
+import time
+from datetime import date
+from typing import Dict, List
+
+import numpy as np
+import orjson
+import typer
+from loguru import logger
+from rich.console import Console
+from rich.table import Table
+
+from scripts.bench_memory_db import MEMORY_LAYERS, RandomEmbedding, get_mode_config
+from src import (
+    ConstantImportanceInitialization,
+    ConstantRecencyInitialization,
+    JumpDirection,
+    LinearCompoundScore,
+    MemoryDBBase,
+    Queries,
+    QuerySingle,
+    construct_memory_db,
+)
+
+app = typer.Typer()
+
+OPERATIONS = ["query", "similar", "jump_scan", "clean_up_scan"]
+
+
+def fill_memories(
+    memory_db: MemoryDBBase, symbols: List[str], size: int, batch_size: int, seed: int
+) -> float:
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for offset in range(0, size, batch_size):
+        cur_layer = MEMORY_LAYERS[(offset // batch_size) % len(MEMORY_LAYERS)]
+        memory_db.add_memory(
+            memory_input=[
+                {
+                    "id": i,
+                    "symbol": symbols[i % len(symbols)],
+                    "date": date(2020, 1, 1),
+                    "text": f"memory {i} {seed}",
+                }
+                for i in range(offset, min(offset + batch_size, size))
+            ],
+            layer=cur_layer,
+            importance_init_func=ConstantImportanceInitialization(
+                init_val=rng.uniform(10.0, 90.0)
+            ),
+            recency_init_func=ConstantRecencyInitialization(),
+        )
+    return time.perf_counter() - start
+
+
+def time_operations(
+    memory_db: MemoryDBBase, symbols: List[str], top_k: int, repeats: int
+) -> Dict[str, float]:
+    timings = {op: [] for op in OPERATIONS}
+    queries = Queries(
+        query_records=[
+            QuerySingle(query_text=f"character {s}", k=top_k, symbol=s) for s in symbols
+        ]
+    )
+    query_vectors = memory_db.emb_model([q.query_text for q in queries.query_records])
+    compound_score = LinearCompoundScore(upper_bound=100.0)
+    for _ in range(repeats):
+        start = time.perf_counter()
+        memory_db.query_layers(
+            query_input=queries,
+            layers=MEMORY_LAYERS,
+            linear_compound_func=compound_score,
+            query_vectors=query_vectors,
+        )
+        timings["query"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        memory_db._get_most_similar_score_in_layer(  # type: ignore
+            layer="reflection", embs=query_vectors, symbols=symbols
+        )
+        timings["similar"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for layer in ["short", "mid"]:
+            memory_db.prepare_jump(
+                jump_direction=JumpDirection.UP, layer=layer, threshold=1e9
+            )
+        for layer in ["mid", "long"]:
+            memory_db.prepare_jump(
+                jump_direction=JumpDirection.DOWN, layer=layer, threshold=1e-9
+            )
+        timings["jump_scan"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for layer in MEMORY_LAYERS:
+            memory_db.clean_up(
+                importance_threshold=1e-9, recency_threshold=1e-9, layer=layer
+            )
+        timings["clean_up_scan"].append(time.perf_counter() - start)
+    return {op: float(np.median(t)) for op, t in timings.items()}
+
+
+@app.command()
+def main(
+    config_path: str = typer.Option(
+        os.path.join("configs", "main.json"), "--config-path", "-c"
+    ),
+    sizes: str = typer.Option("1000,10000,100000", "--sizes"),
+    mode: str = typer.Option("server", "--mode", "-m"),
+    endpoint: str = typer.Option("http://localhost:6333", "--endpoint", "-e"),
+    emb_size: int = typer.Option(256, "--emb-size"),
+    batch_size: int = typer.Option(1000, "--batch-size"),
+    repeats: int = typer.Option(20, "--repeats", "-r"),
+    seed: int = typer.Option(0, "--seed"),
+):
+    logger.remove()
+    with open(config_path, "rb") as f:
+        config = orjson.loads(f.read())
+    agent_config = config["agent_config"]
+    emb_config = dict(config["emb_config"], emb_size=emb_size)
+    symbols = agent_config["trading_symbols"]
+
+    table = Table(title=f"Median ms per call, {mode} mode, {emb_size} dims")
+    table.add_column("memories", justify="right")
+    table.add_column("index")
+    table.add_column("fill s", justify="right")
+    for op in OPERATIONS:
+        table.add_column(op, justify="right")
+    for size in [int(s) for s in sizes.split(",")]:
+        for payload_index in [False, True]:
+            with tempfile.TemporaryDirectory() as tmp_path:
+                memory_db_config = dict(
+                    get_mode_config(
+                        mode=mode,
+                        memory_db_config=agent_config["memory_db_config"],
+                        endpoint=endpoint,
+                        tmp_path=tmp_path,
+                        server_options={},
+                    ),
+                    memory_db_payload_index=payload_index,
+                )
+                memory_db = construct_memory_db(
+                    agent_config=dict(agent_config, memory_db_config=memory_db_config),
+                    emb_config=emb_config,
+                )
+                memory_db.emb_model = RandomEmbedding(emb_config)
+                fill_time = fill_memories(
+                    memory_db=memory_db,
+                    symbols=symbols,
+                    size=size,
+                    batch_size=batch_size,
+                    seed=seed,
+                )
+                timings = time_operations(
+                    memory_db=memory_db,
+                    symbols=symbols,
+                    top_k=agent_config["top_k"],
+                    repeats=repeats,
+                )
+                memory_db.connection_client.close()  # type: ignore
+            table.add_row(
+                str(size),
+                "yes" if payload_index else "no",
+                f"{fill_time:.2f}",
+                *[f"{timings[op] * 1000:.2f}" for op in OPERATIONS],
+            )
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    app()
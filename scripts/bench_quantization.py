@@ -0,0 +1,224 @@
+"""Measure recall and latency of quantized memory vectors.
+
+Fills one collection per quantization setting with the same memories, runs
+the same queries through ``query_layers`` and compares the returned ids with
+the ones of an unquantized collection using exact search. The checkpoint
+dtypes are compared the same way, by querying a reloaded checkpoint of the
+exact collection. Quantization only exists on a Qdrant server, local mode
+ignores it. Vectors are random, so recall on real embeddings may differ.
+
+    python -m scripts.bench_quantization --size 20000 --emb-size 3072
+"""
+
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import orjson
+import typer
+from loguru import logger
+from rich.console import Console
+from rich.table import Table
+
+from scripts.bench_memory_db import MEMORY_LAYERS, RandomEmbedding, get_mode_config
+from scripts.bench_payload_index import fill_memories
+from src import (
+    LinearCompoundScore,
+    MemoryDBBase,
+    Queries,
+    QuerySingle,
+    construct_memory_db,
+    load_memory_db_checkpoint,
+)
+
+app = typer.Typer()
+
+# (quantization, rescore)
+QUANTIZATION_SETTINGS = [
+    ("none", True),
+    ("int8", False),
+    ("int8", True),
+    ("binary", False),
+    ("binary", True),
+]
+CHECKPOINT_DTYPES = ["float32", "float16", "int8"]
+
+
+def run_queries(
+    memory_db: MemoryDBBase, symbols: List[str], top_k: int, num_queries: int
+) -> Tuple[List[List[int]], float]:
+    compound_score = LinearCompoundScore(upper_bound=100.0)
+    emb_model = RandomEmbedding(memory_db.emb_config)
+    results = []
+    elapsed = 0.0
+    for i in range(num_queries):
+        queries = Queries(
+            query_records=[
+                QuerySingle(query_text=f"query {i} {s}", k=top_k, symbol=s)
+                for s in symbols
+            ]
+        )
+        query_vectors = emb_model([q.query_text for q in queries.query_records])
+        start = time.perf_counter()
+        queried = memory_db.query_layers(
+            query_input=queries,
+            layers=MEMORY_LAYERS,
+            linear_compound_func=compound_score,
+            query_vectors=query_vectors,
+        )
+        elapsed += time.perf_counter() - start
+        results += [ids for layer in MEMORY_LAYERS for _, ids in queried[layer]]
+    return results, elapsed / num_queries
+
+
+def get_recall(results: List[List[int]], exact_results: List[List[int]]) -> float:
+    hits = sum(len(set(r) & set(e)) for r, e in zip(results, exact_results))
+    return hits / max(sum(len(e) for e in exact_results), 1)
+
+
+def make_memory_db(
+    agent_config: Dict[str, Any],
+    emb_config: Dict[str, Any],
+    memory_db_config: Dict[str, Any],
+    name: str,
+) -> MemoryDBBase:
+    memory_db = construct_memory_db(
+        agent_config=dict(
+            agent_config,
+            agent_name=f"{agent_config['agent_name']}_{name}",
+            memory_db_config=memory_db_config,
+        ),
+        emb_config=emb_config,
+    )
+    memory_db.emb_model = RandomEmbedding(emb_config)
+    return memory_db
+
+
+@app.command()
+def main(
+    config_path: str = typer.Option(
+        os.path.join("configs", "main.json"), "--config-path", "-c"
+    ),
+    mode: str = typer.Option("server", "--mode", "-m"),
+    endpoint: str = typer.Option("http://localhost:6333", "--endpoint", "-e"),
+    size: int = typer.Option(20000, "--size"),
+    emb_size: int = typer.Option(3072, "--emb-size"),
+    over_fetch: int = typer.Option(50, "--over-fetch"),
+    oversampling: float = typer.Option(2.0, "--oversampling"),
+    num_queries: int = typer.Option(50, "--num-queries", "-q"),
+    batch_size: int = typer.Option(1000, "--batch-size"),
+    seed: int = typer.Option(0, "--seed"),
+):
+    if mode not in ["server", "memory"]:
+        raise typer.BadParameter("mode should be server or memory")
+    logger.remove()
+    with open(config_path, "rb") as f:
+        config = orjson.loads(f.read())
+    agent_config = config["agent_config"]
+    emb_config = dict(config["emb_config"], emb_size=emb_size)
+    symbols = agent_config["trading_symbols"]
+    top_k = agent_config["top_k"]
+
+    table = Table(
+        title=f"Recall@{top_k} of query_layers against exact search, {size} "
+        f"memories, {emb_size} dims, over-fetch {over_fetch}, {mode} mode"
+    )
+    table.add_column("setting")
+    table.add_column("recall", justify="right")
+    table.add_column("ms per query", justify="right")
+    table.add_column("vector bytes", justify="right")
+    with tempfile.TemporaryDirectory() as tmp_path:
+        base_config = dict(
+            get_mode_config(
+                mode=mode,
+                memory_db_config=agent_config["memory_db_config"],
+                endpoint=endpoint,
+                tmp_path=os.path.join(tmp_path, "qdrant"),
+                server_options={},
+            ),
+            memory_query_over_fetch=over_fetch,
+            memory_db_quantization_oversampling=oversampling,
+            memory_checkpoint_format="binary",
+        )
+        exact_results: List[List[int]] = []
+        exact_memory_db = None
+        for quantization, rescore in QUANTIZATION_SETTINGS:
+            memory_db = make_memory_db(
+                agent_config=agent_config,
+                emb_config=emb_config,
+                memory_db_config=dict(
+                    base_config,
+                    memory_db_quantization=quantization,
+                    memory_db_quantization_rescore=rescore,
+                ),
+                name=f"{quantization}_{rescore}",
+            )
+            fill_memories(
+                memory_db=memory_db,
+                symbols=symbols,
+                size=size,
+                batch_size=batch_size,
+                seed=seed,
+            )
+            results, latency = run_queries(
+                memory_db=memory_db,
+                symbols=symbols,
+                top_k=top_k,
+                num_queries=num_queries,
+            )
+            if quantization == "none":
+                exact_results, exact_memory_db = results, memory_db
+            else:
+                memory_db.connection_client.delete_collection(  # type: ignore
+                    collection_name=memory_db.agent_config["agent_name"]
+                )
+                memory_db.connection_client.close()  # type: ignore
+            bytes_per_vector = {"none": 4 * emb_size, "int8": emb_size}.get(
+                quantization, emb_size // 8
+            )
+            table.add_row(
+                f"collection {quantization}"
+                + ("" if quantization == "none" else f", rescore {rescore}"),
+                f"{get_recall(results, exact_results):.4f}",
+                f"{latency * 1000:.2f}",
+                str(bytes_per_vector * size),
+            )
+
+        # checkpoints of the exact collection, all saved before the first
+        # reload replaces the collection, then queried after a reload
+        for checkpoint_dtype in CHECKPOINT_DTYPES:
+            exact_memory_db.memory_config["memory_checkpoint_dtype"] = checkpoint_dtype  # type: ignore
+            exact_memory_db.save_checkpoint(  # type: ignore
+                os.path.join(tmp_path, checkpoint_dtype)
+            )
+        exact_memory_db.connection_client.close()  # type: ignore
+        for checkpoint_dtype in CHECKPOINT_DTYPES:
+            checkpoint_path = os.path.join(tmp_path, checkpoint_dtype)
+            vector_bytes = sum(
+                os.path.getsize(os.path.join(checkpoint_path, "brain", f))
+                for f in ["vectors.npy", "vector_scales.npy"]
+                if os.path.exists(os.path.join(checkpoint_path, "brain", f))
+            )
+            memory_db = load_memory_db_checkpoint(checkpoint_path)
+            results, latency = run_queries(
+                memory_db=memory_db,
+                symbols=symbols,
+                top_k=top_k,
+                num_queries=num_queries,
+            )
+            table.add_row(
+                f"checkpoint {checkpoint_dtype}",
+                f"{get_recall(results, exact_results):.4f}",
+                f"{latency * 1000:.2f}",
+                str(vector_bytes),
+            )
+            memory_db.connection_client.delete_collection(  # type: ignore
+                collection_name=memory_db.agent_config["agent_name"]
+            )
+            memory_db.connection_client.close()  # type: ignore
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,153 @@
+"""Check that memory checkpoints load back the memories they were saved from.
+
+Builds a memory state with the random workload of
+``scripts.check_memory_db_equivalence``, saves it in every checkpoint format
+and dtype and loads it again. The payloads have to load back equal and the
+vectors unit length and within the rounding error of the checkpoint dtype
+(Qdrant normalizes vectors again when they are loaded, so even float32
+vectors can differ in the last bit). The exit status is 1 on a mismatch.
+
+Qdrant runs embedded, in memory or, with the "disk" mode, in a directory.
+As in FinMemAgent.load_checkpoint, a new memory DB of the same config is
+opened and closed before each checkpoint is loaded, so a directory that is
+still held by another client fails the check.
+
+    python -m scripts.check_checkpoint_round_trip --backends qdrant,numpy --modes memory,disk
+"""
+
+import os
+import tempfile
+from typing import Any, Dict, List
+
+import numpy as np
+import orjson
+import typer
+from loguru import logger
+
+from scripts.bench_memory_db import RandomEmbedding
+from scripts.check_memory_db_equivalence import run_workload
+from src import MemoryDBBase, construct_memory_db, load_memory_db_checkpoint
+
+app = typer.Typer()
+
+# (format, dtype, largest difference of a vector component after loading)
+CHECKPOINT_SETTINGS = [
+    ("json", "float32", 1e-6),
+    ("binary", "float32", 1e-6),
+    ("binary", "float16", 1e-3),
+    ("binary", "int8", 1e-2),
+]
+
+
+def check_round_trip(
+    records: List[Dict[str, Any]],
+    loaded_memory_db: MemoryDBBase,
+    max_vector_diff: float,
+) -> List[str]:
+    mismatches = []
+    loaded_records = sorted(loaded_memory_db._get_record_dict(), key=lambda r: r["id"])  # type: ignore
+    if [(r["id"], r["payload"]) for r in records] != [
+        (r["id"], r["payload"]) for r in loaded_records
+    ]:
+        mismatches.append("loaded payloads differ")
+    if records and len(records) == len(loaded_records):
+        vectors = np.asarray([r["vector"] for r in records])
+        loaded_vectors = np.asarray([r["vector"] for r in loaded_records])
+        norm_error = np.abs(np.linalg.norm(loaded_vectors, axis=1) - 1.0).max()
+        if norm_error > 1e-5:
+            mismatches.append(f"loaded vector norms off by up to {norm_error:.2e}")
+        vector_diff = np.abs(loaded_vectors - vectors).max()
+        if vector_diff > max_vector_diff:
+            mismatches.append(f"loaded vectors differ by up to {vector_diff:.2e}")
+    return mismatches
+
+
+@app.command()
+def main(
+    config_path: str = typer.Option(
+        os.path.join("configs", "main.json"), "--config-path", "-c"
+    ),
+    backends: str = typer.Option("qdrant,numpy", "--backends", "-b"),
+    modes: str = typer.Option("memory,disk", "--modes", "-m"),
+    steps: int = typer.Option(30, "--steps", "-s"),
+    emb_size: int = typer.Option(64, "--emb-size"),
+    seed: int = typer.Option(0, "--seed"),
+):
+    logger.remove()
+    with open(config_path, "rb") as f:
+        config = orjson.loads(f.read())
+    agent_config = config["agent_config"]
+    emb_config = dict(config["emb_config"], emb_size=emb_size)
+
+    failed = False
+    for backend in backends.split(","):
+        # the numpy backend keeps its memories in process in either mode
+        for mode in modes.split(",") if backend == "qdrant" else ["memory"]:
+            with tempfile.TemporaryDirectory() as tmp_path:
+                memory_db_config: Dict[str, Any] = dict(
+                    agent_config["memory_db_config"],
+                    memory_db_backend=backend,
+                    memory_db_local_path=(
+                        os.path.join(tmp_path, "qdrant")
+                        if mode == "disk"
+                        else ":memory:"
+                    ),
+                )
+                cur_agent_config = dict(agent_config, memory_db_config=memory_db_config)
+                memory_db = construct_memory_db(
+                    agent_config=cur_agent_config, emb_config=emb_config
+                )
+                memory_db.emb_model = RandomEmbedding(emb_config)
+                run_workload(
+                    memory_db=memory_db,
+                    memory_db_config=memory_db_config,
+                    symbols=agent_config["trading_symbols"],
+                    steps=steps,
+                    news_per_step=6,
+                    top_k=agent_config["top_k"],
+                    seed=seed,
+                    tolerance=1e-5,
+                )
+                records = sorted(memory_db._get_record_dict(), key=lambda r: r["id"])  # type: ignore
+                for checkpoint_format, checkpoint_dtype, _ in CHECKPOINT_SETTINGS:
+                    memory_db.memory_config["memory_checkpoint_format"] = (
+                        checkpoint_format
+                    )
+                    memory_db.memory_config["memory_checkpoint_dtype"] = (
+                        checkpoint_dtype
+                    )
+                    memory_db.save_checkpoint(
+                        os.path.join(
+                            tmp_path, f"{checkpoint_format}-{checkpoint_dtype}"
+                        )
+                    )
+                memory_db.close()
+
+                for (
+                    checkpoint_format,
+                    checkpoint_dtype,
+                    max_vector_diff,
+                ) in CHECKPOINT_SETTINGS:
+                    construct_memory_db(
+                        agent_config=cur_agent_config, emb_config=emb_config
+                    ).close()
+                    loaded_memory_db = load_memory_db_checkpoint(
+                        os.path.join(
+                            tmp_path, f"{checkpoint_format}-{checkpoint_dtype}"
+                        )
+                    )
+                    mismatches = check_round_trip(
+                        records, loaded_memory_db, max_vector_diff
+                    )
+                    loaded_memory_db.close()
+                    setting = f"{backend} {mode} {checkpoint_format} {checkpoint_dtype}"
+                    if mismatches:
+                        failed = True
+                        typer.echo(f"{setting}: {', '.join(mismatches)}")
+                    else:
+                        typer.echo(f"{setting}: round trip ok")
+    raise typer.Exit(code=1 if failed else 0)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,382 @@
+"""Check the MemoryDB backends against the eager memory semantics.
+
+Before decay became lazy, every decay step rewrote the delta, importance and
+recency of each memory, a memory that jumped up got a new recency, and one
+that jumped down kept its recency until the next decay of its new layer.
+This replays a random workload (news and reflections added, a query of every
+layer per symbol, access feedback, decay, clean up and memory flow) against
+each backend and against a small reference that applies those updates
+eagerly, and compares query results (ties in compound score may come in any
+order) and stored records after every step. The exit status is 1 on the
+first mismatch.
+
+    python -m scripts.check_memory_db_equivalence --backends qdrant,numpy --seeds 0,1,2
+"""
+
+import os
+import random
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import orjson
+import typer
+from loguru import logger
+
+from scripts.bench_memory_db import MEMORY_LAYERS, RandomEmbedding
+from src import (
+    AccessFeedback,
+    AccessSingle,
+    ConstantAccessCounterUpdateFunction,
+    ConstantImportanceInitialization,
+    ConstantRecencyInitialization,
+    ImportanceDecay,
+    LinearCompoundScore,
+    MemoryDBBase,
+    Queries,
+    QuerySingle,
+    RecencyDecay,
+    construct_memory_db,
+)
+
+app = typer.Typer()
+
+
+class ReferenceMemoryDB:
+    def __init__(self, memory_db_config: Dict[str, Any]) -> None:
+        self.memory_db_config = memory_db_config
+        self.records: Dict[int, Dict[str, Any]] = {}
+
+    def _layer_records(self, layer: str, symbol: Optional[str] = None) -> List[int]:
+        return [
+            i
+            for i, r in self.records.items()
+            if r["layer"] == layer and (symbol is None or r["symbol"] == symbol)
+        ]
+
+    def _similarity(self, ids: List[int], vector: np.ndarray) -> np.ndarray:
+        if not ids:
+            return np.empty(0)
+        return np.array([self.records[i]["vector"] for i in ids]) @ vector
+
+    def add_memory(
+        self,
+        memories: List[Dict[str, Any]],
+        vectors: np.ndarray,
+        layer: str,
+        similarity_threshold: Optional[float] = None,
+    ) -> None:
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        # near duplicates are checked against the layer before the batch
+        most_similar = [
+            self._similarity(self._layer_records(layer, m["symbol"]), v).max(
+                initial=0.0
+            )
+            for m, v in zip(memories, vectors)
+        ]
+        for m, v, s in zip(memories, vectors, most_similar):
+            if similarity_threshold is not None and s >= similarity_threshold:
+                continue
+            self.records[m["id"]] = {
+                "symbol": m["symbol"],
+                "layer": layer,
+                "vector": v,
+                "delta": 0,
+                "importance": self.memory_db_config[layer]["importance_init_val"],
+                "recency": 1.0,
+                "access_counter": 0,
+            }
+
+    def query_scores(
+        self,
+        layer: str,
+        symbol: str,
+        vector: np.ndarray,
+        linear_compound_func: LinearCompoundScore,
+    ) -> Dict[int, float]:
+        ids = self._layer_records(layer, symbol)
+        similarity = self._similarity(ids, vector / np.linalg.norm(vector))
+        return {
+            i: linear_compound_func(
+                similarity_score=s,
+                importance_score=self.records[i]["importance"],
+                recency_score=self.records[i]["recency"],
+            )
+            for i, s in zip(ids, similarity)
+        }
+
+    def feedback(self, record_id: int, direction: int) -> None:
+        update_step = self.memory_db_config["memory_importance_score_update_step"]
+        self.records[record_id]["access_counter"] += direction
+        self.records[record_id]["importance"] += direction * update_step
+
+    def decay(self, layer: str) -> None:
+        layer_config = self.memory_db_config[layer]
+        for i in self._layer_records(layer):
+            r = self.records[i]
+            r["delta"] += 1
+            r["importance"] *= layer_config["decay_importance_factor"]
+            r["recency"] = np.exp(-(r["delta"] / layer_config["decay_recency_factor"]))
+
+    def clean_up(self, layer: str) -> None:
+        layer_config = self.memory_db_config[layer]
+        for i in self._layer_records(layer):
+            r = self.records[i]
+            if (
+                r["importance"] < layer_config["clean_up_importance_threshold"]
+                or r["recency"] < layer_config["clean_up_recency_threshold"]
+            ):
+                del self.records[i]
+
+    def _jump(self, layer: str, target_layer: str, up: bool) -> None:
+        if up:
+            threshold = self.memory_db_config[layer]["jump_upper_threshold"]
+        else:
+            threshold = self.memory_db_config[layer]["jump_lower_threshold"]
+        for i in self._layer_records(layer):
+            r = self.records[i]
+            if up and r["importance"] >= threshold:
+                r.update(layer=target_layer, delta=0, recency=1.0)
+            elif not up and r["importance"] < threshold:
+                r["layer"] = target_layer
+
+    def memory_flow(self) -> None:
+        for _ in range(2):
+            self._jump("short", "mid", up=True)
+            self._jump("mid", "short", up=False)
+            self._jump("mid", "long", up=True)
+            self._jump("long", "mid", up=False)
+
+
+def compare_step(
+    memory_db: MemoryDBBase,
+    reference: ReferenceMemoryDB,
+    queried: Dict[str, List[Any]],
+    query_scores: Dict[str, List[Dict[int, float]]],
+    top_k: int,
+    tolerance: float,
+) -> List[str]:
+    mismatches = []
+    for layer in MEMORY_LAYERS:
+        for (_, ids), scores in zip(queried[layer], query_scores[layer]):
+            expected = sorted(scores.values(), reverse=True)[:top_k]
+            if any(i not in scores for i in ids):
+                mismatches.append(f"query {layer}: ids {ids} not in layer")
+            elif len(ids) != len(expected) or not np.allclose(
+                [scores[i] for i in ids], expected, rtol=0.0, atol=tolerance
+            ):
+                mismatches.append(
+                    f"query {layer}: ids {ids}, scores {[scores[i] for i in ids]}, "
+                    f"expected scores {expected}"
+                )
+    records = {
+        r["id"]: r["payload"] for r in memory_db._get_record_dict(with_vector=False)
+    }
+    if set(records) != set(reference.records):
+        mismatches.append(
+            f"records: missing {sorted(set(reference.records) - set(records))}, "
+            f"unexpected {sorted(set(records) - set(reference.records))}"
+        )
+    for i in sorted(set(records) & set(reference.records)):
+        payload, expected = records[i], reference.records[i]
+        if (
+            payload["layer"] != expected["layer"]
+            or payload["delta"] != expected["delta"]
+            or payload["access_counter"] != expected["access_counter"]
+            or not np.isclose(payload["importance"], expected["importance"])
+            or not np.isclose(payload["recency"], expected["recency"])
+        ):
+            mismatches.append(
+                f"record {i}: {payload}, expected "
+                f"{ {k: v for k, v in expected.items() if k != 'vector'} }"
+            )
+    return mismatches
+
+
+def run_workload(
+    memory_db: MemoryDBBase,
+    memory_db_config: Dict[str, Any],
+    symbols: List[str],
+    steps: int,
+    news_per_step: int,
+    top_k: int,
+    seed: int,
+    tolerance: float,
+) -> List[str]:
+    rng = random.Random(seed)
+    reference = ReferenceMemoryDB(memory_db_config)
+    queries = Queries(
+        query_records=[
+            QuerySingle(query_text=f"news {s}", k=top_k, symbol=s) for s in symbols
+        ]
+    )
+    query_vectors = memory_db.emb_model([q.query_text for q in queries.query_records])
+    compound_score = LinearCompoundScore(
+        upper_bound=memory_db_config["memory_importance_upper_bound"]
+    )
+    jump_threshold_dict = {
+        "short": {"upper": memory_db_config["short"]["jump_upper_threshold"]},
+        "mid": {
+            "upper": memory_db_config["mid"]["jump_upper_threshold"],
+            "lower": memory_db_config["mid"]["jump_lower_threshold"],
+        },
+        "long": {"lower": memory_db_config["long"]["jump_lower_threshold"]},
+    }
+    next_id = 0
+    for step in range(steps):
+        cur_date = date(2020, 1, 1) + timedelta(days=step)
+        # texts repeat, so that queries have ties and reflections near duplicates
+        added = {"short": [], "reflection": []}
+        for _ in range(rng.randint(0, news_per_step)):
+            added["short"].append(
+                {
+                    "id": next_id,
+                    "symbol": rng.choice(symbols),
+                    "date": cur_date,
+                    "text": f"news {rng.randint(0, 5 * news_per_step)}",
+                }
+            )
+            next_id += 1
+        added["reflection"].append(
+            {
+                "id": next_id,
+                "symbol": rng.choice(symbols),
+                "date": cur_date,
+                "text": f"reflection {rng.randint(0, 10)}",
+            }
+        )
+        next_id += 1
+        for layer, memories in added.items():
+            similarity_threshold = memory_db_config[layer].get("similarity_threshold")
+            memory_db.add_memory(
+                memory_input=memories,
+                layer=layer,
+                importance_init_func=ConstantImportanceInitialization(
+                    init_val=memory_db_config[layer]["importance_init_val"]
+                ),
+                recency_init_func=ConstantRecencyInitialization(),
+                similarity_threshold=similarity_threshold,
+            )
+            if memories:
+                reference.add_memory(
+                    memories,
+                    memory_db.emb_model([m["text"] for m in memories]),
+                    layer,
+                    similarity_threshold,
+                )
+
+        queried = memory_db.query_layers(
+            query_input=queries,
+            layers=MEMORY_LAYERS,
+            linear_compound_func=compound_score,
+            query_vectors=query_vectors,
+        )
+        query_scores = {
+            layer: [
+                reference.query_scores(layer, q.symbol, v, compound_score)
+                for q, v in zip(queries.query_records, query_vectors)
+            ]
+            for layer in MEMORY_LAYERS
+        }
+        mismatches = compare_step(
+            memory_db, reference, queried, query_scores, top_k, tolerance
+        )
+        if mismatches:
+            return [f"step {step}: {m}" for m in mismatches]
+
+        feedback = [
+            AccessSingle(id=i, feedback=rng.choice([1, 1, 1, -1]))
+            for i in rng.sample(
+                sorted(reference.records), min(len(reference.records), 2 * top_k)
+            )
+        ]
+        memory_db.update_access_counter_with_feedback(
+            access_feedback=AccessFeedback(access_counter_records=feedback),
+            access_counter_update_func=ConstantAccessCounterUpdateFunction(
+                update_step=memory_db_config["memory_importance_score_update_step"]
+            ),
+        )
+        for f in feedback:
+            reference.feedback(f.id, f.feedback)
+        for layer in MEMORY_LAYERS:
+            memory_db.decay(
+                importance_decay_func=ImportanceDecay(
+                    decay_rate=memory_db_config[layer]["decay_importance_factor"]
+                ),
+                recency_decay_func=RecencyDecay(
+                    recency_factor=memory_db_config[layer]["decay_recency_factor"]
+                ),
+                layer=layer,
+            )
+            reference.decay(layer)
+        for layer in MEMORY_LAYERS:
+            memory_db.clean_up(
+                importance_threshold=memory_db_config[layer][
+                    "clean_up_importance_threshold"
+                ],
+                recency_threshold=memory_db_config[layer]["clean_up_recency_threshold"],
+                layer=layer,
+            )
+            reference.clean_up(layer)
+        memory_db.memory_flow(
+            jump_threshold_dict=jump_threshold_dict,
+            mid_recency_init_func=ConstantRecencyInitialization(),
+            long_recency_init_func=ConstantRecencyInitialization(),
+        )
+        reference.memory_flow()
+    return []
+
+
+@app.command()
+def main(
+    config_path: str = typer.Option(
+        os.path.join("configs", "main.json"), "--config-path", "-c"
+    ),
+    backends: str = typer.Option("qdrant,numpy", "--backends", "-b"),
+    seeds: str = typer.Option("0,1,2", "--seeds"),
+    steps: int = typer.Option(60, "--steps", "-s"),
+    news_per_step: int = typer.Option(6, "--news-per-step", "-n"),
+    emb_size: int = typer.Option(16, "--emb-size"),
+    tolerance: float = typer.Option(1e-5, "--tolerance"),
+):
+    logger.remove()
+    with open(config_path, "rb") as f:
+        config = orjson.loads(f.read())
+    agent_config = config["agent_config"]
+    emb_config = dict(config["emb_config"], emb_size=emb_size)
+
+    failed = False
+    for backend in backends.split(","):
+        memory_db_config = dict(
+            agent_config["memory_db_config"],
+            memory_db_backend=backend,
+            memory_db_local_path=":memory:",
+        )
+        for seed in [int(s) for s in seeds.split(",")]:
+            memory_db = construct_memory_db(
+                agent_config=dict(agent_config, memory_db_config=memory_db_config),
+                emb_config=emb_config,
+            )
+            memory_db.emb_model = RandomEmbedding(emb_config)
+            mismatches = run_workload(
+                memory_db=memory_db,
+                memory_db_config=memory_db_config,
+                symbols=agent_config["trading_symbols"],
+                steps=steps,
+                news_per_step=news_per_step,
+                top_k=agent_config["top_k"],
+                seed=seed,
+                tolerance=tolerance,
+            )
+            if mismatches:
+                failed = True
+                typer.echo(f"{backend} seed {seed}: {len(mismatches)} mismatches")
+                for m in mismatches[:10]:
+                    typer.echo(f"  {m}")
+            else:
+                typer.echo(f"{backend} seed {seed}: {steps} steps match")
+    raise typer.Exit(code=1 if failed else 0)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,160 @@
+"""Compare retrieval at reduced embedding dimensions on a saved run.
+
+Loads the memory checkpoint of a run embedded at full size with a
+text-embedding-3 model and replays the run's queries (the character string
+of every symbol, over all layers) at each dimension. text-embedding-3
+vectors shortened with the ``dimensions`` parameter equal the full vectors
+cut to their first entries and normalized again, so the memories do not need
+to be embedded again. Reports the overlap of the top k with the full size
+result, query latency, and vector and response sizes per memory.
+
+    python -m scripts.compare_embedding_dims \\
+        results/exp/<chat_model>/<symbols>/warmup_output/agent
+"""
+
+import os
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import orjson
+import typer
+from loguru import logger
+from rich.console import Console
+from rich.table import Table
+
+from src import LinearCompoundScore, NumpyMemoryDB, Queries, QuerySingle
+
+app = typer.Typer()
+
+MEMORY_LAYERS = ["short", "mid", "long", "reflection"]
+
+
+def shorten(vectors: np.ndarray, dims: int) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)[:, :dims]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def replay_queries(
+    memory_db: NumpyMemoryDB,
+    queries: Queries,
+    query_vectors: np.ndarray,
+    repeats: int,
+) -> Tuple[Dict[Tuple[str, int], List[int]], float]:
+    compound_score = LinearCompoundScore(
+        upper_bound=memory_db.memory_config["memory_importance_upper_bound"]
+    )
+    elapsed = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        queried = memory_db.query_layers(
+            query_input=queries,
+            layers=MEMORY_LAYERS,
+            linear_compound_func=compound_score,
+            query_vectors=query_vectors,
+        )
+        elapsed.append(time.perf_counter() - start)
+    results = {
+        (layer, i): ids
+        for layer in MEMORY_LAYERS
+        for i, (_, ids) in enumerate(queried[layer])
+    }
+    return results, float(np.median(elapsed))
+
+
+@app.command()
+def main(
+    agent_path: str = typer.Argument(..., help="Saved agent of a run"),
+    dims: str = typer.Option("256,512,1024,3072", "--dims"),
+    repeats: int = typer.Option(20, "--repeats", "-r"),
+):
+    logger.remove()
+    with open(os.path.join(agent_path, "state_dict.json"), "rb") as f:
+        state_dict = orjson.loads(f.read())
+    agent_config = state_dict["agent_config"]
+    # the numpy backend needs no server, whichever backend the run used
+    full_memory_db = NumpyMemoryDB.load_checkpoint(
+        os.path.join(agent_path, "memory_db")
+    )
+    emb_config = full_memory_db.emb_config
+    if not emb_config["emb_model_name"].startswith("text-embedding-3"):
+        raise typer.BadParameter(
+            f"{emb_config['emb_model_name']} vectors can not be shortened"
+        )
+    ids, vectors, payloads = full_memory_db._get_record_columns()
+
+    queries = Queries(
+        query_records=[
+            QuerySingle(
+                query_text=agent_config["character_string"][symbol],
+                k=agent_config["top_k"],
+                symbol=symbol,
+            )
+            for symbol in agent_config["trading_symbols"]
+        ]
+    )
+    # embedded once at the full size of the run, shortened like the memories
+    full_query_vectors = np.asarray(
+        full_memory_db.emb_model([q.query_text for q in queries.query_records]),
+        dtype=np.float32,
+    )
+    full_results, _ = replay_queries(
+        memory_db=full_memory_db,
+        queries=queries,
+        query_vectors=full_query_vectors,
+        repeats=1,
+    )
+
+    table = Table(
+        title=f"{emb_config['emb_model_name']}, {len(ids)} memories, "
+        f"{len(queries.query_records)} queries over {len(MEMORY_LAYERS)} layers"
+    )
+    table.add_column("dims", justify="right")
+    table.add_column(f"overlap@{agent_config['top_k']}", justify="right")
+    table.add_column("query ms", justify="right")
+    table.add_column("vector bytes", justify="right")
+    table.add_column("response bytes", justify="right")
+    for cur_dims in [int(d) for d in dims.split(",")]:
+        if cur_dims > emb_config["emb_size"]:
+            typer.echo(f"Skipping {cur_dims}, the run used {emb_config['emb_size']}")
+            continue
+        memory_db = NumpyMemoryDB(
+            agent_config=full_memory_db.agent_config,
+            emb_config=dict(emb_config, emb_size=cur_dims, emb_dimensions=cur_dims),
+        )
+        cur_vectors = shorten(vectors, cur_dims)
+        if len(ids) > 0:
+            memory_db._load_record_columns(ids, cur_vectors, payloads)
+        results, latency = replay_queries(
+            memory_db=memory_db,
+            queries=queries,
+            query_vectors=shorten(full_query_vectors, cur_dims),
+            repeats=repeats,
+        )
+        hits = sum(len(set(results[key]) & set(full_results[key])) for key in results)
+        total = sum(len(r) for r in full_results.values())
+        # size of one embedding in a json response of the embedding api
+        response_bytes = (
+            np.mean(
+                [
+                    len(orjson.dumps(v, option=orjson.OPT_SERIALIZE_NUMPY))
+                    for v in cur_vectors[:100]
+                ]
+            )
+            if len(ids) > 0
+            else 0
+        )
+        table.add_row(
+            str(cur_dims),
+            f"{hits / max(total, 1):.4f}",
+            f"{latency * 1000:.2f}",
+            str(cur_dims * 4),
+            f"{response_bytes:.0f}",
+        )
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    app()
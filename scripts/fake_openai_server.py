@@ -0,0 +1,467 @@
+"""A deterministic stand-in for the OpenAI embedding API and a vLLM server.
+
+Serves ``/v1/embeddings``, ``/v1/chat/completions``, ``/v1/completions``,
+``/v1/models`` and ``/health`` as used by ``OpenAIEmbedding`` and the vLLM
+chat endpoints. Embeddings are unit vectors seeded by a hash of the model and
+the text, in the float or base64 encoding. Chat responses are seeded by a
+hash of the request and follow its ``guided_json`` schema, so they pass the
+same validation as vLLM output. Every request sleeps for a latency drawn from
+a distribution given as ``name:params`` in milliseconds:
+
+    constant:20  uniform:10:50  normal:50:10  lognormal:50:0.5  exponential:30
+
+where lognormal takes the median and sigma. Embedding requests add
+``--embedding-ms-per-input`` for every text.
+
+    python -m scripts.fake_openai_server serve --port 8000 \\
+        --chat-latency lognormal:800:0.4 --embedding-latency lognormal:150:0.3
+    python -m scripts.fake_openai_server bench --embedding-calls 200 --chat-calls 50
+
+``bench`` starts the server in process and times ``OpenAIEmbedding`` and
+``SingleAssetVLLMStructureGeneration`` against it with the configs of
+``configs/main.json``. Chat requests to one endpoint are paced one at a time
+by their rate controller, as in the agent loop, whatever ``--concurrency``.
+"""
+
+import base64
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import orjson
+import typer
+from loguru import logger
+from rich.console import Console
+from rich.table import Table
+
+app = typer.Typer()
+
+# default sizes of the OpenAI embedding models, others use --emb-size
+EMBEDDING_SIZES = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def _seed(*parts: Any) -> int:
+    return int.from_bytes(
+        hashlib.sha256(orjson.dumps(parts, option=orjson.OPT_SORT_KEYS)).digest()[:8],
+        "big",
+    )
+
+
+def fake_embedding(model: str, text: str, emb_size: int) -> np.ndarray:
+    vector = np.random.default_rng(_seed(model, text)).standard_normal(
+        emb_size, dtype=np.float32
+    )
+    return vector / np.linalg.norm(vector)
+
+
+def fake_json(schema: Dict[str, Any], rng: np.random.Generator) -> Any:
+    """A value that is valid for the subset of JSON schema used in guided_json."""
+    if "enum" in schema:
+        return schema["enum"][rng.integers(len(schema["enum"]))]
+    schema_type = schema.get("type", "object")
+    if isinstance(schema_type, list):
+        schema_type = schema_type[rng.integers(len(schema_type))]
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        required = schema.get("required", list(properties))
+        return {
+            key: fake_json(properties.get(key, {"type": "string"}), rng)
+            for key in properties
+            if key in required or rng.random() < 0.5
+        }
+    if schema_type == "array":
+        items = schema.get("items", {"type": "string"})
+        min_items = schema.get("minItems", 0)
+        max_items = schema.get("maxItems", max(min_items, 3))
+        if "enum" in items:
+            # memory ids are picked without repetition, as a model would
+            max_items = min(max_items, len(items["enum"]))
+            num_items = int(rng.integers(min(min_items, max_items), max_items + 1))
+            return [
+                items["enum"][i]
+                for i in sorted(
+                    rng.choice(len(items["enum"]), size=num_items, replace=False)
+                )
+            ]
+        num_items = int(rng.integers(min_items, max_items + 1))
+        return [fake_json(items, rng) for _ in range(num_items)]
+    if schema_type == "string":
+        title = schema.get("title", "text")
+        return f"Fake {title.lower()} {rng.integers(1 << 32):08x}."
+    if schema_type == "integer":
+        return int(rng.integers(schema.get("minimum", 0), schema.get("maximum", 100)))
+    if schema_type == "number":
+        return float(rng.uniform(schema.get("minimum", 0), schema.get("maximum", 1)))
+    if schema_type == "boolean":
+        return bool(rng.random() < 0.5)
+    return None
+
+
+class LatencyModel:
+    def __init__(self, spec: str, seed: int = 0) -> None:
+        name, *params = spec.split(":")
+        self.spec = spec
+        self.params = [float(p) for p in params]
+        samplers: Dict[str, Tuple[int, Callable[[], float]]] = {
+            "constant": (1, lambda: self.params[0]),
+            "uniform": (2, lambda: self.rng.uniform(*self.params)),
+            "normal": (2, lambda: self.rng.normal(*self.params)),
+            "lognormal": (
+                2,
+                lambda: self.params[0] * np.exp(self.rng.normal(0, self.params[1])),
+            ),
+            "exponential": (1, lambda: self.rng.exponential(self.params[0])),
+        }
+        if name not in samplers or len(self.params) != samplers[name][0]:
+            raise ValueError(f"Unknown latency distribution {spec}")
+        self.sampler = samplers[name][1]
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+
+    def sample(self) -> float:
+        """Latency in seconds."""
+        with self.lock:
+            return max(float(self.sampler()), 0.0) / 1000
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeOpenAIServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.trace(f"SYS-Fake server {format % args}")
+
+    def _send(self, status: int, body: Dict[str, Any]) -> None:
+        data = orjson.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._send(200, {})
+        elif self.path == "/v1/models":
+            self._send(
+                200,
+                {
+                    "object": "list",
+                    "data": [
+                        {"id": self.server.chat_model, "object": "model"},
+                        *[{"id": m, "object": "model"} for m in EMBEDDING_SIZES],
+                    ],
+                },
+            )
+        else:
+            self._send(404, {"error": {"message": f"Unknown route {self.path}"}})
+
+    def do_POST(self) -> None:
+        routes = {
+            "/v1/embeddings": self.server.embeddings,
+            "/v1/chat/completions": self.server.chat_completions,
+            "/v1/completions": self.server.completions,
+        }
+        request = orjson.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path not in routes:
+            self._send(404, {"error": {"message": f"Unknown route {self.path}"}})
+            return
+        try:
+            status, body, latency = routes[self.path](request)
+        except (KeyError, TypeError, ValueError) as e:
+            status, body, latency = 400, {"error": {"message": repr(e)}}, 0.0
+        time.sleep(latency)
+        self._send(status, body)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        emb_size: int = 3072,
+        chat_model: str = "fake-chat-model",
+        embedding_latency: str = "constant:0",
+        embedding_ms_per_input: float = 0.0,
+        chat_latency: str = "constant:0",
+        seed: int = 0,
+    ) -> None:
+        super().__init__((host, port), FakeOpenAIHandler)
+        self.emb_size = emb_size
+        self.chat_model = chat_model
+        self.embedding_latency = LatencyModel(embedding_latency, seed=seed)
+        self.embedding_ms_per_input = embedding_ms_per_input
+        self.chat_latency = LatencyModel(chat_latency, seed=seed + 1)
+        self.seed = seed
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def embeddings(self, request: Dict[str, Any]) -> Tuple[int, Dict, float]:
+        texts = request["input"]
+        if isinstance(texts, str):
+            texts = [texts]
+        if not all(isinstance(t, str) for t in texts):
+            raise ValueError("only text inputs are supported")
+        model = request.get("model", "text-embedding-3-large")
+        emb_size = request.get("dimensions") or EMBEDDING_SIZES.get(
+            model, self.emb_size
+        )
+        data = []
+        for i, text in enumerate(texts):
+            vector = fake_embedding(model, text, emb_size)
+            data.append(
+                {
+                    "object": "embedding",
+                    "index": i,
+                    "embedding": (
+                        base64.b64encode(vector.astype("<f4").tobytes()).decode()
+                        if request.get("encoding_format") == "base64"
+                        else vector.tolist()
+                    ),
+                }
+            )
+        num_tokens = sum(len(t) // 4 + 1 for t in texts)
+        latency = (
+            self.embedding_latency.sample()
+            + self.embedding_ms_per_input * len(texts) / 1000
+        )
+        return (
+            200,
+            {
+                "object": "list",
+                "data": data,
+                "model": model,
+                "usage": {"prompt_tokens": num_tokens, "total_tokens": num_tokens},
+            },
+            latency,
+        )
+
+    def _generate(self, request: Dict[str, Any], prompt: Any) -> Tuple[str, Dict]:
+        rng = np.random.default_rng(
+            _seed(self.seed, request.get("model"), prompt, request.get("guided_json"))
+        )
+        schema = request.get("guided_json")
+        if schema is None:
+            text = f"Fake response {rng.integers(1 << 32):08x}."
+        else:
+            if isinstance(schema, str):
+                schema = orjson.loads(schema)
+            text = orjson.dumps(fake_json(schema, rng)).decode()
+        prompt_tokens = len(orjson.dumps(prompt)) // 4 + 1
+        completion_tokens = len(text) // 4 + 1
+        return text, {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def chat_completions(self, request: Dict[str, Any]) -> Tuple[int, Dict, float]:
+        text, usage = self._generate(request, request["messages"])
+        return (
+            200,
+            {
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", self.chat_model),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            },
+            self.chat_latency.sample(),
+        )
+
+    def completions(self, request: Dict[str, Any]) -> Tuple[int, Dict, float]:
+        text, usage = self._generate(request, request["prompt"])
+        return (
+            200,
+            {
+                "object": "text_completion",
+                "created": int(time.time()),
+                "model": request.get("model", self.chat_model),
+                "choices": [{"index": 0, "text": text, "finish_reason": "stop"}],
+                "usage": usage,
+            },
+            self.chat_latency.sample(),
+        )
+
+
+def time_calls(
+    call: Callable[[int], Any], num_calls: int, concurrency: int
+) -> Tuple[List[float], float]:
+    def timed(i: int) -> float:
+        start = time.perf_counter()
+        call(i)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, range(num_calls)))
+    return latencies, time.perf_counter() - start
+
+
+def add_latency_row(
+    table: Table, name: str, latencies: List[float], elapsed: float, items: int
+) -> None:
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    table.add_row(
+        name,
+        str(len(latencies)),
+        f"{len(latencies) / elapsed:.1f}",
+        f"{items / elapsed:.1f}",
+        f"{p50:.1f}",
+        f"{p95:.1f}",
+        f"{p99:.1f}",
+        f"{max(latencies) * 1000:.1f}",
+    )
+
+
+@app.command()
+def serve(
+    host: str = typer.Option("127.0.0.1", "--host"),
+    port: int = typer.Option(8000, "--port", "-p"),
+    emb_size: int = typer.Option(3072, "--emb-size"),
+    chat_model: str = typer.Option("fake-chat-model", "--chat-model"),
+    embedding_latency: str = typer.Option("constant:0", "--embedding-latency"),
+    embedding_ms_per_input: float = typer.Option(0.0, "--embedding-ms-per-input"),
+    chat_latency: str = typer.Option("constant:0", "--chat-latency"),
+    seed: int = typer.Option(0, "--seed"),
+):
+    server = FakeOpenAIServer(
+        host=host,
+        port=port,
+        emb_size=emb_size,
+        chat_model=chat_model,
+        embedding_latency=embedding_latency,
+        embedding_ms_per_input=embedding_ms_per_input,
+        chat_latency=chat_latency,
+        seed=seed,
+    )
+    logger.info(f"SYS-Fake OpenAI server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@app.command()
+def bench(
+    config_path: str = typer.Option(
+        os.path.join("configs", "main.json"), "--config-path", "-c"
+    ),
+    embedding_calls: int = typer.Option(200, "--embedding-calls"),
+    texts_per_call: int = typer.Option(10, "--texts-per-call"),
+    chat_calls: int = typer.Option(50, "--chat-calls"),
+    concurrency: int = typer.Option(1, "--concurrency"),
+    embedding_latency: str = typer.Option("lognormal:150:0.3", "--embedding-latency"),
+    embedding_ms_per_input: float = typer.Option(0.5, "--embedding-ms-per-input"),
+    chat_latency: str = typer.Option("lognormal:800:0.4", "--chat-latency"),
+    num_memory_ids: int = typer.Option(5, "--num-memory-ids"),
+    seed: int = typer.Option(0, "--seed"),
+):
+    # the clients pull in the whole package, the server alone does not need it
+    from src.chat.endpoint.base import SingleAssetStructureGenerationFailure
+    from src.chat.endpoint.vllm import SingleAssetVLLMStructureGeneration
+    from src.chat.structure_generation.vllm_sg import (
+        SingleAssetVLLMStructureGenerationSchema,
+    )
+    from src.embedding import OpenAIEmbedding
+    from src.utils import RunMode
+
+    logger.remove()
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    with open(config_path, "rb") as f:
+        config = orjson.loads(f.read())
+    server = FakeOpenAIServer(
+        port=0,
+        emb_size=config["emb_config"]["emb_size"],
+        embedding_latency=embedding_latency,
+        embedding_ms_per_input=embedding_ms_per_input,
+        chat_latency=chat_latency,
+        seed=seed,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    table = Table(
+        title=f"Fake server, embedding {embedding_latency} + {embedding_ms_per_input} "
+        f"ms per text, chat {chat_latency}, concurrency {concurrency}"
+    )
+    table.add_column("requests")
+    table.add_column("calls", justify="right")
+    table.add_column("calls per s", justify="right")
+    table.add_column("items per s", justify="right")
+    table.add_column("p50 ms", justify="right")
+    table.add_column("p95 ms", justify="right")
+    table.add_column("p99 ms", justify="right")
+    table.add_column("max ms", justify="right")
+
+    # without a cache every call goes to the server
+    emb_model = OpenAIEmbedding(
+        dict(
+            config["emb_config"],
+            emb_backend="openai",
+            request_endpoint=f"{server.url}/v1/embeddings",
+            embedding_cache_path=None,
+        )
+    )
+    latencies, elapsed = time_calls(
+        lambda i: emb_model(
+            [f"news {i} {j}" for j in range(texts_per_call)]  # type: ignore
+        ),
+        num_calls=embedding_calls,
+        concurrency=concurrency,
+    )
+    emb_model.close()
+    add_latency_row(
+        table, "embedding", latencies, elapsed, embedding_calls * texts_per_call
+    )
+
+    chat_model = SingleAssetVLLMStructureGeneration(
+        chat_config=dict(config["chat_config"], chat_vllm_endpoint=server.url)
+    )
+    schema = SingleAssetVLLMStructureGenerationSchema()(
+        run_mode=RunMode.TEST,
+        short_memory_ids=list(range(num_memory_ids)),
+        mid_memory_ids=list(range(num_memory_ids, 2 * num_memory_ids)),
+        long_memory_ids=list(range(2 * num_memory_ids, 3 * num_memory_ids)),
+        reflection_memory_ids=list(range(3 * num_memory_ids, 4 * num_memory_ids)),
+    )
+    failures = []
+
+    def chat_call(i: int) -> None:
+        response = chat_model(prompt=f"prompt {i}", schema=schema)
+        if isinstance(response, SingleAssetStructureGenerationFailure):
+            failures.append(i)
+
+    latencies, elapsed = time_calls(
+        chat_call, num_calls=chat_calls, concurrency=concurrency
+    )
+    add_latency_row(table, "chat", latencies, elapsed, chat_calls)
+    server.shutdown()
+    server.server_close()
+    Console().print(table)
+    if failures:
+        typer.echo(f"{len(failures)} chat responses failed validation")
+
+
+if __name__ == "__main__":
+    app()
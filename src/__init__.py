@@ -5,7 +5,15 @@ from .chat import (
     MultiAssetsStructureOutputResponse,
     get_chat_model,
 )
-from .embedding import OpenAIEmbedding
+from .checkpoint import (
+    CheckpointOp,
+    CheckpointPolicy,
+    CheckpointWriteFailed,
+    CheckpointWriter,
+    get_latest_checkpoint_path,
+    write_checkpoint_ops,
+)
+from .embedding import ONNXEmbedding, OpenAIEmbedding, construct_embedding_model
 from .memory_db import (
     AccessFeedbackMulti,
     AccessFeedback,
@@ -18,10 +26,14 @@ from .memory_db import (
     LinearCompoundScore,
     Memories,
     MemoryDB,
+    MemoryDBBase,
     MemorySingle,
+    NumpyMemoryDB,
     Queries,
     QuerySingle,
     RecencyDecay,
+    construct_memory_db,
+    load_memory_db_checkpoint,
 )
 from .portfolio import (
     PortfolioBase,
@@ -1,5 +1,5 @@
 import os
-from typing import Any, Dict, Union
+from typing import Any, Dict, List, Union
 
 import orjson
 from loguru import logger
@@ -10,6 +10,7 @@ from .chat import (
     SingleAssetStructureGenerationFailure,
     get_chat_model,
 )
+from .checkpoint import CheckpointOp, write_checkpoint_ops
 from .market_env import OneDayMarketInfo
 from .memory_db import (
     ConstantAccessCounterUpdateFunction,
@@ -18,11 +19,13 @@ from .memory_db import (
     IDGenerator,
     ImportanceDecay,
     LinearCompoundScore,
-    MemoryDB,
     Queries,
     QuerySingle,
     RecencyDecay,
+    construct_memory_db,
+    load_memory_db_checkpoint,
 )
+from .news_dedup import NewsDeduplicator
 from .portfolio import (
     PortfolioMultiAsset,
     PortfolioSingleAsset,
@@ -53,8 +56,19 @@ class FinMemAgent:
         logger.trace("CONFIG-chat config: {chat_config}")
         logger.trace("CONFIG-portfolio config: {portfolio_config}")
         # memory db
-        self.memory_db = MemoryDB(agent_config=agent_config, emb_config=emb_config)
+        self.memory_db = construct_memory_db(
+            agent_config=agent_config, emb_config=emb_config
+        )
         self.id_generator = IDGenerator(id_init=0)
+        # near-duplicate news are dropped before they are embedded
+        self.news_dedup = None
+        if agent_config.get("news_dedup_threshold") is not None:
+            self.news_dedup = NewsDeduplicator(
+                threshold=agent_config["news_dedup_threshold"],
+                num_perm=agent_config["news_dedup_num_perm"],
+                shingle_size=agent_config["news_dedup_shingle_size"],
+                window=agent_config["news_dedup_window"],
+            )
         # chat endpoint
         self.chat_schema, self.chat_endpoint, self.chat_prompt = get_chat_model(
             chat_config=chat_config, task_type=task_type
@@ -79,6 +93,10 @@ class FinMemAgent:
             ]
         )
         logger.trace(f"AGENT-Constructed queries: {self.queries.model_dump()}")
+        # the character strings never change during a run, embed them once
+        self.memory_db.cache_query_embeddings(
+            [q.query_text for q in self.queries.query_records]
+        )
 
     def _config_memory_settings(self) -> None:
         short_memory_config: Dict[str, Any] = self.agent_config["memory_db_config"][
@@ -239,6 +257,14 @@ class FinMemAgent:
         for symbol, news in market_info.cur_news.items():  # type: ignore
             if news is not None:
                 logger.trace(f"AGENT-Handling news for symbol: {symbol}")
+                if self.news_dedup is not None:
+                    num_news = len(news)
+                    news = self.news_dedup(symbol=symbol, news=news)
+                    logger.info(
+                        f"AGENT-Dropped {num_news - len(news)} near-duplicate news for symbol: {symbol}"
+                    )
+                    if not news:
+                        continue
                 self.memory_db.add_memory(
                     memory_input=[
                         {
@@ -256,26 +282,15 @@ class FinMemAgent:
 
     def _query_memories(self) -> Dict[str, Dict[str, Union[str, NonNegativeInt, None]]]:
         # sourcery skip: low-code-quality
-        short_queried_memories = self.memory_db.query(
-            query_input=self.queries,
-            layer="short",
-            linear_compound_func=self.memory_compound_score,
-        )
-        mid_queried_memories = self.memory_db.query(
-            query_input=self.queries,
-            layer="mid",
-            linear_compound_func=self.memory_compound_score,
-        )
-        long_queried_memories = self.memory_db.query(
+        queried_memories = self.memory_db.query_layers(
             query_input=self.queries,
-            layer="long",
-            linear_compound_func=self.memory_compound_score,
-        )
-        reflection_queried_memories = self.memory_db.query(
-            query_input=self.queries,
-            layer="reflection",
+            layers=["short", "mid", "long", "reflection"],
             linear_compound_func=self.memory_compound_score,
         )
+        short_queried_memories = queried_memories["short"]
+        mid_queried_memories = queried_memories["mid"]
+        long_queried_memories = queried_memories["long"]
+        reflection_queried_memories = queried_memories["reflection"]
         # organize output
         ret_dict = {}
         for i, symbol in enumerate(self.agent_config["trading_symbols"]):
@@ -657,6 +672,14 @@ class FinMemAgent:
             mid_recency_init_func=self.mid_recency_init,
             long_recency_init_func=self.long_recency_init,
         )
+        # embedding connection reuse
+        emb_stats = self.memory_db.emb_model.pop_connection_stats()
+        logger.info(
+            f"EMB-Step embedding requests: {emb_stats['requests']}, new connections: {emb_stats['new_connections']}"
+        )
+
+    def close(self) -> None:
+        self.memory_db.close()
 
     def __eq__(self, another_agent: "FinMemAgent") -> bool:
         return (
@@ -668,19 +691,33 @@ class FinMemAgent:
         )
 
     def save_checkpoint(self, path: str) -> None:
-        os.makedirs(os.path.join(path, "memory_db"), exist_ok=True)
-        self.portfolio.save_checkpoint(path)
+        write_checkpoint_ops(self.checkpoint_ops(path))
+
+    def checkpoint_ops(self, path: str) -> List[CheckpointOp]:
+        ops = [CheckpointOp(kind="make_dir", path=os.path.join(path, "memory_db"))]
+        ops += self.portfolio.checkpoint_ops(path)
         state_dict = {
             "agent_config": self.agent_config,
             "emb_config": self.emb_config,
             "chat_config": self.chat_config,
             "portfolio_config": self.portfolio_config,
             "id_generator": self.id_generator.save_check_point(),
+            "news_dedup": (
+                self.news_dedup.save_checkpoint()
+                if self.news_dedup is not None
+                else None
+            ),
             "task_type": self.task_type,
         }
-        with open(os.path.join(path, "state_dict.json"), "w") as f:
-            f.write(orjson.dumps(state_dict).decode())
-        self.memory_db.save_checkpoint(os.path.join(path, "memory_db"))
+        ops.append(
+            CheckpointOp(
+                kind="write",
+                path=os.path.join(path, "state_dict.json"),
+                data=orjson.dumps(state_dict),
+            )
+        )
+        ops += self.memory_db.checkpoint_ops(os.path.join(path, "memory_db"))
+        return ops
 
     @classmethod
     def load_checkpoint(
@@ -696,7 +733,18 @@ class FinMemAgent:
             task_type=state_dict["task_type"],
         )
         agent.id_generator = IDGenerator.load_checkpoint(state_dict["id_generator"])
-        agent.memory_db = MemoryDB.load_checkpoint(os.path.join(path, "memory_db"))
+        if state_dict.get("news_dedup") is not None:
+            agent.news_dedup = NewsDeduplicator.load_checkpoint(
+                history=state_dict["news_dedup"],
+                threshold=agent.agent_config["news_dedup_threshold"],
+                num_perm=agent.agent_config["news_dedup_num_perm"],
+                shingle_size=agent.agent_config["news_dedup_shingle_size"],
+                window=agent.agent_config["news_dedup_window"],
+            )
+        query_emb_cache = agent.memory_db.query_emb_cache
+        agent.memory_db.close()
+        agent.memory_db = load_memory_db_checkpoint(os.path.join(path, "memory_db"))
+        agent.memory_db.query_emb_cache.update(query_emb_cache)
         if agent.task_type == TaskType.SingleAsset:
             agent.portfolio = PortfolioSingleAsset.load_checkpoint(path)
         else:
@@ -6,6 +6,7 @@ import guardrails as gd
 import httpx
 from loguru import logger
 
+from ...rate_limit import get_rate_controller
 from .base import (
     SingleAssetStructuredGenerationChatEndPoint as StructuredGenerationChatEndPoint,
 )
@@ -29,6 +30,10 @@ class BaseGuardRailStructureGeneration(StructuredGenerationChatEndPoint):
         self.endpoint = chat_config["chat_endpoint"]
         self.chat_request_timeout = chat_config["chat_request_timeout"]
         self.chat_parameters = chat_config["chat_parameters"]
+        # requests wait and retry as the endpoint's rate limits ask
+        self.rate_controller = get_rate_controller(
+            name=self.endpoint, max_retries=chat_config.get("chat_max_retries", 5)
+        )
 
         self.chat_end_point_func = self.endpoint_func()
 
@@ -118,8 +123,10 @@ class ClaudeGuardRailStructureGeneration(BaseGuardRailStructureGeneration):
             }
             logger.info("LLM API Request sent")
             with httpx.Client(timeout=self.chat_request_timeout) as client:
-                response = client.post(
-                    url=self.endpoint, headers=self.headers, json=request_data
+                response = self.rate_controller.request(
+                    lambda: client.post(
+                        url=self.endpoint, headers=self.headers, json=request_data
+                    )
                 )
             if response.status_code != 200:
                 logger.error(
@@ -168,8 +175,10 @@ class GPTGuardRailStructureGeneration(BaseGuardRailStructureGeneration):
                 }
             logger.info("LLM API Request sent")
             with httpx.Client(timeout=self.chat_request_timeout) as client:
-                response = client.post(
-                    url=self.endpoint, headers=self.headers, json=request_data
+                response = self.rate_controller.request(
+                    lambda: client.post(
+                        url=self.endpoint, headers=self.headers, json=request_data
+                    )
                 )
             if response.status_code != 200:
                 logger.error(
@@ -8,6 +8,7 @@ from loguru import logger
 from pydantic import ValidationError
 
 from ...portfolio import TradeAction
+from ...rate_limit import get_rate_controller
 from .base import (
     MultiAssetsStructuredGenerationChatEndPoint,
     MultiAssetsStructureGenerationFailure,
@@ -48,6 +49,10 @@ class SingleAssetVLLMStructureGeneration(SingleAssetStructuredGenerationChatEndP
         logger.trace(f"CHAT-VLLM chat request timeout: {self.chat_request_timeout}")
         self.chat_parameters = chat_config["chat_parameters"]
         logger.trace(f"CHAT-VLLM chat parameters: {self.chat_parameters}")
+        self.rate_controller = get_rate_controller(
+            name=f"{self.request_url}{self.endpoint_suffix}",
+            max_retries=chat_config.get("chat_max_retries", 5),
+        )
         # check if vllm is alive otherwise raise an error
         try:
             with httpx.Client(timeout=self.chat_request_timeout) as client:
@@ -88,10 +93,12 @@ class SingleAssetVLLMStructureGeneration(SingleAssetStructuredGenerationChatEndP
                 **self.chat_parameters,
             }
         with httpx.Client(timeout=self.chat_request_timeout) as client:
-            response = client.post(
-                url=f"{self.request_url}{self.endpoint_suffix}",
-                headers=self.header,
-                json=request_data,
+            response = self.rate_controller.request(
+                lambda: client.post(
+                    url=f"{self.request_url}{self.endpoint_suffix}",
+                    headers=self.header,
+                    json=request_data,
+                )
             )
         if response.status_code != 200:
             logger.error(f"CHAT-VLLM response status code: {response.status_code}")
@@ -160,6 +167,10 @@ class MultiAssetsVLLMStructureGeneration(MultiAssetsStructuredGenerationChatEndP
         logger.trace(f"CHAT-VLLM chat request timeout: {self.chat_request_timeout}")
         self.chat_parameters = chat_config["chat_parameters"]
         logger.trace(f"CHAT-VLLM chat parameters: {self.chat_parameters}")
+        self.rate_controller = get_rate_controller(
+            name=f"{self.request_url}{self.endpoint_suffix}",
+            max_retries=chat_config.get("chat_max_retries", 5),
+        )
         # check if vllm is alive otherwise raise an error
         try:
             with httpx.Client(timeout=self.chat_request_timeout) as client:
@@ -200,10 +211,12 @@ class MultiAssetsVLLMStructureGeneration(MultiAssetsStructuredGenerationChatEndP
                 **self.chat_parameters,
             }
         with httpx.Client(timeout=self.chat_request_timeout) as client:
-            response = client.post(
-                url=f"{self.request_url}{self.endpoint_suffix}",
-                headers=self.header,
-                json=request_data,
+            response = self.rate_controller.request(
+                lambda: client.post(
+                    url=f"{self.request_url}{self.endpoint_suffix}",
+                    headers=self.header,
+                    json=request_data,
+                )
             )
         if response.status_code != 200:
             logger.error(f"CHAT-VLLM response status code: {response.status_code}")
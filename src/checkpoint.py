@@ -0,0 +1,266 @@
+import atexit
+import os
+import queue
+import re
+import shutil
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable, List, Literal, Tuple, Union
+
+from loguru import logger
+
+
+class CheckpointWriteFailed(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class CheckpointOp:
+    # "reset_dir" rebuilds the directory from the ops under it that follow,
+    # "make_dir" creates it if missing, "remove_dir" deletes it, "write"
+    # replaces the file atomically and "append" adds to its end
+    kind: Literal["reset_dir", "make_dir", "remove_dir", "write", "append"]
+    path: str
+    # bytes, or a function producing them that only reads a snapshot taken
+    # when the op was created, so encoding can run off the step loop
+    data: Union[bytes, Callable[[], bytes], None] = None
+
+
+def _get_bytes(op: CheckpointOp) -> bytes:
+    return op.data() if callable(op.data) else op.data  # type: ignore
+
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _is_within(path: str, dir_path: str) -> bool:
+    dir_path = os.path.abspath(dir_path)
+    return os.path.commonpath([os.path.abspath(path), dir_path]) == dir_path
+
+
+def get_committed_dir(path: str) -> str:
+    # a crash between the two renames of _commit_dir leaves only the previous
+    # directory, under its ".old" name
+    previous_path = f"{path}.old"
+    if not os.path.exists(path) and os.path.exists(previous_path):
+        return previous_path
+    return path
+
+
+def _commit_dir(path: str, staging_path: str) -> None:
+    # the previous directory stays complete until the new one is on disk
+    for cur_dir, _, _ in os.walk(staging_path):
+        _fsync_dir(cur_dir)
+    previous_path = f"{path}.old"
+    if os.path.exists(path):
+        shutil.rmtree(previous_path, ignore_errors=True)
+        os.rename(path, previous_path)
+    os.rename(staging_path, path)
+    _fsync_dir(os.path.dirname(os.path.abspath(path)))
+    shutil.rmtree(previous_path, ignore_errors=True)
+
+
+def write_checkpoint_ops(ops: List[CheckpointOp]) -> None:
+    # (directory, staging directory) of the "reset_dir" in progress, its ops
+    # are written to the staging directory, which replaces the directory once
+    # an op outside of it or the end of the ops is reached
+    staged: Union[Tuple[str, str], None] = None
+    for op in ops:
+        if staged is not None and (
+            op.kind == "reset_dir" or not _is_within(op.path, staged[0])
+        ):
+            _commit_dir(*staged)
+            staged = None
+        path = op.path
+        if staged is not None:
+            path = os.path.join(staged[1], os.path.relpath(op.path, staged[0]))
+        if op.kind == "reset_dir":
+            staged = (op.path, f"{op.path}.tmp")
+            shutil.rmtree(staged[1], ignore_errors=True)
+            os.makedirs(staged[1])
+        elif op.kind == "make_dir":
+            os.makedirs(path, exist_ok=True)
+        elif op.kind == "remove_dir":
+            shutil.rmtree(path, ignore_errors=True)
+        elif op.kind == "write":
+            # rename on complete, a reader never sees a partially written file
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_get_bytes(op))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        elif op.kind == "append":
+            with open(path, "ab") as f:
+                f.write(_get_bytes(op))
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            raise NotImplementedError(f"Checkpoint op {op.kind} not implemented")
+    if staged is not None:
+        _commit_dir(*staged)
+
+
+class CheckpointWriter:
+    """Persists checkpoints on a background thread.
+
+    ``submit`` takes the ops of one checkpoint and returns right away unless
+    ``max_pending`` checkpoints are already queued. Checkpoints are written in
+    submission order, and a failed write is raised on the next call.
+    """
+
+    def __init__(self, max_pending: int = 2) -> None:
+        self.queue: "queue.Queue[Union[List[CheckpointOp], None]]" = queue.Queue(
+            maxsize=max_pending
+        )
+        self.error: Union[BaseException, None] = None
+        self.closed = False
+        self.thread = threading.Thread(
+            target=self._run, name="checkpoint-writer", daemon=True
+        )
+        self.thread.start()
+        # pending checkpoints are still written if the run stops with an error
+        atexit.register(self.close)
+
+    def _run(self) -> None:
+        while True:
+            ops = self.queue.get()
+            try:
+                if ops is None:
+                    return
+                if self.error is None:
+                    write_checkpoint_ops(ops)
+            except BaseException as e:
+                logger.error(f"SYS-Checkpoint write failed: {e}")
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            raise CheckpointWriteFailed("Checkpoint write failed") from self.error
+
+    def submit(self, ops: List[CheckpointOp]) -> None:
+        self._raise_error()
+        self.queue.put(ops)
+
+    def wait(self) -> None:
+        self.queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+        self._raise_error()
+
+
+# name of the file pointing at the newest complete checkpoint of a ring
+LATEST_CHECKPOINT_FILE = "latest"
+
+
+def get_latest_checkpoint_path(path: str) -> str:
+    latest_path = os.path.join(path, LATEST_CHECKPOINT_FILE)
+    if not os.path.exists(latest_path):
+        return path
+    with open(latest_path, "r") as f:
+        return os.path.join(path, f.read().strip())
+
+
+class CheckpointPolicy:
+    """Decides after which steps a checkpoint is saved and where.
+
+    A checkpoint is due every ``every_n_steps`` steps, once ``every_seconds``
+    passed since the last one, or after a SIGTERM when ``on_signal`` is set.
+    Without ``keep_last`` every checkpoint overwrites the previous one in
+    ``path``; otherwise each goes to its own sub-directory named after the
+    step date, ``latest`` points at the newest complete one and only the
+    last ``keep_last`` are kept.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        every_n_steps: Union[int, None] = 1,
+        every_seconds: Union[float, None] = None,
+        on_signal: bool = False,
+        keep_last: Union[int, None] = None,
+    ) -> None:
+        self.path = path
+        self.every_n_steps = every_n_steps
+        self.every_seconds = every_seconds
+        self.keep_last = keep_last
+        self.steps_since_checkpoint = 0
+        self.last_checkpoint_time = time.monotonic()
+        self.received_signal: Union[int, None] = None
+        if on_signal:
+            signal.signal(signal.SIGTERM, self._handle_signal)
+        # checkpoints left by an interrupted run are part of the ring
+        self.kept: List[str] = []
+        if keep_last is not None and os.path.isdir(path):
+            self.kept = sorted(
+                name
+                for name in os.listdir(path)
+                if re.fullmatch(r"\d{4}-\d{2}-\d{2}", name)
+                and os.path.isdir(os.path.join(path, name))
+            )
+
+    def _handle_signal(self, signum: int, frame) -> None:
+        # the step in progress finishes first, so the checkpoint is consistent
+        logger.warning(f"SYS-Received signal {signum}, checkpointing after step")
+        self.received_signal = signum
+
+    def step(self) -> bool:
+        self.steps_since_checkpoint += 1
+        if (
+            self.received_signal is not None
+            or (
+                self.every_n_steps is not None
+                and self.steps_since_checkpoint >= self.every_n_steps
+            )
+            or (
+                self.every_seconds is not None
+                and time.monotonic() - self.last_checkpoint_time >= self.every_seconds
+            )
+        ):
+            self.steps_since_checkpoint = 0
+            self.last_checkpoint_time = time.monotonic()
+            return True
+        return False
+
+    def get_checkpoint_path(self, cur_date: date) -> str:
+        if self.keep_last is None:
+            return self.path
+        return os.path.join(self.path, cur_date.strftime("%Y-%m-%d"))
+
+    def retention_ops(self, cur_date: date) -> List[CheckpointOp]:
+        # run after the checkpoint ops, so "latest" only moves to a complete one
+        if self.keep_last is None:
+            return []
+        name = cur_date.strftime("%Y-%m-%d")
+        if name in self.kept:
+            self.kept.remove(name)
+        self.kept.append(name)
+        ops = [
+            CheckpointOp(
+                kind="write",
+                path=os.path.join(self.path, LATEST_CHECKPOINT_FILE),
+                data=name.encode("utf-8"),
+            )
+        ]
+        while len(self.kept) > self.keep_last:
+            ops.append(
+                CheckpointOp(
+                    kind="remove_dir", path=os.path.join(self.path, self.kept.pop(0))
+                )
+            )
+        return ops
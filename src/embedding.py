@@ -1,15 +1,27 @@
+import atexit
+import base64
+import fcntl
+import hashlib
 import os
+import threading
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Literal, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Literal, Tuple, Union
 
 import httpx
+import numpy as np
+import tiktoken
 from loguru import logger
 from pydantic import BaseModel
 
+from .rate_limit import get_rate_controller
+
 
 class EmbeddingObject(BaseModel):
     object: Literal["embedding"]
-    embedding: List[float]
+    # a base64 string of little endian float32 with encoding_format "base64"
+    embedding: Union[str, List[float]]
     index: int
 
 
@@ -42,13 +54,125 @@ class OpenAIEmbeddingError(Exception):
         return self.message
 
 
+class EmbeddingCache:
+    """Append-only on-disk embedding store addressed by content hash.
+
+    ``index.bin`` holds one 16 byte key per row and ``vectors.bin`` the raw
+    vectors in the same row order, so the store is opened by reading the keys
+    and memory-mapping the vectors, without any parsing. Writers append under
+    a file lock, which keeps the store safe to share between concurrent runs.
+    """
+
+    key_size = 16
+
+    def __init__(self, cache_path: str, emb_size: int, dtype: str = "float32") -> None:
+        self.cache_path = cache_path
+        self.emb_size = emb_size
+        self.dtype = np.dtype(dtype)
+        self.row_size = self.emb_size * self.dtype.itemsize
+        self.index_path = os.path.join(cache_path, "index.bin")
+        self.vector_path = os.path.join(cache_path, "vectors.bin")
+        self.lock_path = os.path.join(cache_path, ".lock")
+        self.key_to_row: Dict[bytes, int] = {}
+        self.num_rows = 0
+        self.vectors: Union[np.memmap, None] = None
+        os.makedirs(cache_path, exist_ok=True)
+        with self._lock():
+            self._repair()
+            self._refresh()
+        logger.trace(
+            f"EMB-Opened embedding cache at {cache_path} with {self.num_rows} vectors"
+        )
+
+    @staticmethod
+    def hash_key(emb_model_name: str, emb_size: int, text: str) -> bytes:
+        return hashlib.blake2b(
+            f"{emb_model_name}\x00{emb_size}\x00{text}".encode(),
+            digest_size=EmbeddingCache.key_size,
+        ).digest()
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _repair(self) -> None:
+        # vectors are written before their keys, so an interrupted write can only
+        # leave a partial key or vectors without keys behind
+        for path in [self.index_path, self.vector_path]:
+            if not os.path.exists(path):
+                open(path, "wb").close()
+        num_keys = os.path.getsize(self.index_path) // self.key_size
+        if os.path.getsize(self.vector_path) < num_keys * self.row_size:
+            raise ValueError(f"Embedding cache at {self.cache_path} is corrupted")
+        os.truncate(self.index_path, num_keys * self.key_size)
+        os.truncate(self.vector_path, num_keys * self.row_size)
+
+    def _refresh(self) -> None:
+        num_keys = os.path.getsize(self.index_path) // self.key_size
+        if num_keys <= self.num_rows:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self.num_rows * self.key_size)
+            new_keys = f.read((num_keys - self.num_rows) * self.key_size)
+        for row in range(num_keys - self.num_rows):
+            cur_key = new_keys[row * self.key_size : (row + 1) * self.key_size]
+            self.key_to_row[cur_key] = self.num_rows + row
+        self.num_rows = num_keys
+        self.vectors = None
+
+    def _get_vectors(self) -> np.memmap:
+        if self.vectors is None:
+            self.vectors = np.memmap(
+                self.vector_path,
+                dtype=self.dtype,
+                mode="r",
+                shape=(self.num_rows, self.emb_size),
+            )
+        return self.vectors
+
+    def get(self, keys: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+        rows = np.array([self.key_to_row.get(k, -1) for k in keys], dtype=np.int64)
+        found = rows >= 0
+        embeddings = np.zeros((len(keys), self.emb_size), dtype=np.float32)
+        if found.any():
+            embeddings[found] = self._get_vectors()[rows[found]]
+        return embeddings, found
+
+    def put(self, keys: List[bytes], embeddings: np.ndarray) -> None:
+        with self._lock():
+            # pick up rows written by other processes before appending
+            self._refresh()
+            new_rows = {}
+            for cur_key, cur_emb in zip(keys, embeddings):
+                if cur_key not in self.key_to_row and cur_key not in new_rows:
+                    new_rows[cur_key] = cur_emb
+            if not new_rows:
+                return
+            with open(self.vector_path, "ab") as f:
+                f.write(np.asarray(list(new_rows.values()), dtype=self.dtype).tobytes())
+            with open(self.index_path, "ab") as f:
+                f.write(b"".join(new_rows.keys()))
+            self._refresh()
+
+
 class EmbeddingModel(ABC):
     @abstractmethod
     def __init__(self, config: Dict[str, Any]) -> None:
         pass
 
     @abstractmethod
-    def __call__(self, texts: List[str]) -> List[List[float]]:
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        pass
+
+    def pop_connection_stats(self) -> Dict[str, int]:
+        return {"requests": 0, "new_connections": 0}
+
+    def close(self) -> None:
         pass
 
 
@@ -62,47 +186,348 @@ class OpenAIEmbedding(EmbeddingModel):
         except KeyError as e:
             logger.error("Can not find openai api key")
             raise ValueError("Can not find openai api key") from e
+        if (
+            self.config.get("emb_dimensions") is not None
+            and self.config["emb_model_name"] == "text-embedding-ada-002"
+        ):
+            logger.error("EMB-text-embedding-ada-002 does not support dimensions")
+            raise ValueError("text-embedding-ada-002 does not support dimensions")
         self.header = {
             "Authorization": f"Bearer {openai_api_key}",
             "Content-Type": "application/json",
         }
+        # persistent embedding cache
+        self.cache = None
+        if self.config.get("embedding_cache_path"):
+            cache_dtype = self.config.get("embedding_cache_dtype", "float32")
+            self.cache = EmbeddingCache(
+                cache_path=os.path.join(
+                    self.config["embedding_cache_path"],
+                    f"{self.config['emb_model_name']}-{self.config['emb_size']}-{cache_dtype}",
+                ),
+                emb_size=self.config["emb_size"],
+                dtype=cache_dtype,
+            )
+        # one pooled client for all requests, so connections are kept alive
+        # between calls instead of paying a handshake per request
+        self.client = httpx.Client(
+            timeout=self.config["embedding_timeout"],
+            http2=self.config.get("embedding_http2", False),
+            limits=httpx.Limits(
+                max_connections=self.config.get("embedding_max_connections", 100),
+                max_keepalive_connections=self.config.get(
+                    "embedding_max_keepalive_connections", 20
+                ),
+            ),
+        )
+        self.stats_lock = threading.Lock()
+        self.num_requests = 0
+        self.num_new_connections = 0
+        atexit.register(self.close)
+        # inputs are split into token-budgeted batches that are requested
+        # concurrently, as many at a time as the endpoint's rate limits allow
+        # and at most embedding_max_concurrency
+        self.encoding: Union[tiktoken.Encoding, None] = None
+        self.encoding_loaded = False
+        self.rate_controller = get_rate_controller(
+            name=self.config["request_endpoint"],
+            max_concurrency=self.config.get("embedding_max_concurrency", 8),
+            max_retries=self.config.get("embedding_max_retries", 5),
+        )
+
+    def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            with self.stats_lock:
+                self.num_new_connections += 1
+
+    def pop_connection_stats(self) -> Dict[str, int]:
+        with self.stats_lock:
+            stats = {
+                "requests": self.num_requests,
+                "new_connections": self.num_new_connections,
+            }
+            self.num_requests = 0
+            self.num_new_connections = 0
+        return stats
 
-    def __call__(self, texts: Union[List[str], str]) -> List[List[float]]:
+    def close(self) -> None:
+        if not self.client.is_closed:
+            logger.trace("EMB-Closing OpenAIEmbedding client")
+            self.client.close()
+        atexit.unregister(self.close)
+
+    def _count_tokens(self, texts: List[str]) -> List[int]:
+        if not self.encoding_loaded:
+            self.encoding_loaded = True
+            try:
+                self.encoding = tiktoken.encoding_for_model(
+                    self.config["emb_model_name"]
+                )
+            except Exception as e:
+                # the encoding is downloaded on first use, which fails offline
+                logger.warning(
+                    f"EMB-Can not load tiktoken encoding, estimating tokens from text length: {e}"
+                )
+        if self.encoding is None:
+            return [len(t.encode()) // 4 + 1 for t in texts]
+        return [
+            len(t) for t in self.encoding.encode_batch(texts, disallowed_special=())
+        ]
+
+    def _split_batches(
+        self, texts: List[str], max_inputs: Union[int, None] = None
+    ) -> List[List[int]]:
+        max_tokens = self.config.get("embedding_batch_max_tokens", 8192)
+        if max_inputs is None:
+            max_inputs = self.config.get("embedding_batch_max_inputs", 2048)
+        batches: List[List[int]] = []
+        cur_tokens = 0
+        for i, num_tokens in enumerate(self._count_tokens(texts)):
+            # a new batch starts once the budget is used, so a text over the
+            # budget is sent alone
+            if (
+                not batches
+                or len(batches[-1]) >= max_inputs
+                or cur_tokens + num_tokens > max_tokens
+            ):
+                batches.append([])
+                cur_tokens = 0
+            batches[-1].append(i)
+            cur_tokens += num_tokens
+        return batches
+
+    def _embed_batched(self, texts: List[str]) -> np.ndarray:
+        batches = self._split_batches(texts)
+        if len(batches) <= 1:
+            return self._request_embeddings(texts)
+        logger.trace(
+            f"EMB-Embedding {len(texts)} texts in {len(batches)} concurrent batches"
+        )
+        embeddings = np.empty((len(texts), self.config["emb_size"]), dtype=np.float32)
+        with ThreadPoolExecutor(
+            max_workers=min(
+                len(batches), self.config.get("embedding_max_concurrency", 8)
+            )
+        ) as executor:
+            futures = {
+                executor.submit(
+                    self._request_embeddings, [texts[i] for i in batch]
+                ): batch
+                for batch in batches
+            }
+            # reassemble in input order
+            for future in as_completed(futures):
+                embeddings[futures[future]] = future.result()
+        return embeddings
+
+    def __call__(self, texts: Union[List[str], str]) -> np.ndarray:
         if isinstance(texts, str):
             texts = [texts]
-        with httpx.Client(timeout=self.config["embedding_timeout"]) as client:
-            logger.trace(
-                f"EMB-Calling OpenAIEmbedding with model: {self.config['emb_model_name']}, endpoint: {self.config['request_endpoint']}"
+        if self.cache is None:
+            return self._embed_batched(texts)
+        keys = [
+            EmbeddingCache.hash_key(
+                self.config["emb_model_name"], self.config["emb_size"], t
+            )
+            for t in texts
+        ]
+        embeddings, found = self.cache.get(keys)
+        # embed every missing text only once
+        to_emb = {}
+        for cur_key, cur_text, cur_found in zip(keys, texts, found):
+            if not cur_found:
+                to_emb[cur_key] = cur_text
+        logger.trace(
+            f"EMB-Embedding cache hits: {int(found.sum())}, misses: {len(to_emb)}"
+        )
+        if to_emb:
+            new_embeddings = self._embed_batched(list(to_emb.values()))
+            self.cache.put(list(to_emb.keys()), new_embeddings)
+            key_to_row = {k: i for i, k in enumerate(to_emb)}
+            missing = np.flatnonzero(~found)
+            embeddings[missing] = new_embeddings[[key_to_row[keys[i]] for i in missing]]
+        return embeddings
+
+    def fill_cache(
+        self,
+        texts: List[str],
+        batch_size: int,
+        num_workers: int,
+        progress_callback: Union[Callable[[int], None], None] = None,
+    ) -> int:
+        if self.cache is None:
+            raise ValueError("embedding_cache_path is not set in emb_config")
+        to_emb = {}
+        for cur_text in texts:
+            cur_key = EmbeddingCache.hash_key(
+                self.config["emb_model_name"], self.config["emb_size"], cur_text
             )
-            request_data = {
-                "input": texts,
-                "model": self.config["emb_model_name"],
-                "encoding_format": "float",
+            if cur_key not in self.cache.key_to_row:
+                to_emb[cur_key] = cur_text
+        logger.info(
+            f"EMB-Filling embedding cache: {len(to_emb)} new texts, {len(texts) - len(to_emb)} already cached"
+        )
+        if progress_callback is not None:
+            progress_callback(len(texts) - len(to_emb))
+        keys, to_emb_texts = list(to_emb.keys()), list(to_emb.values())
+        batches = [
+            ([keys[i] for i in batch], [to_emb_texts[i] for i in batch])
+            for batch in self._split_batches(to_emb_texts, max_inputs=batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = {
+                executor.submit(self._request_embeddings, batch_texts): batch_keys
+                for batch_keys, batch_texts in batches
             }
+            for future in as_completed(futures):
+                self.cache.put(futures[future], future.result())
+                if progress_callback is not None:
+                    progress_callback(len(futures[future]))
+        return len(to_emb_texts)
 
-            response = client.post(
+    def _request_embeddings(self, texts: List[str]) -> np.ndarray:
+        logger.trace(
+            f"EMB-Calling OpenAIEmbedding with model: {self.config['emb_model_name']}, endpoint: {self.config['request_endpoint']}"
+        )
+        request_data = {
+            "input": texts,
+            "model": self.config["emb_model_name"],
+            "encoding_format": self.config.get("embedding_encoding_format", "base64"),
+        }
+        # text-embedding-3 models can return shortened vectors
+        if self.config.get("emb_dimensions") is not None:
+            request_data["dimensions"] = self.config["emb_dimensions"]
+
+        def send() -> httpx.Response:
+            with self.stats_lock:
+                self.num_requests += 1
+            return self.client.post(
                 url=self.config["request_endpoint"],
                 headers=self.header,
                 json=request_data,
+                extensions={"trace": self._trace},
             )
 
+        # throttled requests are retried once the endpoint allows it
+        response = self.rate_controller.request(send)
+
+        try:
+            results = EmbeddingSuccessResponse(**response.json())
+            logger.trace("EMB-OpenAIEmbedding success response")
+        except Exception as e:
             try:
-                results = EmbeddingSuccessResponse(**response.json())
-                logger.trace("EMB-OpenAIEmbedding success response")
-            except Exception as e:
-                try:
-                    error_response = EmbeddingErrorResponse(**response.json())
-                    logger.error(
-                        f"EMB-OpenAIEmbedding failed with error: {error_response.error.message}, error type: {error_response.error.type}"
-                    )
-                    raise OpenAIEmbeddingError(
-                        message=error_response.error.message,
-                        error_type=error_response.error.type,
-                    ) from e
-                except Exception:
-                    response.raise_for_status()
-                    logger.error("EMB-OpenAIEmbedding failed with unknown error")
-
-            # ensure the order and return
-            embeddings = sorted(results.data, key=lambda x: x.index)  # type: ignore
-            return [i.embedding for i in embeddings]
+                error_response = EmbeddingErrorResponse(**response.json())
+                logger.error(
+                    f"EMB-OpenAIEmbedding failed with error: {error_response.error.message}, error type: {error_response.error.type}"
+                )
+                raise OpenAIEmbeddingError(
+                    message=error_response.error.message,
+                    error_type=error_response.error.type,
+                ) from e
+            except Exception:
+                response.raise_for_status()
+                logger.error("EMB-OpenAIEmbedding failed with unknown error")
+
+        # ensure the order and return, base64 vectors are read from the
+        # decoded bytes instead of being parsed float by float
+        embeddings = np.empty((len(texts), self.config["emb_size"]), dtype=np.float32)
+        for cur_emb in results.data:  # type: ignore
+            if isinstance(cur_emb.embedding, str):
+                embeddings[cur_emb.index] = np.frombuffer(
+                    base64.b64decode(cur_emb.embedding), dtype="<f4"
+                )
+            else:
+                embeddings[cur_emb.index] = cur_emb.embedding
+        return embeddings
+
+
+class ONNXEmbedding(EmbeddingModel):
+    """Embeds texts on the CPU with an ONNX export of a sentence encoder.
+
+    ``emb_model_path`` is a local directory or a Hugging Face repository
+    holding ``tokenizer.json`` and the ONNX model, so replays can run without
+    network access once the files are present.
+    """
+
+    def __init__(self, emb_config: Dict) -> None:
+        self.config = emb_config
+        logger.trace(f"EMB-Initializing ONNXEmbedding with config: {self.config}")
+        if self.config.get("emb_dimensions") is not None:
+            logger.error(
+                f"EMB-{self.config['emb_model_name']} does not support dimensions"
+            )
+            raise ValueError(
+                f"{self.config['emb_model_name']} does not support dimensions"
+            )
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError(
+                "The onnx embedding backend needs onnxruntime and tokenizers, install them with `pip install onnxruntime tokenizers`"
+            ) from e
+        tokenizer_path = self._get_model_file("tokenizer.json")
+        model_path = self._get_model_file(self.config["emb_onnx_file"])
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=self.config["emb_max_length"])
+        self.tokenizer.enable_padding()
+        session_options = ort.SessionOptions()
+        if self.config.get("embedding_num_threads") is not None:
+            session_options.intra_op_num_threads = self.config["embedding_num_threads"]
+        session_options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options=session_options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        logger.info(
+            f"EMB-Loaded {self.config['emb_model_name']} from {model_path}, threads: {self.config.get('embedding_num_threads')}"
+        )
+
+    def _get_model_file(self, file_name: str) -> str:
+        if os.path.isdir(self.config["emb_model_path"]):
+            return os.path.join(self.config["emb_model_path"], file_name)
+        from huggingface_hub import hf_hub_download
+
+        return hf_hub_download(
+            repo_id=self.config["emb_model_path"], filename=file_name
+        )
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.array(
+                [e.type_ids for e in encodings], dtype=np.int64
+            )
+        hidden_states = self.session.run(None, inputs)[0]
+        if self.config["emb_pooling"] == "cls":
+            pooled = hidden_states[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype(hidden_states.dtype)
+            pooled = (hidden_states * mask).sum(axis=1) / np.maximum(
+                mask.sum(axis=1), 1e-9
+            )
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.maximum(norms, 1e-12)
+
+    def __call__(self, texts: Union[List[str], str]) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        batch_size = self.config.get("embedding_local_batch_size", 32)
+        # texts of similar length share a batch, which keeps padding short
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = np.zeros((len(texts), self.config["emb_size"]), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            batch = order[start : start + batch_size]
+            embeddings[batch] = self._embed_batch([texts[i] for i in batch])
+        return embeddings
+
+
+def construct_embedding_model(emb_config: Dict[str, Any]) -> EmbeddingModel:
+    if emb_config.get("emb_backend", "openai") == "onnx":
+        return ONNXEmbedding(emb_config=emb_config)
+    return OpenAIEmbedding(emb_config=emb_config)
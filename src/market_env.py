@@ -8,7 +8,7 @@ import orjson
 from loguru import logger
 from pydantic import BaseModel, ValidationError
 
-from .utils import ensure_path
+from .checkpoint import CheckpointOp, get_committed_dir, write_checkpoint_ops
 
 
 # return type
@@ -49,8 +49,7 @@ class MarketEnv:
         self.day_count = 0
         self.momentum_window = momentum_window_size
         self.market_price_series = {
-            symbol: np.array([])
-            for symbol in self.env_data.keys()  # type: ignore
+            symbol: np.array([]) for symbol in self.env_data.keys()  # type: ignore
         }
         self.momentum_series = {symbol: [] for symbol in self.env_data.keys()}  # type: ignore
 
@@ -223,7 +222,10 @@ class MarketEnv:
 
     def save_checkpoint(self, path: str) -> None:
         logger.info(f"ENV-Saving environment to {path}")
-        ensure_path(path)
+        write_checkpoint_ops(self.checkpoint_ops(path))
+        logger.info(f"ENV-Environment saved to {path}")
+
+    def checkpoint_ops(self, path: str) -> List[CheckpointOp]:
         state_dict = {
             "env_date_path": self.env_data_path,
             "start_date": self.update_start_date,
@@ -231,22 +233,25 @@ class MarketEnv:
             "symbol": self.symbols,
             "momentum_window_size": self.momentum_window,
         }
-        with open(os.path.join(path, "env_checkpoint.json"), "w") as f:
-            # json.dump(state_dict, f)
-            f.write(
-                orjson.dumps(
+        return [
+            CheckpointOp(kind="reset_dir", path=path),
+            CheckpointOp(
+                kind="write",
+                path=os.path.join(path, "env_checkpoint.json"),
+                data=orjson.dumps(
                     state_dict,
                     option=orjson.OPT_NON_STR_KEYS
                     | orjson.OPT_NAIVE_UTC
                     | orjson.OPT_INDENT_2
                     | orjson.OPT_SERIALIZE_NUMPY,
-                ).decode("utf-8")
-            )
-        logger.info(f"ENV-Environment saved to {path}")
+                ),
+            ),
+        ]
 
     @classmethod
     def load_checkpoint(cls, path: str) -> "MarketEnv":
         logger.info(f"ENV-Loading environment from {path}")
+        path = get_committed_dir(path)
         with open(os.path.join(path, "env_checkpoint.json"), "r") as f:
             env_config = json.load(f)
         env = cls(
@@ -1,21 +1,32 @@
+import io
+import math
 import os
+from abc import ABC, abstractmethod
 from datetime import date
 from enum import Enum
-from typing import Any, Dict, List, Literal, Tuple, Union
+from typing import Any, Dict, Iterable, List, Literal, Set, Tuple, Type, Union
 
+import httpx
 import numpy as np
 import orjson
 from loguru import logger
 from pydantic import BaseModel, NonNegativeInt
 from qdrant_client import QdrantClient
 from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
     Distance,
     FieldCondition,
     Filter,
     MatchValue,
+    PayloadSchemaType,
     PointIdsList,
     PointStruct,
+    QuantizationSearchParams,
     Range,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
     SearchParams,
     SearchRequest,
     SetPayload,
@@ -23,8 +34,8 @@ from qdrant_client.models import (
     VectorParams,
 )
 
-from .embedding import OpenAIEmbedding
-from .utils import ensure_path
+from .checkpoint import CheckpointOp, get_committed_dir, write_checkpoint_ops
+from .embedding import construct_embedding_model
 
 
 # memory functions
@@ -47,7 +58,7 @@ class LinearCompoundScore:
         self, similarity_score: float, importance_score: float, recency_score: float
     ) -> float:
         normalized_importance_score = (
-            min(importance_score, self.upper_bound) / self.upper_bound
+            np.minimum(importance_score, self.upper_bound) / self.upper_bound
         )
         return similarity_score + normalized_importance_score + recency_score
 
@@ -81,6 +92,62 @@ class ConstantRecencyInitialization:
         return 1.0
 
 
+MEMORY_LAYERS = ["short", "mid", "long", "reflection"]
+STORED_PAYLOAD_KEYS = [
+    "symbol",
+    "date",
+    "text",
+    "layer",
+    "access_counter",
+    "importance_base",
+    "importance_step",
+    "recency_step",
+    "recency_carry",
+    "recency_carry_step",
+]
+PAYLOAD_KEYS = [
+    "symbol",
+    "date",
+    "text",
+    "delta",
+    "importance",
+    "recency",
+    "access_counter",
+    "layer",
+]
+# stands in for log(importance) when importance is not positive, such records
+# are below every positive importance threshold, and for log(-importance) when
+# importance is not negative
+_MIN_LOG_IMPORTANCE = -1e300
+# recency_carry_step of memories that carry no recency over from another layer
+_NO_CARRY_STEP = -1
+# payload fields the Qdrant filters match on: symbol and layer in every
+# search, the importance and recency ranges in jumps and clean up
+_PAYLOAD_INDEXES = {
+    "symbol": PayloadSchemaType.KEYWORD,
+    "layer": PayloadSchemaType.KEYWORD,
+    "log_importance": PayloadSchemaType.FLOAT,
+    "log_neg_importance": PayloadSchemaType.FLOAT,
+    "recency_step": PayloadSchemaType.INTEGER,
+    "recency_carry": PayloadSchemaType.FLOAT,
+    "recency_carry_step": PayloadSchemaType.INTEGER,
+}
+
+
+def _quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # one scale per vector, cosine similarity does not depend on it
+    scales = np.abs(vectors).max(axis=1).astype(np.float32) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales
+
+
+def _get_npy_bytes(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
 # interface
 class MemorySingle(BaseModel):
     id: NonNegativeInt
@@ -154,71 +221,87 @@ class IDGenerator:
         return IDGenerator(id_init=id_init)
 
 
-class MemoryDB:
+class MemoryDBBase(ABC):
     def __init__(self, agent_config: Dict[str, Any], emb_config: Dict[str, Any]):
-        logger.info("SYS-Initializing MemoryDB")
         # init
         self.agent_config = agent_config
         self.memory_config = agent_config["memory_db_config"]
         self.emb_config = emb_config
         # embedding model
-        self.emb_model = OpenAIEmbedding(emb_config=self.emb_config)
-        # init database
-        self.connection_client = QdrantClient(
-            url=self.memory_config["memory_db_endpoint"]
-        )
-        logger.trace("Connect to Qdrant established")
-        if self.connection_client.collection_exists(
-            collection_name=self.agent_config["agent_name"]
-        ):
-            logger.trace(
-                f"SYS-Collection {self.agent_config['agent_name']} already exists, deleting"
-            )
-            self.connection_client.delete_collection(
-                collection_name=self.agent_config["agent_name"]
-            )
-        logger.trace(
-            f"SYS-Create collection {self.agent_config['agent_name']}, emb_size: {self.emb_config['emb_size']}"
-        )
-        self.connection_client.create_collection(
-            collection_name=self.agent_config["agent_name"],
-            vectors_config=VectorParams(
-                size=self.emb_config["emb_size"], distance=Distance.COSINE
-            ),
-        )
-
-    def _get_most_similar_score_in_layer(
-        self, layer: str, embs: List[List[float]], symbols: List[str]
-    ) -> List[float]:
-        search_queries = [
-            SearchRequest(
-                vector=cur_emb,
-                limit=1,
-                with_payload=False,
-                with_vector=False,
-                params=SearchParams(exact=True),
-                filter=Filter(
-                    must=[
-                        FieldCondition(
-                            key="symbol", match=MatchValue(value=cur_symbol)
-                        ),
-                        FieldCondition(key="layer", match=MatchValue(value=layer)),
-                    ]
-                ),
+        self.emb_model = construct_embedding_model(emb_config=self.emb_config)
+        # query embeddings keyed by (embedding model, query text)
+        self.query_emb_cache: Dict[Tuple[str, str], np.ndarray] = {}
+        # decay is lazy: each memory keeps its importance and the decay step at
+        # which it was set, plus the decay step at which its recency was reset,
+        # and the current values are derived from the number of decay steps
+        self.decay_steps: Dict[str, int] = {layer: 0 for layer in MEMORY_LAYERS}
+        self.decay_params: Dict[str, Tuple[float, float]] = {
+            layer: (
+                self.memory_config[layer]["decay_importance_factor"],
+                self.memory_config[layer]["decay_recency_factor"],
             )
-            for cur_emb, cur_symbol in zip(embs, symbols)
+            for layer in MEMORY_LAYERS
+        }
+        # the importance filters take the log of the decay rate
+        for layer, (decay_rate, _) in self.decay_params.items():
+            if not 0 < decay_rate <= 1:
+                raise ValueError(
+                    f"decay_importance_factor of {layer} memory should be in (0, 1], got {decay_rate}"
+                )
+        # write-ahead log checkpoints: ids touched since the last checkpoint,
+        # and where the snapshot the log extends lives
+        self.wal_added: Set[int] = set()
+        self.wal_updated: Set[int] = set()
+        self.wal_deleted: Set[int] = set()
+        self.wal_path: Union[str, None] = None
+        self.wal_snapshot_step = 0
+        self.checkpoint_step = 0
+
+    def _journal_changes(
+        self,
+        added: Iterable[int] = (),
+        updated: Iterable[int] = (),
+        deleted: Iterable[int] = (),
+    ) -> None:
+        if self.memory_config.get("memory_checkpoint_wal_interval") is None:
+            return
+        self.wal_added.update(added)
+        self.wal_updated.update(updated)
+        self.wal_deleted.update(deleted)
+
+    def close(self) -> None:
+        self.emb_model.close()
+
+    def cache_query_embeddings(self, query_texts: List[str]) -> None:
+        emb_model_name = self.emb_config["emb_model_name"]
+        to_emb = [
+            t
+            for t in dict.fromkeys(query_texts)
+            if (emb_model_name, t) not in self.query_emb_cache
         ]
-        search_results = self.connection_client.search_batch(
-            collection_name=self.agent_config["agent_name"], requests=search_queries
+        if not to_emb:
+            return
+        logger.trace(f"MEM-Caching embeddings for {len(to_emb)} query texts")
+        for cur_text, cur_emb in zip(to_emb, self.emb_model(texts=to_emb)):
+            self.query_emb_cache[(emb_model_name, cur_text)] = cur_emb
+
+    def _get_query_embeddings(
+        self,
+        query_input: Queries,
+        query_vectors: Union[np.ndarray, List[List[float]], None] = None,
+    ) -> np.ndarray:
+        # keep the dtype of the embeddings, casting float64 query vectors to
+        # float32 changes the scores and the order of ties in Qdrant
+        if query_vectors is not None:
+            return np.asarray(query_vectors)
+        query_texts = [r.query_text for r in query_input.query_records]
+        self.cache_query_embeddings(query_texts)
+        emb_model_name = self.emb_config["emb_model_name"]
+        return np.asarray(
+            [self.query_emb_cache[(emb_model_name, t)] for t in query_texts]
         )
-        ret_results = []
-        for s in search_results:
-            if len(s) == 0:
-                ret_results.append(0.0)
-            else:
-                ret_results.append(s[0].score)
-        return ret_results
 
+    @abstractmethod
     def add_memory(
         self,
         memory_input: List[Dict],
@@ -227,434 +310,150 @@ class MemoryDB:
         recency_init_func: ConstantRecencyInitialization,
         similarity_threshold: float | None = None,
     ) -> List[NonNegativeInt]:
-        if not memory_input:
-            return []
-        memories = Memories(memory_records=memory_input)  # type: ignore
-        logger.trace(f"MEM-Adding memories: {memories}")
-        memories_records = memories.memory_records
-        to_emb_texts = [m.text for m in memories_records]
-        text_embs = self.emb_model(texts=to_emb_texts)
-        if similarity_threshold is not None:
-            symbol_list = [m.symbol for m in memories_records]
-            most_similar_score = self._get_most_similar_score_in_layer(
-                layer=layer, embs=text_embs, symbols=symbol_list
-            )
-        # construct points
-        points = []
-        id_list = []
-        if similarity_threshold is None:
-            for cur_m, cur_emb in zip(memories_records, text_embs):
-                points.append(
-                    PointStruct(
-                        id=cur_m.id,
-                        payload={
-                            "symbol": cur_m.symbol,
-                            "date": cur_m.date.isoformat(),
-                            "text": cur_m.text,
-                            "delta": 0,
-                            "importance": importance_init_func(),
-                            "recency": recency_init_func(),
-                            "access_counter": 0,
-                            "layer": layer,
-                        },
-                        vector=cur_emb,
-                    )
-                )
-                id_list.append(cur_m.id)
-                logger.trace(
-                    f"MEM-Adding memory: id: {cur_m.id}, symbol: {cur_m.symbol}, date: {cur_m.date}, delta: 0, importance: {importance_init_func()}, recency: {recency_init_func()}, access_counter: 0, layer: {layer}"
-                )
-        else:
-            for cur_m, cur_emb, cur_sim in zip(
-                memories_records, text_embs, most_similar_score
-            ):
-                if cur_sim < similarity_threshold:
-                    points.append(
-                        PointStruct(
-                            id=cur_m.id,
-                            payload={
-                                "symbol": cur_m.symbol,
-                                "date": cur_m.date.isoformat(),
-                                "text": cur_m.text,
-                                "delta": 0,
-                                "importance": importance_init_func(),
-                                "recency": recency_init_func(),
-                                "access_counter": 0,
-                                "layer": layer,
-                            },
-                            vector=cur_emb,
-                        )
-                    )
-                    id_list.append(cur_m.id)
-                    logger.trace(
-                        f"MEM-Adding memory: id: {cur_m.id}, symbol: {cur_m.symbol}, date: {cur_m.date}, delta: 0, importance: {importance_init_func()}, recency: {recency_init_func()}, access_counter: 0, layer: {layer}"
-                    )
-                else:
-                    logger.trace(
-                        f"MEM-Skipping memory: id: {cur_m.id}, symbol: {cur_m.symbol}, date: {cur_m.date}, delta: 0, importance: {importance_init_func()}, recency: {recency_init_func()}, access_counter: 0, layer: {layer}"
-                    )
-        # upload to db
-        if points:
-            self.connection_client.upsert(
-                collection_name=self.agent_config["agent_name"],
-                points=points,
-                wait=True,
-            )
-            logger.trace("MEM-Adding memories finished")
-            return id_list
-        else:
-            logger.trace("MEM-No memories to add")
-            return []
+        pass
 
-    def _count_num_records(
-        self, layer: Union[str, None] = None, symbol: Union[str, None] = None
-    ) -> int:
-        if layer or symbol:
-            filter_condition = self._filter_by_layer_and_symbol(layer, symbol)
-            layer_filter = Filter(must=filter_condition)
-            return self.connection_client.count(
-                collection_name=self.agent_config["agent_name"],
-                count_filter=layer_filter,
-            ).count
-        else:
-            return self.connection_client.count(
-                collection_name=self.agent_config["agent_name"]
-            ).count
+    def query(
+        self,
+        query_input: Queries,
+        layer: str,
+        linear_compound_func: LinearCompoundScore,
+        query_vectors: Union[np.ndarray, List[List[float]], None] = None,
+    ) -> List[Tuple[List[str], List[int]]]:
+        return self.query_layers(
+            query_input=query_input,
+            layers=[layer],
+            linear_compound_func=linear_compound_func,
+            query_vectors=query_vectors,
+        )[layer]
+
+    @abstractmethod
+    def query_layers(
+        self,
+        query_input: Queries,
+        layers: List[str],
+        linear_compound_func: LinearCompoundScore,
+        query_vectors: Union[np.ndarray, List[List[float]], None] = None,
+    ) -> Dict[str, List[Tuple[List[str], List[int]]]]:
+        pass
+
+    def _get_search_limit(self, num_records: int, k: int) -> int:
+        # by default the whole layer is re-ranked by compound score, with an
+        # over-fetch size only the most similar records are re-ranked
+        over_fetch = self.memory_config.get("memory_query_over_fetch")
+        if over_fetch is None:
+            return num_records
+        return min(num_records, max(over_fetch, k))
+
+    @abstractmethod
+    def prepare_jump(
+        self, jump_direction: JumpDirection, layer: str, threshold: float
+    ) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def accept_jump(
+        self,
+        jump_dict: List[Dict[str, Any]],
+        jump_direction: JumpDirection,
+        recency_init_func: Union[ConstantRecencyInitialization, None],
+        target_layer: str,
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def update_access_counter_with_feedback(
+        self,
+        access_feedback: Union[AccessFeedback, AccessFeedbackMulti],
+        access_counter_update_func: ConstantAccessCounterUpdateFunction,
+    ) -> None:
+        pass
 
+    def decay(
+        self,
+        importance_decay_func: ImportanceDecay,
+        recency_decay_func: RecencyDecay,
+        layer: str,
+    ) -> None:
+        # nothing is rewritten, the derived values of the layer move one step
+        self.decay_params[layer] = (
+            importance_decay_func.decay_rate,
+            recency_decay_func.recency_factor,
+        )
+        self.decay_steps[layer] += 1
+
+    def _get_importance(self, importance_base, importance_step, layer: str):
+        decay_rate = self.decay_params[layer][0]
+        return importance_base * decay_rate ** (
+            self.decay_steps[layer] - importance_step
+        )
+
+    def _get_delta(self, recency_step, layer: str):
+        return self.decay_steps[layer] - recency_step
+
+    def _get_recency(self, recency_step, recency_carry, recency_carry_step, layer: str):
+        recency_factor = self.decay_params[layer][1]
+        recency = np.exp(-(self._get_delta(recency_step, layer) / recency_factor))
+        return np.where(
+            recency_carry_step == self.decay_steps[layer], recency_carry, recency
+        )
+
+    def _get_recency_carry(
+        self, recency: float, delta: int, layer: str
+    ) -> Tuple[float, int]:
+        # a memory that jumps down keeps the recency it had in its old layer
+        # until the next decay of its new layer, as when recency was stored
+        if recency == np.exp(-(delta / self.decay_params[layer][1])):
+            return 0.0, _NO_CARRY_STEP
+        return float(recency), self.decay_steps[layer]
+
+    @abstractmethod
+    def clean_up(
+        self, importance_threshold: float, recency_threshold: float, layer: str
+    ) -> None:
+        pass
+
+    @abstractmethod
     def _get_record_dict(
         self,
         with_vector: bool = True,
         layer: Union[None, str] = None,
         symbol: Union[str, None] = None,
     ) -> List[Dict[str, Union[int, List[float], Dict]]]:
-        # get total number of item
-        total_num_record = self._count_num_records(layer=layer, symbol=symbol)
-        if total_num_record == 0:
-            return []
+        pass
 
-        # get record
-        if layer or symbol:
-            filter_condition = self._filter_by_layer_and_symbol(layer, symbol)
-            all_memory_record = self.connection_client.scroll(
-                collection_name=self.agent_config["agent_name"],
-                limit=total_num_record,
-                scroll_filter=Filter(must=filter_condition),
-                with_payload=True,
-                with_vectors=with_vector,
-            )[0]
-        else:
-            all_memory_record = self.connection_client.scroll(
-                collection_name=self.agent_config["agent_name"],
-                limit=total_num_record,
-                with_payload=True,
-                with_vectors=with_vector,
-            )[0]
+    @abstractmethod
+    def _load_records(self, memories: List[Dict[str, Any]]) -> None:
+        pass
 
-        # format for return
-        all_memories = []
-        for r in all_memory_record:
-            if with_vector:
-                all_memories.append(
-                    {"id": r.id, "payload": r.payload, "vector": r.vector}
-                )
-            else:
-                all_memories.append({"id": r.id, "payload": r.payload})
-        return all_memories
+    # records in their stored form, with the lazy decay fields instead of the
+    # derived importance, recency and delta, used by the write-ahead log
+    @abstractmethod
+    def _get_stored_records(
+        self, ids: List[int], with_vector: bool
+    ) -> List[Dict[str, Any]]:
+        pass
 
-    @staticmethod
-    def _filter_by_layer_and_symbol(layer, symbol):
-        """
-        Filter data by layer and symbol.
+    @abstractmethod
+    def _put_stored_records(self, records: List[Dict[str, Any]]) -> None:
+        pass
 
-        Args:
-            layer (str): The layer to filter by.
-            symbol (str): The symbol to filter by.
+    @abstractmethod
+    def _delete_records(self, ids: List[int]) -> None:
+        pass
 
-        Returns:
-            Filtered data based on layer and symbol.
-        """
-        result = []
-        if layer:
-            result.append(FieldCondition(key="layer", match=MatchValue(value=layer)))
-        if symbol:
-            result.append(FieldCondition(key="symbol", match=MatchValue(value=symbol)))
-        return result
+    def __eq__(self, another_db) -> bool:
+        emb_config_condition = self.emb_config == another_db.emb_config
+        memory_config_condition = self.memory_config == another_db.memory_config
+        config_condition = emb_config_condition and memory_config_condition
 
-    def query(
-        self,
-        query_input: Queries,
-        layer: str,
-        linear_compound_func: LinearCompoundScore,
-    ) -> List[Tuple[List[str], List[int]]]:
-        # generate embedding
-        to_emb = [r.query_text for r in query_input.query_records]
-        emb_vector = self.emb_model(texts=to_emb)
-        query_records = [
-            {
-                "query_vector": cur_emb,
-                "query_text": cur_query.query_text,
-                "k": cur_query.k,
-                "symbol": cur_query.symbol,
-            }
-            for cur_emb, cur_query in zip(emb_vector, query_input.query_records)
-        ]
-        # construct request
-        query_result = {}
-        search_requests = []
-        search_queries = []
-        for cur_query in query_records:
-            cur_count = self._count_num_records(layer=layer, symbol=cur_query["symbol"])
-            if cur_count == 0:
-                query_result[orjson.dumps(cur_query)] = ([], [])
-                continue
-            cur_search_query = SearchRequest(
-                vector=cur_query["query_vector"],
-                limit=cur_count,
-                with_payload=True,
-                params=SearchParams(exact=True),
-                filter=Filter(
-                    must=[
-                        FieldCondition(
-                            key="symbol", match=MatchValue(value=cur_query["symbol"])
-                        ),
-                        FieldCondition(key="layer", match=MatchValue(value=layer)),
-                    ]
-                ),
-            )
-            search_requests.append(cur_search_query)
-            search_queries.append(cur_query)
-
-        # search
-        search_results = self.connection_client.search_batch(
-            collection_name=self.agent_config["agent_name"], requests=search_requests
-        )
-        for cur_query, cur_result in zip(search_queries, search_results):
-            cur_result_subset = sorted(
-                [
-                    {
-                        "compound_score": linear_compound_func(
-                            similarity_score=r.score,
-                            importance_score=r.payload["importance"],  # type: ignore
-                            recency_score=r.payload["recency"],  # type: ignore
-                        ),
-                        "text": r.payload["text"],  # type: ignore
-                        "id": r.id,
-                    }
-                    for r in cur_result
-                ],
-                key=lambda x: -x["compound_score"],  # type: ignore
-            )[: cur_query["k"]]
-            cur_text = [i["text"] for i in cur_result_subset]
-            cur_ids = [i["id"] for i in cur_result_subset]
-            query_result[orjson.dumps(cur_query)] = (cur_text, cur_ids)
-
-        return [query_result[orjson.dumps(q)] for q in query_records]
-
-    def prepare_jump(
-        self, jump_direction: JumpDirection, layer: str, threshold: float
-    ) -> List[Dict[str, Any]]:
-        record_count = self._count_num_records(layer=layer)
-        if record_count == 0:
-            return []
-
-        # get filter
-        if jump_direction == JumpDirection.UP:
-            filter_condition = Filter(
-                must=[
-                    FieldCondition(
-                        key="importance",
-                        range=Range(gte=threshold),
-                    ),
-                    FieldCondition(key="layer", match=MatchValue(value=layer)),
-                ]
-            )
-        else:
-            filter_condition = Filter(
-                must=[
-                    FieldCondition(
-                        key="importance",
-                        range=Range(lt=threshold),
-                    ),
-                    FieldCondition(key="layer", match=MatchValue(value=layer)),
-                ]
-            )
-
-        # get all records
-        all_records = self.connection_client.scroll(
-            collection_name=self.agent_config["agent_name"],
-            scroll_filter=filter_condition,
-            with_vectors=True,
-            limit=record_count,
-        )[0]
-        to_delete_ids = []
-        jump_records = []
-        for r in all_records:
-            jump_records.append({"id": r.id, "payload": r.payload, "vector": r.vector})
-            to_delete_ids.append(r.id)
-
-        # delete
-        if to_delete_ids:
-            self.connection_client.delete(
-                collection_name=self.agent_config["agent_name"],
-                points_selector=PointIdsList(points=to_delete_ids),
-            )
-
-        return jump_records
-
-    def accept_jump(
-        self,
-        jump_dict: List[Dict[str, Any]],
-        jump_direction: JumpDirection,
-        recency_init_func: Union[ConstantRecencyInitialization, None],
-        target_layer: str,
-    ) -> None:
-        if jump_dict:
-            add_points = []
-            for r in jump_dict:
-                if jump_direction == JumpDirection.UP:
-                    if recency_init_func is None:
-                        raise ValueError(
-                            "recency_init_func should not be None if jump up"
-                        )
-                    r["payload"]["recency"] = recency_init_func()
-                    r["payload"]["delta"] = 0
-                r["payload"]["layer"] = target_layer
-                add_points.append(
-                    PointStruct(id=r["id"], payload=r["payload"], vector=r["vector"])
-                )
-            self.connection_client.upsert(
-                collection_name=self.agent_config["agent_name"],
-                points=add_points,
-                wait=True,
-            )
-
-    def update_access_counter_with_feedback(
-        self,
-        access_feedback: Union[AccessFeedback, AccessFeedbackMulti],
-        access_counter_update_func: ConstantAccessCounterUpdateFunction,
-    ) -> None:
-        # get points
-        if isinstance(access_feedback, AccessFeedback):
-            point_ids = [a.id for a in access_feedback.access_counter_records]
-            retrieved_points = self.connection_client.retrieve(
-                collection_name=self.agent_config["agent_name"],
-                ids=point_ids,  # type: ignore
-                with_payload=True,
-                with_vectors=True,
-            )
-
-            new_points = []
-            for r, f in zip(retrieved_points, access_feedback.access_counter_records):
-                cur_payload = r.payload
-                cur_payload["access_counter"] += f.feedback  # type: ignore
-                cur_payload["importance"] = access_counter_update_func(  # type: ignore
-                    cur_importance_score=cur_payload["importance"],  # type: ignore
-                    direction=f.feedback,  # type: ignore
-                )
-                new_points.append(
-                    PointStruct(id=r.id, vector=r.vector, payload=cur_payload)  # type: ignore
-                )
-            if new_points:
-                self.connection_client.upsert(
-                    collection_name=self.agent_config["agent_name"], points=new_points
-                )
-        else:
-            for cur_asset in access_feedback.access_counter_records:
-                point_ids = cur_asset.id
-                retrieved_points = self.connection_client.retrieve(
-                    collection_name=self.agent_config["agent_name"],
-                    ids=point_ids,  # type: ignore
-                    with_payload=True,
-                    with_vectors=True,
-                )
-
-                new_points = []
-                for r, f in zip(retrieved_points, cur_asset.feedback):
-                    cur_payload = r.payload
-                    cur_payload["access_counter"] += f  # type: ignore
-                    cur_payload["importance"] = access_counter_update_func(  # type: ignore
-                        cur_importance_score=cur_payload["importance"],  # type: ignore
-                        direction=f,
-                    )  # type: ignore
-                    new_points.append(
-                        PointStruct(id=r.id, vector=r.vector, payload=cur_payload)  # type: ignore
-                    )
-
-                if new_points:
-                    self.connection_client.upsert(
-                        collection_name=self.agent_config["agent_name"],
-                        points=new_points,
-                    )
-
-    def __eq__(self, another_db) -> bool:
-        emb_config_condition = self.emb_config == another_db.emb_config
-        memory_config_condition = self.memory_config == another_db.memory_config
-        config_condition = emb_config_condition and memory_config_condition
-
-        our_brain_records = self._get_record_dict()
-        our_brain_records = sorted(our_brain_records, key=lambda x: x["id"])  # type: ignore
-        another_brain_records = self._get_record_dict()
-        another_brain_records = sorted(another_brain_records, key=lambda x: x["id"])  # type: ignore
-        record_condition = our_brain_records == another_brain_records
+        our_brain_records = self._get_record_dict()
+        our_brain_records = sorted(our_brain_records, key=lambda x: x["id"])  # type: ignore
+        another_brain_records = another_db._get_record_dict()
+        another_brain_records = sorted(another_brain_records, key=lambda x: x["id"])  # type: ignore
+        record_condition = our_brain_records == another_brain_records
 
         return config_condition and record_condition
 
-    def decay(
-        self,
-        importance_decay_func: ImportanceDecay,
-        recency_decay_func: RecencyDecay,
-        layer: str,
-    ) -> None:
-        all_records = self._get_record_dict(with_vector=False, layer=layer)
-        update_operations = []
-
-        for r in all_records:
-            cur_id = r["id"]
-            cur_new_delta = r["payload"]["delta"] + 1  # type: ignore
-            cur_new_importance = importance_decay_func(
-                cur_val=r["payload"]["importance"]  # type: ignore
-            )
-            cur_new_recency = recency_decay_func(delta=cur_new_delta)
-            update_operations.append(
-                SetPayloadOperation(
-                    set_payload=SetPayload(
-                        payload={
-                            "delta": cur_new_delta,
-                            "importance": cur_new_importance,
-                            "recency": cur_new_recency,
-                        },
-                        points=[cur_id],  # type: ignore
-                    )
-                )
-            )
-
-        self.connection_client.batch_update_points(
-            collection_name=self.agent_config["agent_name"],
-            update_operations=update_operations,
-        )
-
-    def clean_up(
-        self, importance_threshold: float, recency_threshold: float, layer: str
-    ) -> None:
-        self.connection_client.delete(
-            collection_name=self.agent_config["agent_name"],
-            points_selector=Filter(
-                must=[
-                    FieldCondition(key="layer", match=MatchValue(value=layer)),
-                    Filter(
-                        should=[
-                            FieldCondition(
-                                key="importance", range=Range(lt=importance_threshold)
-                            ),
-                            FieldCondition(
-                                key="recency", range=Range(lt=recency_threshold)
-                            ),
-                        ]
-                    ),
-                ]
-            ),
-        )
-
     def memory_flow(
         self,
         jump_threshold_dict: Dict[str, Dict[str, float]],
@@ -731,41 +530,1914 @@ class MemoryDB:
                 target_layer="mid",
             )
 
+    def _get_record_columns(
+        self,
+    ) -> Tuple[np.ndarray, np.ndarray, Dict[str, List[Any]]]:
+        all_memories = self._get_record_dict(with_vector=True)
+        ids = np.asarray([m["id"] for m in all_memories], dtype=np.int64)
+        vectors = np.asarray(
+            [m["vector"] for m in all_memories], dtype=np.float32
+        ).reshape(len(all_memories), self.emb_config["emb_size"])
+        payloads = {
+            key: [m["payload"][key] for m in all_memories]  # type: ignore
+            for key in PAYLOAD_KEYS
+        }
+        return ids, vectors, payloads
+
+    def _load_record_columns(
+        self, ids: np.ndarray, vectors: np.ndarray, payloads: Dict[str, List[Any]]
+    ) -> None:
+        self._load_records(
+            [
+                {
+                    "id": cur_id,
+                    "payload": {key: payloads[key][i] for key in PAYLOAD_KEYS},
+                    "vector": cur_vector,
+                }
+                for i, (cur_id, cur_vector) in enumerate(
+                    zip(ids.tolist(), vectors.astype(np.float32).tolist())
+                )
+            ]
+        )
+
     def save_checkpoint(
         self,
         path: str,
     ) -> None:
-        # ensure save path
+        write_checkpoint_ops(self.checkpoint_ops(path))
+
+    def checkpoint_ops(self, path: str) -> List[CheckpointOp]:
+        # the records are read now, encoding and writing can happen later
+        wal_interval = self.memory_config.get("memory_checkpoint_wal_interval")
+        if wal_interval is None:
+            return self._snapshot_ops(path)
+        # append the changes of this step to the log, and compact the log into
+        # a new snapshot every wal_interval checkpoints
+        self.checkpoint_step += 1
+        if (
+            path != self.wal_path
+            or self.checkpoint_step - self.wal_snapshot_step >= wal_interval
+        ):
+            wal_state = {
+                "step": self.checkpoint_step,
+                "decay_steps": dict(self.decay_steps),
+            }
+            ops = self._snapshot_ops(path) + [
+                CheckpointOp(
+                    kind="write",
+                    path=os.path.join(path, "brain", "wal_state.json"),
+                    data=orjson.dumps(wal_state),
+                ),
+                # truncate the log, entries up to the snapshot step are skipped
+                # on load anyway if this does not happen
+                CheckpointOp(
+                    kind="write", path=os.path.join(path, "wal.jsonl"), data=b""
+                ),
+            ]
+            self.wal_path = path
+            self.wal_snapshot_step = self.checkpoint_step
+        else:
+            ops = [self._wal_op(path)]
+        self.wal_added.clear()
+        self.wal_updated.clear()
+        self.wal_deleted.clear()
+        return ops
+
+    def _wal_op(self, path: str) -> CheckpointOp:
+        # ids added and removed within the step never reach the log
+        deleted = self.wal_deleted - self.wal_added
+        added = self.wal_added - self.wal_deleted
+        updated = self.wal_updated - self.wal_added - self.wal_deleted
+        entry = {
+            "step": self.checkpoint_step,
+            "decay_steps": dict(self.decay_steps),
+            "records": self._get_stored_records(sorted(added), with_vector=True)
+            + self._get_stored_records(sorted(updated), with_vector=False),
+            "deleted": sorted(deleted),
+        }
+        logger.trace(
+            f"MEM-Appending checkpoint log step {self.checkpoint_step}, added: {len(added)}, updated: {len(updated)}, deleted: {len(deleted)}"
+        )
+        return CheckpointOp(
+            kind="append",
+            path=os.path.join(path, "wal.jsonl"),
+            data=lambda: orjson.dumps(entry, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n",
+        )
+
+    def _replay_wal(self, path: str) -> None:
+        wal_path = os.path.join(path, "wal.jsonl")
+        if not os.path.exists(wal_path):
+            return
+        with open(wal_path, "rb") as f:
+            for line in f:
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # torn write of the last entry
+                    logger.warning("MEM-Skipping incomplete checkpoint log entry")
+                    break
+                if entry["step"] <= self.checkpoint_step:
+                    continue
+                self.decay_steps.update(entry["decay_steps"])
+                self._delete_records(entry["deleted"])
+                self._put_stored_records(entry["records"])
+                self.checkpoint_step = entry["step"]
+
+    def _snapshot_ops(self, path: str) -> List[CheckpointOp]:
         save_path = os.path.join(path, "brain")
-        ensure_path(save_path)
-        # extract memories
-        all_memories = self._get_record_dict(with_vector=True)
-        # save
-        with open(os.path.join(path, "brain", "memories.json"), "w") as f:
-            f.write(orjson.dumps(all_memories).decode())
-        with open(os.path.join(path, "brain", "agent_config.json"), "w") as f:
-            f.write(orjson.dumps(self.agent_config).decode())
-        with open(os.path.join(path, "brain", "emb_config.json"), "w") as f:
-            f.write(orjson.dumps(self.emb_config).decode())
+        ops = [CheckpointOp(kind="reset_dir", path=save_path)]
+        # memories
+        if self.memory_config.get("memory_checkpoint_format", "json") == "binary":
+            # vectors as a raw npy blob, payloads as one json list per field
+            ids, vectors, payloads = self._get_record_columns()
+            checkpoint_dtype = self.memory_config.get(
+                "memory_checkpoint_dtype", "float32"
+            )
+            if checkpoint_dtype == "int8":
+                vectors, scales = _quantize_int8(vectors)
+                ops.append(
+                    CheckpointOp(
+                        kind="write",
+                        path=os.path.join(save_path, "vector_scales.npy"),
+                        data=lambda: _get_npy_bytes(scales),
+                    )
+                )
+            else:
+                vectors = vectors.astype(checkpoint_dtype)
+            ops += [
+                CheckpointOp(
+                    kind="write",
+                    path=os.path.join(save_path, "ids.npy"),
+                    data=lambda: _get_npy_bytes(ids),
+                ),
+                CheckpointOp(
+                    kind="write",
+                    path=os.path.join(save_path, "vectors.npy"),
+                    data=lambda: _get_npy_bytes(vectors),
+                ),
+                CheckpointOp(
+                    kind="write",
+                    path=os.path.join(save_path, "payloads.json"),
+                    data=lambda: orjson.dumps(payloads),
+                ),
+            ]
+        else:
+            all_memories = self._get_record_dict(with_vector=True)
+            ops.append(
+                CheckpointOp(
+                    kind="write",
+                    path=os.path.join(save_path, "memories.json"),
+                    data=lambda: orjson.dumps(all_memories),
+                )
+            )
+        # configs
+        ops += [
+            CheckpointOp(
+                kind="write",
+                path=os.path.join(save_path, "agent_config.json"),
+                data=orjson.dumps(self.agent_config),
+            ),
+            CheckpointOp(
+                kind="write",
+                path=os.path.join(save_path, "emb_config.json"),
+                data=orjson.dumps(self.emb_config),
+            ),
+        ]
+        return ops
 
     @classmethod
-    def load_checkpoint(cls, path: str) -> "MemoryDB":
-        # load data
-        with open(os.path.join(path, "brain", "memories.json"), "r") as f:
-            memories = orjson.loads(f.read())
-        with open(os.path.join(path, "brain", "agent_config.json"), "r") as f:
+    def load_checkpoint(cls, path: str) -> "MemoryDBBase":
+        # load configs
+        load_path = get_committed_dir(os.path.join(path, "brain"))
+        with open(os.path.join(load_path, "agent_config.json"), "r") as f:
             agent_config = orjson.loads(f.read())
-        with open(os.path.join(path, "brain", "emb_config.json"), "r") as f:
+        with open(os.path.join(load_path, "emb_config.json"), "r") as f:
             emb_config = orjson.loads(f.read())
         # init memoryDB
         new_memory_db = cls(agent_config=agent_config, emb_config=emb_config)
-        if memories:
-            points = [
-                PointStruct(id=m["id"], payload=m["payload"], vector=m["vector"])
-                for m in memories
+        # snapshot of a write-ahead log checkpoint, the memories are rebased at
+        # the decay steps the snapshot was taken at
+        wal_state = None
+        if os.path.exists(os.path.join(load_path, "wal_state.json")):
+            with open(os.path.join(load_path, "wal_state.json"), "rb") as f:
+                wal_state = orjson.loads(f.read())
+            new_memory_db.decay_steps.update(wal_state["decay_steps"])
+        # load memories, the format is given by the files in the checkpoint
+        if os.path.exists(os.path.join(load_path, "vectors.npy")):
+            ids = np.load(os.path.join(load_path, "ids.npy"))
+            vectors = np.load(os.path.join(load_path, "vectors.npy"), mmap_mode="r")
+            checkpoint_dtype = vectors.dtype
+            if os.path.exists(os.path.join(load_path, "vector_scales.npy")):
+                scales = np.load(os.path.join(load_path, "vector_scales.npy"))
+                vectors = vectors.astype(np.float32) * scales[:, None]
+            # float16 and int8 vectors come back slightly off unit length
+            if checkpoint_dtype != np.float32:
+                vectors = _normalize_rows(vectors)
+            with open(os.path.join(load_path, "payloads.json"), "rb") as f:
+                payloads = orjson.loads(f.read())
+            if len(ids) > 0:
+                new_memory_db._load_record_columns(ids, vectors, payloads)
+        else:
+            with open(os.path.join(load_path, "memories.json"), "r") as f:
+                memories = orjson.loads(f.read())
+            if memories:
+                new_memory_db._load_records(memories)
+        # replay the log
+        if wal_state is not None:
+            new_memory_db.checkpoint_step = wal_state["step"]
+            new_memory_db.wal_snapshot_step = wal_state["step"]
+            new_memory_db._replay_wal(path)
+            new_memory_db.wal_path = path
+        return new_memory_db
+
+
+def _construct_qdrant_client(memory_config: Dict[str, Any]) -> QdrantClient:
+    # embedded mode runs Qdrant in process, either in memory (":memory:") or
+    # persisted to a local directory, so no server is needed
+    local_path = memory_config.get("memory_db_local_path")
+    if local_path is None:
+        client_kwargs: Dict[str, Any] = {}
+        max_connections = memory_config.get("memory_db_max_connections")
+        max_keepalive = memory_config.get("memory_db_max_keepalive_connections")
+        if max_connections is not None or max_keepalive is not None:
+            # qdrant-client turns keep-alive off for localhost by default, a
+            # pool of kept-alive connections saves a handshake per REST request
+            client_kwargs["limits"] = httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+            )
+        if memory_config.get("memory_db_prefer_grpc", False):
+            logger.info("SYS-Connecting to Qdrant over gRPC")
+        return QdrantClient(
+            url=memory_config["memory_db_endpoint"],
+            prefer_grpc=memory_config.get("memory_db_prefer_grpc", False),
+            grpc_port=memory_config.get("memory_db_grpc_port", 6334),
+            timeout=memory_config.get("memory_db_timeout"),
+            **client_kwargs,
+        )
+    logger.info(f"SYS-Using embedded Qdrant at {local_path}")
+    if local_path == ":memory:":
+        return QdrantClient(location=":memory:")
+    return QdrantClient(path=local_path)
+
+
+class MemoryDB(MemoryDBBase):
+    def __init__(self, agent_config: Dict[str, Any], emb_config: Dict[str, Any]):
+        logger.info("SYS-Initializing MemoryDB")
+        super().__init__(agent_config=agent_config, emb_config=emb_config)
+        # init database
+        self.connection_client = _construct_qdrant_client(self.memory_config)
+        logger.trace("Connect to Qdrant established")
+        if self.connection_client.collection_exists(
+            collection_name=self.agent_config["agent_name"]
+        ):
+            logger.trace(
+                f"SYS-Collection {self.agent_config['agent_name']} already exists, deleting"
+            )
+            self.connection_client.delete_collection(
+                collection_name=self.agent_config["agent_name"]
+            )
+        logger.trace(
+            f"SYS-Create collection {self.agent_config['agent_name']}, emb_size: {self.emb_config['emb_size']}"
+        )
+        self.connection_client.create_collection(
+            collection_name=self.agent_config["agent_name"],
+            vectors_config=VectorParams(
+                size=self.emb_config["emb_size"], distance=Distance.COSINE
+            ),
+            quantization_config=self._get_quantization_config(),
+        )
+        # filters scan every point without payload indexes, local mode has none
+        use_payload_index = self.memory_config.get("memory_db_payload_index", True)
+        if use_payload_index and self.memory_config.get("memory_db_local_path") is None:
+            for cur_field, cur_schema in _PAYLOAD_INDEXES.items():
+                self.connection_client.create_payload_index(
+                    collection_name=self.agent_config["agent_name"],
+                    field_name=cur_field,
+                    field_schema=cur_schema,
+                    wait=True,
+                )
+            logger.trace(f"SYS-Created payload indexes on {list(_PAYLOAD_INDEXES)}")
+        # number of records per (symbol, layer), kept in sync locally so that
+        # counting never needs a round trip to the server
+        self.record_counts: Dict[Tuple[str, str], int] = {}
+
+    def close(self) -> None:
+        super().close()
+        # an embedded Qdrant directory can only be opened by one client
+        self.connection_client.close()
+
+    def _get_quantization_config(
+        self,
+    ) -> Union[ScalarQuantization, BinaryQuantization, None]:
+        # the quantized vectors are kept in RAM for the candidate search, the
+        # full precision ones can stay on disk for rescoring
+        quantization = self.memory_config.get("memory_db_quantization", "none")
+        if quantization == "int8":
+            return ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=True)
+            )
+        if quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def _get_search_params(self) -> SearchParams:
+        # exact search ignores quantized vectors, so with quantization the
+        # candidates come from the quantized index and only the top
+        # limit * oversampling of them are rescored with the original vectors
+        if self.memory_config.get("memory_db_quantization", "none") == "none":
+            return SearchParams(exact=True)
+        return SearchParams(
+            quantization=QuantizationSearchParams(
+                rescore=self.memory_config.get("memory_db_quantization_rescore", True),
+                oversampling=self.memory_config.get(
+                    "memory_db_quantization_oversampling", 2.0
+                ),
+            )
+        )
+
+    def _update_record_counts(self, symbols: List[str], layer: str, step: int) -> None:
+        for cur_symbol in symbols:
+            cur_key = (cur_symbol, layer)
+            self.record_counts[cur_key] = self.record_counts.get(cur_key, 0) + step
+
+    def _get_log_importance(
+        self, importance_base: float, importance_step: int, layer: str
+    ) -> float:
+        # importance < threshold holds exactly when
+        # log_importance < log(threshold) - decay_step * log(decay_rate),
+        # which lets thresholds be checked with a range filter on the server
+        if importance_base <= 0:
+            return _MIN_LOG_IMPORTANCE
+        return math.log(importance_base) - importance_step * math.log(
+            self.decay_params[layer][0]
+        )
+
+    def _get_log_neg_importance(
+        self, importance_base: float, importance_step: int, layer: str
+    ) -> float:
+        # importance keeps its sign as it decays, and for thresholds at or
+        # below zero importance < threshold holds exactly when
+        # log_neg_importance > log(-threshold) - decay_step * log(decay_rate)
+        # (or > _MIN_LOG_IMPORTANCE for a threshold of zero)
+        if importance_base >= 0:
+            return _MIN_LOG_IMPORTANCE
+        return math.log(-importance_base) - importance_step * math.log(
+            self.decay_params[layer][0]
+        )
+
+    def _get_log_importance_payload(
+        self, importance_base: float, importance_step: int, layer: str
+    ) -> Dict[str, float]:
+        return {
+            "log_importance": self._get_log_importance(
+                importance_base, importance_step, layer
+            ),
+            "log_neg_importance": self._get_log_neg_importance(
+                importance_base, importance_step, layer
+            ),
+        }
+
+    def _get_log_importance_bound(self, layer: str, threshold: float) -> float:
+        # the bound of log_importance for positive thresholds, and of
+        # log_neg_importance for the others
+        if threshold == 0:
+            return _MIN_LOG_IMPORTANCE
+        return math.log(abs(threshold)) - self.decay_steps[layer] * math.log(
+            self.decay_params[layer][0]
+        )
+
+    def _is_importance_below(
+        self, importance: float, layer: str, threshold: float
+    ) -> bool:
+        # the check of _importance_condition for the current importance
+        cur_step = self.decay_steps[layer]
+        bound = self._get_log_importance_bound(layer, threshold)
+        if threshold > 0:
+            return self._get_log_importance(importance, cur_step, layer) < bound
+        return self._get_log_neg_importance(importance, cur_step, layer) > bound
+
+    def _importance_condition(
+        self, layer: str, threshold: float, below: bool
+    ) -> FieldCondition:
+        bound = self._get_log_importance_bound(layer, threshold)
+        if threshold > 0:
+            return FieldCondition(
+                key="log_importance",
+                range=Range(lt=bound) if below else Range(gte=bound),
+            )
+        return FieldCondition(
+            key="log_neg_importance",
+            range=Range(gt=bound) if below else Range(lte=bound),
+        )
+
+    def _recency_condition(self, layer: str, threshold: float) -> Union[Filter, None]:
+        # recency < threshold holds exactly when
+        # recency_step < decay_step + recency_factor * log(threshold),
+        # unless the memory still carries the recency of its old layer
+        if threshold <= 0:
+            return None
+        # recency_step is an integer, so the bound is rounded up to stay exact
+        # against its integer index
+        bound = math.ceil(
+            self.decay_steps[layer] + self.decay_params[layer][1] * math.log(threshold)
+        )
+        carried = FieldCondition(
+            key="recency_carry_step", match=MatchValue(value=self.decay_steps[layer])
+        )
+        return Filter(
+            should=[
+                Filter(
+                    must=[FieldCondition(key="recency_step", range=Range(lt=bound))],
+                    must_not=[carried],
+                ),
+                Filter(
+                    must=[
+                        carried,
+                        FieldCondition(key="recency_carry", range=Range(lt=threshold)),
+                    ]
+                ),
             ]
-            new_memory_db.connection_client.upsert(
-                collection_name=new_memory_db.agent_config["agent_name"],
-                points=points,  # type: ignore
+        )
+
+    def _to_point_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        layer = payload["layer"]
+        cur_step = self.decay_steps[layer]
+        recency_carry, recency_carry_step = self._get_recency_carry(
+            payload["recency"], payload["delta"], layer
+        )
+        return {
+            "symbol": payload["symbol"],
+            "date": payload["date"],
+            "text": payload["text"],
+            "importance_base": payload["importance"],
+            "importance_step": cur_step,
+            **self._get_log_importance_payload(payload["importance"], cur_step, layer),
+            "recency_step": cur_step - payload["delta"],
+            "recency_carry": recency_carry,
+            "recency_carry_step": recency_carry_step,
+            "access_counter": payload["access_counter"],
+            "layer": layer,
+        }
+
+    def _from_point_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        layer = payload["layer"]
+        return {
+            "symbol": payload["symbol"],
+            "date": payload["date"],
+            "text": payload["text"],
+            "delta": int(self._get_delta(payload["recency_step"], layer)),
+            "importance": float(
+                self._get_importance(
+                    payload["importance_base"], payload["importance_step"], layer
+                )
+            ),
+            "recency": float(
+                self._get_recency(
+                    payload["recency_step"],
+                    payload["recency_carry"],
+                    payload["recency_carry_step"],
+                    layer,
+                )
+            ),
+            "access_counter": payload["access_counter"],
+            "layer": layer,
+        }
+
+    def _get_most_similar_score_in_layer(
+        self, layer: str, embs: np.ndarray, symbols: List[str]
+    ) -> List[float]:
+        search_queries = [
+            SearchRequest(
+                vector=cur_emb,
+                limit=1,
+                with_payload=False,
+                with_vector=False,
+                params=SearchParams(exact=True),
+                filter=Filter(
+                    must=[
+                        FieldCondition(
+                            key="symbol", match=MatchValue(value=cur_symbol)
+                        ),
+                        FieldCondition(key="layer", match=MatchValue(value=layer)),
+                    ]
+                ),
             )
-        return new_memory_db
+            for cur_emb, cur_symbol in zip(embs, symbols)
+        ]
+        search_results = self.connection_client.search_batch(
+            collection_name=self.agent_config["agent_name"], requests=search_queries
+        )
+        ret_results = []
+        for s in search_results:
+            if len(s) == 0:
+                ret_results.append(0.0)
+            else:
+                ret_results.append(s[0].score)
+        return ret_results
+
+    def add_memory(
+        self,
+        memory_input: List[Dict],
+        layer: str,
+        importance_init_func: ConstantImportanceInitialization,
+        recency_init_func: ConstantRecencyInitialization,
+        similarity_threshold: float | None = None,
+    ) -> List[NonNegativeInt]:
+        if not memory_input:
+            return []
+        memories = Memories(memory_records=memory_input)  # type: ignore
+        logger.trace(f"MEM-Adding memories: {memories}")
+        memories_records = memories.memory_records
+        to_emb_texts = [m.text for m in memories_records]
+        text_embs = self.emb_model(texts=to_emb_texts)
+        if similarity_threshold is not None:
+            symbol_list = [m.symbol for m in memories_records]
+            most_similar_score = self._get_most_similar_score_in_layer(
+                layer=layer, embs=text_embs, symbols=symbol_list
+            )
+        # construct points
+        points = []
+        id_list = []
+        if similarity_threshold is None:
+            for cur_m, cur_emb in zip(memories_records, text_embs):
+                points.append(
+                    PointStruct(
+                        id=cur_m.id,
+                        payload=self._to_point_payload(
+                            {
+                                "symbol": cur_m.symbol,
+                                "date": cur_m.date.isoformat(),
+                                "text": cur_m.text,
+                                "delta": 0,
+                                "importance": importance_init_func(),
+                                "recency": recency_init_func(),
+                                "access_counter": 0,
+                                "layer": layer,
+                            }
+                        ),
+                        vector=cur_emb,
+                    )
+                )
+                id_list.append(cur_m.id)
+                logger.trace(
+                    f"MEM-Adding memory: id: {cur_m.id}, symbol: {cur_m.symbol}, date: {cur_m.date}, delta: 0, importance: {importance_init_func()}, recency: {recency_init_func()}, access_counter: 0, layer: {layer}"
+                )
+        else:
+            for cur_m, cur_emb, cur_sim in zip(
+                memories_records, text_embs, most_similar_score
+            ):
+                if cur_sim < similarity_threshold:
+                    points.append(
+                        PointStruct(
+                            id=cur_m.id,
+                            payload=self._to_point_payload(
+                                {
+                                    "symbol": cur_m.symbol,
+                                    "date": cur_m.date.isoformat(),
+                                    "text": cur_m.text,
+                                    "delta": 0,
+                                    "importance": importance_init_func(),
+                                    "recency": recency_init_func(),
+                                    "access_counter": 0,
+                                    "layer": layer,
+                                }
+                            ),
+                            vector=cur_emb,
+                        )
+                    )
+                    id_list.append(cur_m.id)
+                    logger.trace(
+                        f"MEM-Adding memory: id: {cur_m.id}, symbol: {cur_m.symbol}, date: {cur_m.date}, delta: 0, importance: {importance_init_func()}, recency: {recency_init_func()}, access_counter: 0, layer: {layer}"
+                    )
+                else:
+                    logger.trace(
+                        f"MEM-Skipping memory: id: {cur_m.id}, symbol: {cur_m.symbol}, date: {cur_m.date}, delta: 0, importance: {importance_init_func()}, recency: {recency_init_func()}, access_counter: 0, layer: {layer}"
+                    )
+        # upload to db
+        if points:
+            self.connection_client.upsert(
+                collection_name=self.agent_config["agent_name"],
+                points=points,
+                wait=True,
+            )
+            self._update_record_counts(
+                symbols=[p.payload["symbol"] for p in points],  # type: ignore
+                layer=layer,
+                step=1,
+            )
+            self._journal_changes(added=id_list)
+            logger.trace("MEM-Adding memories finished")
+            return id_list
+        else:
+            logger.trace("MEM-No memories to add")
+            return []
+
+    def _count_num_records(
+        self, layer: Union[str, None] = None, symbol: Union[str, None] = None
+    ) -> int:
+        return sum(
+            cur_count
+            for (cur_symbol, cur_layer), cur_count in self.record_counts.items()
+            if (layer is None or cur_layer == layer)
+            and (symbol is None or cur_symbol == symbol)
+        )
+
+    def _get_record_dict(
+        self,
+        with_vector: bool = True,
+        layer: Union[None, str] = None,
+        symbol: Union[str, None] = None,
+    ) -> List[Dict[str, Union[int, List[float], Dict]]]:
+        # get total number of item
+        total_num_record = self._count_num_records(layer=layer, symbol=symbol)
+        if total_num_record == 0:
+            return []
+
+        # get record
+        if layer or symbol:
+            filter_condition = self._filter_by_layer_and_symbol(layer, symbol)
+            all_memory_record = self.connection_client.scroll(
+                collection_name=self.agent_config["agent_name"],
+                limit=total_num_record,
+                scroll_filter=Filter(must=filter_condition),
+                with_payload=True,
+                with_vectors=with_vector,
+            )[0]
+        else:
+            all_memory_record = self.connection_client.scroll(
+                collection_name=self.agent_config["agent_name"],
+                limit=total_num_record,
+                with_payload=True,
+                with_vectors=with_vector,
+            )[0]
+
+        # format for return
+        all_memories = []
+        for r in all_memory_record:
+            cur_payload = self._from_point_payload(r.payload)  # type: ignore
+            if with_vector:
+                all_memories.append(
+                    {"id": r.id, "payload": cur_payload, "vector": r.vector}
+                )
+            else:
+                all_memories.append({"id": r.id, "payload": cur_payload})
+        return all_memories
+
+    @staticmethod
+    def _filter_by_layer_and_symbol(layer, symbol):
+        """
+        Filter data by layer and symbol.
+
+        Args:
+            layer (str): The layer to filter by.
+            symbol (str): The symbol to filter by.
+
+        Returns:
+            Filtered data based on layer and symbol.
+        """
+        result = []
+        if layer:
+            result.append(FieldCondition(key="layer", match=MatchValue(value=layer)))
+        if symbol:
+            result.append(FieldCondition(key="symbol", match=MatchValue(value=symbol)))
+        return result
+
+    def _rank_search_result(
+        self,
+        search_result: List[Any],
+        layer: str,
+        k: int,
+        linear_compound_func: LinearCompoundScore,
+    ) -> List[int]:
+        cur_result_subset = sorted(
+            [
+                {
+                    "compound_score": linear_compound_func(
+                        similarity_score=r.score,
+                        importance_score=self._get_importance(
+                            r.payload["importance_base"],
+                            r.payload["importance_step"],
+                            layer,
+                        ),
+                        recency_score=self._get_recency(
+                            r.payload["recency_step"],
+                            r.payload["recency_carry"],
+                            r.payload["recency_carry_step"],
+                            layer,
+                        ),
+                    ),
+                    "id": r.id,
+                }
+                for r in search_result
+            ],
+            key=lambda x: -x["compound_score"],  # type: ignore
+        )[:k]
+        return [i["id"] for i in cur_result_subset]
+
+    def query_layers(
+        self,
+        query_input: Queries,
+        layers: List[str],
+        linear_compound_func: LinearCompoundScore,
+        query_vectors: Union[np.ndarray, List[List[float]], None] = None,
+    ) -> Dict[str, List[Tuple[List[str], List[int]]]]:
+        # generate embedding
+        emb_vector = self._get_query_embeddings(query_input, query_vectors)
+        query_result: Dict[str, List[Tuple[List[str], List[int]]]] = {
+            layer: [([], []) for _ in query_input.query_records] for layer in layers
+        }
+        # construct one request per (layer, symbol)
+        search_requests = []
+        search_slots = []
+        for layer in layers:
+            for i, (cur_emb, cur_query) in enumerate(
+                zip(emb_vector, query_input.query_records)
+            ):
+                cur_count = self._count_num_records(
+                    layer=layer, symbol=cur_query.symbol
+                )
+                if cur_count == 0:
+                    continue
+                search_requests.append(
+                    SearchRequest(
+                        vector=cur_emb,
+                        limit=self._get_search_limit(cur_count, cur_query.k),
+                        # only the scores are needed for ranking, texts are
+                        # fetched for the top k ids afterwards
+                        with_payload=[
+                            "importance_base",
+                            "importance_step",
+                            "recency_step",
+                            "recency_carry",
+                            "recency_carry_step",
+                        ],
+                        params=self._get_search_params(),
+                        filter=Filter(
+                            must=[
+                                FieldCondition(
+                                    key="symbol",
+                                    match=MatchValue(value=cur_query.symbol),
+                                ),
+                                FieldCondition(
+                                    key="layer", match=MatchValue(value=layer)
+                                ),
+                            ]
+                        ),
+                    )
+                )
+                search_slots.append((layer, i, cur_query.k))
+        if not search_requests:
+            return query_result
+
+        # search all layers in a single batch
+        search_results = self.connection_client.search_batch(
+            collection_name=self.agent_config["agent_name"], requests=search_requests
+        )
+        top_ids = [
+            self._rank_search_result(
+                search_result=cur_result,
+                layer=layer,
+                k=k,
+                linear_compound_func=linear_compound_func,
+            )
+            for (layer, _, k), cur_result in zip(search_slots, search_results)
+        ]
+
+        # fetch the texts of the selected records only
+        all_top_ids = [cur_id for cur_ids in top_ids for cur_id in cur_ids]
+        id_to_text = {}
+        if all_top_ids:
+            id_to_text = {
+                r.id: r.payload["text"]  # type: ignore
+                for r in self.connection_client.retrieve(
+                    collection_name=self.agent_config["agent_name"],
+                    ids=all_top_ids,
+                    with_payload=["text"],
+                    with_vectors=False,
+                )
+            }
+        for (layer, i, _), cur_ids in zip(search_slots, top_ids):
+            query_result[layer][i] = ([id_to_text[j] for j in cur_ids], cur_ids)
+        return query_result
+
+    def prepare_jump(
+        self, jump_direction: JumpDirection, layer: str, threshold: float
+    ) -> List[Dict[str, Any]]:
+        record_count = self._count_num_records(layer=layer)
+        if record_count == 0:
+            return []
+
+        # get filter
+        if jump_direction == JumpDirection.UP:
+            filter_condition = Filter(
+                must=[
+                    self._importance_condition(layer, threshold, below=False),
+                    FieldCondition(key="layer", match=MatchValue(value=layer)),
+                ]
+            )
+        else:
+            filter_condition = Filter(
+                must=[
+                    self._importance_condition(layer, threshold, below=True),
+                    FieldCondition(key="layer", match=MatchValue(value=layer)),
+                ]
+            )
+
+        # get all records
+        all_records = self.connection_client.scroll(
+            collection_name=self.agent_config["agent_name"],
+            scroll_filter=filter_condition,
+            with_vectors=True,
+            limit=record_count,
+        )[0]
+        to_delete_ids = []
+        jump_records = []
+        for r in all_records:
+            jump_records.append(
+                {
+                    "id": r.id,
+                    "payload": self._from_point_payload(r.payload),  # type: ignore
+                    "vector": r.vector,
+                }
+            )
+            to_delete_ids.append(r.id)
+
+        # delete
+        if to_delete_ids:
+            self.connection_client.delete(
+                collection_name=self.agent_config["agent_name"],
+                points_selector=PointIdsList(points=to_delete_ids),
+            )
+            self._update_record_counts(
+                symbols=[r["payload"]["symbol"] for r in jump_records],
+                layer=layer,
+                step=-1,
+            )
+
+        return jump_records
+
+    def accept_jump(
+        self,
+        jump_dict: List[Dict[str, Any]],
+        jump_direction: JumpDirection,
+        recency_init_func: Union[ConstantRecencyInitialization, None],
+        target_layer: str,
+    ) -> None:
+        if jump_dict:
+            add_points = []
+            for r in jump_dict:
+                if jump_direction == JumpDirection.UP:
+                    if recency_init_func is None:
+                        raise ValueError(
+                            "recency_init_func should not be None if jump up"
+                        )
+                    r["payload"]["recency"] = recency_init_func()
+                    r["payload"]["delta"] = 0
+                r["payload"]["layer"] = target_layer
+                add_points.append(
+                    PointStruct(
+                        id=r["id"],
+                        payload=self._to_point_payload(r["payload"]),
+                        vector=r["vector"],
+                    )
+                )
+            self.connection_client.upsert(
+                collection_name=self.agent_config["agent_name"],
+                points=add_points,
+                wait=True,
+            )
+            self._update_record_counts(
+                symbols=[r["payload"]["symbol"] for r in jump_dict],
+                layer=target_layer,
+                step=1,
+            )
+            self._journal_changes(updated=[r["id"] for r in jump_dict])
+
+    def memory_flow(
+        self,
+        jump_threshold_dict: Dict[str, Dict[str, float]],
+        mid_recency_init_func: ConstantRecencyInitialization,
+        long_recency_init_func: ConstantRecencyInitialization,
+    ) -> None:
+        # same transitions as MemoryDBBase.memory_flow, but a jump only rewrites
+        # the payload, so each pass is one scroll and one batch update and the
+        # vectors never leave the server
+        logger.trace("MEM-Flowing memories")
+        recency_init_funcs = {
+            "mid": mid_recency_init_func,
+            "long": long_recency_init_func,
+        }
+        transitions = [
+            ("short", JumpDirection.UP, "mid"),
+            ("mid", JumpDirection.DOWN, "short"),
+            ("mid", JumpDirection.UP, "long"),
+            ("long", JumpDirection.DOWN, "mid"),
+        ]
+        for _ in range(2):
+            record_count = sum(
+                self._count_num_records(layer=layer)
+                for layer in ["short", "mid", "long"]
+            )
+            if record_count == 0:
+                return
+            # every record that takes at least the first jump of its layer
+            candidate_records = self.connection_client.scroll(
+                collection_name=self.agent_config["agent_name"],
+                scroll_filter=Filter(
+                    should=[
+                        Filter(
+                            must=[
+                                FieldCondition(
+                                    key="layer", match=MatchValue(value=layer)
+                                ),
+                                self._importance_condition(
+                                    layer,
+                                    jump_threshold_dict[layer][direction.value],
+                                    below=direction == JumpDirection.DOWN,
+                                ),
+                            ]
+                        )
+                        for layer, direction, _ in transitions
+                    ]
+                ),
+                with_payload=[
+                    "symbol",
+                    "layer",
+                    "importance_base",
+                    "importance_step",
+                    "recency_step",
+                    "recency_carry",
+                    "recency_carry_step",
+                ],
+                with_vectors=False,
+                limit=record_count,
+            )[0]
+
+            # follow each record through the transitions of the pass
+            update_operations = []
+            for r in candidate_records:
+                cur_payload: Dict[str, Any] = r.payload  # type: ignore
+                cur_layer = cur_payload["layer"]
+                cur_importance = self._get_importance(
+                    cur_payload["importance_base"],
+                    cur_payload["importance_step"],
+                    cur_layer,
+                )
+                cur_delta = self._get_delta(cur_payload["recency_step"], cur_layer)
+                cur_recency = self._get_recency(
+                    cur_payload["recency_step"],
+                    cur_payload["recency_carry"],
+                    cur_payload["recency_carry_step"],
+                    cur_layer,
+                )
+                new_layer = cur_layer
+                for layer, direction, target_layer in transitions:
+                    if layer != new_layer:
+                        continue
+                    if self._is_importance_below(
+                        cur_importance,
+                        layer,
+                        jump_threshold_dict[layer][direction.value],
+                    ) != (direction == JumpDirection.DOWN):
+                        continue
+                    if direction == JumpDirection.UP:
+                        if recency_init_funcs[target_layer] is None:
+                            raise ValueError(
+                                "recency_init_func should not be None if jump up"
+                            )
+                        cur_recency = recency_init_funcs[target_layer]()
+                        cur_delta = 0
+                    logger.trace(
+                        f"MEM-Jump {direction.name} memory: id: {r.id}, from: {layer}, to: {target_layer}"
+                    )
+                    new_layer = target_layer
+                if new_layer == cur_layer:
+                    continue
+                new_step = self.decay_steps[new_layer]
+                recency_carry, recency_carry_step = self._get_recency_carry(
+                    cur_recency, cur_delta, new_layer
+                )
+                update_operations.append(
+                    SetPayloadOperation(
+                        set_payload=SetPayload(
+                            payload={
+                                "layer": new_layer,
+                                "importance_base": cur_importance,
+                                "importance_step": new_step,
+                                **self._get_log_importance_payload(
+                                    cur_importance, new_step, new_layer
+                                ),
+                                "recency_step": new_step - cur_delta,
+                                "recency_carry": recency_carry,
+                                "recency_carry_step": recency_carry_step,
+                            },
+                            points=[r.id],
+                        )
+                    )
+                )
+                self._update_record_counts(
+                    symbols=[cur_payload["symbol"]], layer=cur_layer, step=-1
+                )
+                self._update_record_counts(
+                    symbols=[cur_payload["symbol"]], layer=new_layer, step=1
+                )
+                self._journal_changes(updated=[r.id])  # type: ignore
+            if update_operations:
+                self.connection_client.batch_update_points(
+                    collection_name=self.agent_config["agent_name"],
+                    update_operations=update_operations,
+                )
+
+    def update_access_counter_with_feedback(
+        self,
+        access_feedback: Union[AccessFeedback, AccessFeedbackMulti],
+        access_counter_update_func: ConstantAccessCounterUpdateFunction,
+    ) -> None:
+        if isinstance(access_feedback, AccessFeedback):
+            feedback_pairs = [
+                (a.id, a.feedback) for a in access_feedback.access_counter_records
+            ]
+        else:
+            feedback_pairs = [
+                (cur_id, cur_feedback)
+                for cur_asset in access_feedback.access_counter_records
+                for cur_id, cur_feedback in zip(cur_asset.id, cur_asset.feedback)
+            ]
+        if not feedback_pairs:
+            return
+
+        # get the payload fields of all points at once, without vectors
+        retrieved_points = self.connection_client.retrieve(
+            collection_name=self.agent_config["agent_name"],
+            ids=list(dict.fromkeys(cur_id for cur_id, _ in feedback_pairs)),
+            with_payload=[
+                "layer",
+                "access_counter",
+                "importance_base",
+                "importance_step",
+            ],
+            with_vectors=False,
+        )
+        cur_payloads: Dict[int, Dict[str, Any]] = {
+            r.id: r.payload for r in retrieved_points  # type: ignore
+        }
+
+        # update
+        new_values: Dict[int, Dict[str, Any]] = {}
+        for cur_id, cur_feedback in feedback_pairs:
+            if cur_id not in cur_payloads:
+                continue
+            cur_payload = cur_payloads[cur_id]
+            cur_layer = cur_payload["layer"]
+            cur_step = self.decay_steps[cur_layer]
+            cur_importance = access_counter_update_func(
+                cur_importance_score=self._get_importance(
+                    cur_payload["importance_base"],
+                    cur_payload["importance_step"],
+                    cur_layer,
+                ),
+                direction=cur_feedback,  # type: ignore
+            )
+            cur_payload["access_counter"] += cur_feedback
+            cur_payload["importance_base"] = cur_importance
+            cur_payload["importance_step"] = cur_step
+            new_values[cur_id] = {
+                "access_counter": cur_payload["access_counter"],
+                "importance_base": cur_importance,
+                "importance_step": cur_step,
+                **self._get_log_importance_payload(cur_importance, cur_step, cur_layer),
+            }
+
+        # write back in one request
+        if new_values:
+            self.connection_client.batch_update_points(
+                collection_name=self.agent_config["agent_name"],
+                update_operations=[
+                    SetPayloadOperation(
+                        set_payload=SetPayload(payload=cur_values, points=[cur_id])
+                    )
+                    for cur_id, cur_values in new_values.items()
+                ],
+            )
+            self._journal_changes(updated=new_values)
+
+    def clean_up(
+        self, importance_threshold: float, recency_threshold: float, layer: str
+    ) -> None:
+        record_count = self._count_num_records(layer=layer)
+        if record_count == 0:
+            return
+        should_conditions = [
+            self._importance_condition(layer, importance_threshold, below=True)
+        ]
+        recency_condition = self._recency_condition(layer, recency_threshold)
+        if recency_condition is not None:
+            should_conditions.append(recency_condition)
+        # select the ids first so the local record counts stay in sync
+        to_delete_records = self.connection_client.scroll(
+            collection_name=self.agent_config["agent_name"],
+            scroll_filter=Filter(
+                must=[
+                    FieldCondition(key="layer", match=MatchValue(value=layer)),
+                    Filter(should=should_conditions),
+                ]
+            ),
+            with_payload=["symbol"],
+            with_vectors=False,
+            limit=record_count,
+        )[0]
+        if not to_delete_records:
+            return
+        self.connection_client.delete(
+            collection_name=self.agent_config["agent_name"],
+            points_selector=PointIdsList(points=[r.id for r in to_delete_records]),
+        )
+        self._update_record_counts(
+            symbols=[r.payload["symbol"] for r in to_delete_records],  # type: ignore
+            layer=layer,
+            step=-1,
+        )
+        self._journal_changes(deleted=[r.id for r in to_delete_records])  # type: ignore
+
+    def _load_records(self, memories: List[Dict[str, Any]]) -> None:
+        points = [
+            PointStruct(
+                id=m["id"],
+                payload=self._to_point_payload(m["payload"]),
+                vector=m["vector"],
+            )
+            for m in memories
+        ]
+        self.connection_client.upsert(
+            collection_name=self.agent_config["agent_name"],
+            points=points,  # type: ignore
+        )
+        for m in memories:
+            self._update_record_counts(
+                symbols=[m["payload"]["symbol"]], layer=m["payload"]["layer"], step=1
+            )
+
+    def _get_stored_records(
+        self, ids: List[int], with_vector: bool
+    ) -> List[Dict[str, Any]]:
+        if not ids:
+            return []
+        retrieved_points = self.connection_client.retrieve(
+            collection_name=self.agent_config["agent_name"],
+            ids=ids,  # type: ignore
+            with_payload=STORED_PAYLOAD_KEYS,
+            with_vectors=with_vector,
+        )
+        stored_records = []
+        for r in retrieved_points:
+            cur_record = {"id": r.id, "payload": r.payload}
+            if with_vector:
+                cur_record["vector"] = r.vector
+            stored_records.append(cur_record)
+        return stored_records
+
+    def _with_log_importance(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            # log entries written before recency carries were stored
+            "recency_carry": 0.0,
+            "recency_carry_step": _NO_CARRY_STEP,
+            **payload,
+            **self._get_log_importance_payload(
+                payload["importance_base"], payload["importance_step"], payload["layer"]
+            ),
+        }
+
+    def _get_symbol_and_layer(self, ids: List[int]) -> Dict[int, Tuple[str, str]]:
+        if not ids:
+            return {}
+        return {
+            r.id: (r.payload["symbol"], r.payload["layer"])  # type: ignore
+            for r in self.connection_client.retrieve(
+                collection_name=self.agent_config["agent_name"],
+                ids=ids,  # type: ignore
+                with_payload=["symbol", "layer"],
+                with_vectors=False,
+            )
+        }
+
+    def _put_stored_records(self, records: List[Dict[str, Any]]) -> None:
+        if not records:
+            return
+        cur_locations = self._get_symbol_and_layer([r["id"] for r in records])
+        for cur_id, (cur_symbol, cur_layer) in cur_locations.items():
+            self._update_record_counts(symbols=[cur_symbol], layer=cur_layer, step=-1)
+        # new records come with their vector, existing ones only change payload
+        new_points = [
+            PointStruct(
+                id=r["id"],
+                payload=self._with_log_importance(r["payload"]),
+                vector=r["vector"],
+            )
+            for r in records
+            if "vector" in r
+        ]
+        if new_points:
+            self.connection_client.upsert(
+                collection_name=self.agent_config["agent_name"],
+                points=new_points,
+                wait=True,
+            )
+        update_operations = [
+            SetPayloadOperation(
+                set_payload=SetPayload(
+                    payload=self._with_log_importance(r["payload"]), points=[r["id"]]
+                )
+            )
+            for r in records
+            if "vector" not in r and r["id"] in cur_locations
+        ]
+        if update_operations:
+            self.connection_client.batch_update_points(
+                collection_name=self.agent_config["agent_name"],
+                update_operations=update_operations,
+            )
+        for r in records:
+            if "vector" in r or r["id"] in cur_locations:
+                self._update_record_counts(
+                    symbols=[r["payload"]["symbol"]],
+                    layer=r["payload"]["layer"],
+                    step=1,
+                )
+
+    def _delete_records(self, ids: List[int]) -> None:
+        cur_locations = self._get_symbol_and_layer(ids)
+        if not cur_locations:
+            return
+        self.connection_client.delete(
+            collection_name=self.agent_config["agent_name"],
+            points_selector=PointIdsList(points=list(cur_locations)),
+        )
+        for cur_symbol, cur_layer in cur_locations.values():
+            self._update_record_counts(symbols=[cur_symbol], layer=cur_layer, step=-1)
+
+
+class _MemorySegment:
+    """Contiguous storage for all memories of one (symbol, layer) pair.
+
+    Vectors are kept L2-normalized in a growable float32 matrix so cosine
+    similarity against the whole segment is a single matmul. Payload fields are
+    stored column-wise and rows are removed by swapping in the last row, which
+    keeps the live region contiguous.
+    """
+
+    def __init__(self, emb_size: int) -> None:
+        self.size = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, emb_size), dtype=np.float32)
+        self.importance_base = np.empty(0, dtype=np.float64)
+        self.importance_step = np.empty(0, dtype=np.int64)
+        self.recency_step = np.empty(0, dtype=np.int64)
+        self.recency_carry = np.empty(0, dtype=np.float64)
+        self.recency_carry_step = np.empty(0, dtype=np.int64)
+        self.access_counter = np.empty(0, dtype=np.int64)
+        self.dates: List[str] = []
+        self.texts: List[str] = []
+        self.id_to_row: Dict[int, int] = {}
+
+    def _reserve_columns(self, required: int) -> None:
+        capacity = len(self.ids)
+        if required <= capacity:
+            return
+        new_capacity = max(required, 2 * capacity, 16)
+        for name in [
+            "ids",
+            "importance_base",
+            "importance_step",
+            "recency_step",
+            "recency_carry",
+            "recency_carry_step",
+            "access_counter",
+        ]:
+            old = getattr(self, name)
+            new = np.empty(new_capacity, dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+
+    def _reserve_vectors(self, required: int) -> None:
+        # vectors mapped from a checkpoint are read-only, they are copied into
+        # a growable matrix on the first write
+        if required <= len(self.vectors) and self.vectors.flags.writeable:
+            return
+        new_vectors = np.empty(
+            (max(required, len(self.ids)), self.vectors.shape[1]), dtype=np.float32
+        )
+        new_vectors[: self.size] = self.vectors[: self.size]
+        self.vectors = new_vectors
+
+    def append(
+        self,
+        ids: List[int],
+        vectors: np.ndarray,
+        dates: List[str],
+        texts: List[str],
+        importance_base: List[float],
+        importance_step: List[int],
+        recency_step: List[int],
+        recency_carry: List[float],
+        recency_carry_step: List[int],
+        access_counter: List[int],
+    ) -> None:
+        num_new = len(ids)
+        if num_new == 0:
+            return
+        start, end = self.size, self.size + num_new
+        self._reserve_columns(end)
+        if start == 0 and isinstance(vectors, np.memmap):
+            # the first rows of a segment loaded from a memory-mapped checkpoint
+            # are used as they are instead of being copied
+            self.vectors = vectors
+        else:
+            self._reserve_vectors(end)
+            self.vectors[start:end] = vectors
+        self.ids[start:end] = ids
+        self.importance_base[start:end] = importance_base
+        self.importance_step[start:end] = importance_step
+        self.recency_step[start:end] = recency_step
+        self.recency_carry[start:end] = recency_carry
+        self.recency_carry_step[start:end] = recency_carry_step
+        self.access_counter[start:end] = access_counter
+        self.dates.extend(dates)
+        self.texts.extend(texts)
+        for row, cur_id in enumerate(ids, start=start):
+            self.id_to_row[int(cur_id)] = row
+        self.size = end
+
+    def remove(self, rows: np.ndarray) -> Dict[str, Any]:
+        rows = np.asarray(rows, dtype=np.int64)
+        removed = {
+            "ids": self.ids[rows].copy(),
+            "vectors": self.vectors[rows].copy(),
+            "importance_base": self.importance_base[rows].copy(),
+            "importance_step": self.importance_step[rows].copy(),
+            "recency_step": self.recency_step[rows].copy(),
+            "recency_carry": self.recency_carry[rows].copy(),
+            "recency_carry_step": self.recency_carry_step[rows].copy(),
+            "access_counter": self.access_counter[rows].copy(),
+            "dates": [self.dates[r] for r in rows],
+            "texts": [self.texts[r] for r in rows],
+        }
+        self._reserve_vectors(self.size)
+        # rows above the current one are gone already, so the last row is never
+        # another row pending removal
+        for row in sorted(rows.tolist(), reverse=True):
+            last = self.size - 1
+            del self.id_to_row[int(self.ids[row])]
+            if row != last:
+                self.ids[row] = self.ids[last]
+                self.vectors[row] = self.vectors[last]
+                self.importance_base[row] = self.importance_base[last]
+                self.importance_step[row] = self.importance_step[last]
+                self.recency_step[row] = self.recency_step[last]
+                self.recency_carry[row] = self.recency_carry[last]
+                self.recency_carry_step[row] = self.recency_carry_step[last]
+                self.access_counter[row] = self.access_counter[last]
+                self.dates[row] = self.dates[last]
+                self.texts[row] = self.texts[last]
+                self.id_to_row[int(self.ids[row])] = row
+            self.dates.pop()
+            self.texts.pop()
+            self.size = last
+        return removed
+
+    def similarity(self, query_vectors: np.ndarray) -> np.ndarray:
+        return query_vectors @ self.vectors[: self.size].T
+
+
+def _normalize_rows(vectors: Union[List[List[float]], np.ndarray]) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyMemoryDB(MemoryDBBase):
+    """In-process memory store with exact cosine search.
+
+    Drop-in replacement for the Qdrant backed ``MemoryDB`` for single node runs:
+    memories live in one ``_MemorySegment`` per (symbol, layer), so every
+    operation is a handful of numpy calls instead of an HTTP round trip.
+    """
+
+    def __init__(self, agent_config: Dict[str, Any], emb_config: Dict[str, Any]):
+        logger.info("SYS-Initializing NumpyMemoryDB")
+        super().__init__(agent_config=agent_config, emb_config=emb_config)
+        self.emb_size = self.emb_config["emb_size"]
+        self.segments: Dict[Tuple[str, str], _MemorySegment] = {}
+
+    def _get_segment(self, symbol: str, layer: str) -> _MemorySegment:
+        if (symbol, layer) not in self.segments:
+            self.segments[(symbol, layer)] = _MemorySegment(emb_size=self.emb_size)
+        return self.segments[(symbol, layer)]
+
+    def _iter_segments(
+        self, layer: Union[str, None] = None, symbol: Union[str, None] = None
+    ):
+        for (cur_symbol, cur_layer), segment in self.segments.items():
+            if (layer is None or cur_layer == layer) and (
+                symbol is None or cur_symbol == symbol
+            ):
+                yield cur_symbol, cur_layer, segment
+
+    def _segment_importance(
+        self, segment: _MemorySegment, layer: str, rows: Union[np.ndarray, slice]
+    ) -> np.ndarray:
+        return self._get_importance(
+            segment.importance_base[rows], segment.importance_step[rows], layer
+        )
+
+    def _segment_recency(
+        self, segment: _MemorySegment, layer: str, rows: Union[np.ndarray, slice]
+    ) -> np.ndarray:
+        return self._get_recency(
+            segment.recency_step[rows],
+            segment.recency_carry[rows],
+            segment.recency_carry_step[rows],
+            layer,
+        )
+
+    def _segment_payload(
+        self, segment: _MemorySegment, row: int, symbol: str, layer: str
+    ) -> Dict[str, Any]:
+        return {
+            "symbol": symbol,
+            "date": segment.dates[row],
+            "text": segment.texts[row],
+            "delta": int(self._get_delta(segment.recency_step[row], layer)),
+            "importance": float(
+                self._get_importance(
+                    segment.importance_base[row], segment.importance_step[row], layer
+                )
+            ),
+            "recency": float(self._segment_recency(segment, layer, row)),
+            "access_counter": int(segment.access_counter[row]),
+            "layer": layer,
+        }
+
+    def _append_payloads(
+        self,
+        symbol: str,
+        layer: str,
+        ids: List[int],
+        vectors: np.ndarray,
+        payloads: List[Dict[str, Any]],
+    ) -> None:
+        cur_step = self.decay_steps[layer]
+        recency_carries = [
+            self._get_recency_carry(p["recency"], p["delta"], layer) for p in payloads
+        ]
+        self._get_segment(symbol, layer).append(
+            ids=ids,
+            vectors=vectors,
+            dates=[p["date"] for p in payloads],
+            texts=[p["text"] for p in payloads],
+            importance_base=[p["importance"] for p in payloads],
+            importance_step=[cur_step] * len(payloads),
+            recency_step=[cur_step - p["delta"] for p in payloads],
+            recency_carry=[c for c, _ in recency_carries],
+            recency_carry_step=[c for _, c in recency_carries],
+            access_counter=[p["access_counter"] for p in payloads],
+        )
+
+    def _get_record_columns(
+        self,
+    ) -> Tuple[np.ndarray, np.ndarray, Dict[str, List[Any]]]:
+        ids, vectors = [], []
+        payloads: Dict[str, List[Any]] = {key: [] for key in PAYLOAD_KEYS}
+        for cur_symbol, cur_layer, segment in self._iter_segments():
+            live_rows = slice(0, segment.size)
+            ids.append(segment.ids[live_rows])
+            vectors.append(segment.vectors[live_rows])
+            payloads["symbol"].extend([cur_symbol] * segment.size)
+            payloads["date"].extend(segment.dates)
+            payloads["text"].extend(segment.texts)
+            payloads["delta"].extend(
+                self._get_delta(segment.recency_step[live_rows], cur_layer).tolist()
+            )
+            payloads["importance"].extend(
+                self._segment_importance(segment, cur_layer, live_rows).tolist()
+            )
+            payloads["recency"].extend(
+                self._segment_recency(segment, cur_layer, live_rows).tolist()
+            )
+            payloads["access_counter"].extend(
+                segment.access_counter[live_rows].tolist()
+            )
+            payloads["layer"].extend([cur_layer] * segment.size)
+        if not ids:
+            return (
+                np.empty(0, dtype=np.int64),
+                np.empty((0, self.emb_size), dtype=np.float32),
+                payloads,
+            )
+        return np.concatenate(ids), np.concatenate(vectors), payloads
+
+    def _load_record_columns(
+        self, ids: np.ndarray, vectors: np.ndarray, payloads: Dict[str, List[Any]]
+    ) -> None:
+        # rows of one (symbol, layer) are appended to its segment at once. The
+        # rows of a segment are contiguous in a checkpoint of this backend, so
+        # mapped float32 vectors are passed on as a view of the file
+        grouped_rows: Dict[Tuple[str, str], List[int]] = {}
+        for row, (cur_symbol, cur_layer) in enumerate(
+            zip(payloads["symbol"], payloads["layer"])
+        ):
+            grouped_rows.setdefault((cur_symbol, cur_layer), []).append(row)
+        for (symbol, layer), rows in grouped_rows.items():
+            self._append_payloads(
+                symbol=symbol,
+                layer=layer,
+                ids=ids[rows].tolist(),
+                vectors=(
+                    vectors[rows[0] : rows[-1] + 1]
+                    if rows[-1] - rows[0] + 1 == len(rows)
+                    and vectors.dtype == np.float32
+                    else np.asarray(vectors[rows], dtype=np.float32)
+                ),
+                payloads=[
+                    {key: payloads[key][r] for key in PAYLOAD_KEYS} for r in rows
+                ],
+            )
+
+    def _get_most_similar_score_in_layer(
+        self, layer: str, embs: np.ndarray, symbols: List[str]
+    ) -> List[float]:
+        ret_results = []
+        for cur_emb, cur_symbol in zip(embs, symbols):
+            segment = self.segments.get((cur_symbol, layer))
+            if segment is None or segment.size == 0:
+                ret_results.append(0.0)
+            else:
+                ret_results.append(float(segment.similarity(cur_emb).max()))
+        return ret_results
+
+    def add_memory(
+        self,
+        memory_input: List[Dict],
+        layer: str,
+        importance_init_func: ConstantImportanceInitialization,
+        recency_init_func: ConstantRecencyInitialization,
+        similarity_threshold: float | None = None,
+    ) -> List[NonNegativeInt]:
+        if not memory_input:
+            return []
+        memories = Memories(memory_records=memory_input)  # type: ignore
+        logger.trace(f"MEM-Adding memories: {memories}")
+        memories_records = memories.memory_records
+        text_embs = _normalize_rows(
+            self.emb_model(texts=[m.text for m in memories_records])
+        )
+        if similarity_threshold is not None:
+            most_similar_score = self._get_most_similar_score_in_layer(
+                layer=layer,
+                embs=text_embs,
+                symbols=[m.symbol for m in memories_records],
+            )
+        else:
+            most_similar_score = [0.0] * len(memories_records)
+        # group by symbol
+        grouped_records: Dict[str, List[Tuple[MemorySingle, np.ndarray]]] = {}
+        id_list = []
+        for cur_m, cur_emb, cur_sim in zip(
+            memories_records, text_embs, most_similar_score
+        ):
+            if similarity_threshold is not None and cur_sim >= similarity_threshold:
+                logger.trace(
+                    f"MEM-Skipping memory: id: {cur_m.id}, symbol: {cur_m.symbol}, date: {cur_m.date}, delta: 0, importance: {importance_init_func()}, recency: {recency_init_func()}, access_counter: 0, layer: {layer}"
+                )
+                continue
+            grouped_records.setdefault(cur_m.symbol, []).append((cur_m, cur_emb))
+            id_list.append(cur_m.id)
+            logger.trace(
+                f"MEM-Adding memory: id: {cur_m.id}, symbol: {cur_m.symbol}, date: {cur_m.date}, delta: 0, importance: {importance_init_func()}, recency: {recency_init_func()}, access_counter: 0, layer: {layer}"
+            )
+        if not id_list:
+            logger.trace("MEM-No memories to add")
+            return []
+        for symbol, records in grouped_records.items():
+            self._append_payloads(
+                symbol=symbol,
+                layer=layer,
+                ids=[m.id for m, _ in records],
+                vectors=np.stack([e for _, e in records]),
+                payloads=[
+                    {
+                        "date": m.date.isoformat(),
+                        "text": m.text,
+                        "delta": 0,
+                        "importance": importance_init_func(),
+                        "recency": recency_init_func(),
+                        "access_counter": 0,
+                    }
+                    for m, _ in records
+                ],
+            )
+        self._journal_changes(added=id_list)
+        logger.trace("MEM-Adding memories finished")
+        return id_list
+
+    def _get_record_dict(
+        self,
+        with_vector: bool = True,
+        layer: Union[None, str] = None,
+        symbol: Union[str, None] = None,
+    ) -> List[Dict[str, Union[int, List[float], Dict]]]:
+        all_memories = []
+        for cur_symbol, cur_layer, segment in self._iter_segments(layer, symbol):
+            for row in range(segment.size):
+                cur_record = {
+                    "id": int(segment.ids[row]),
+                    "payload": self._segment_payload(
+                        segment, row, cur_symbol, cur_layer
+                    ),
+                }
+                if with_vector:
+                    cur_record["vector"] = segment.vectors[row].tolist()
+                all_memories.append(cur_record)
+        return all_memories
+
+    def _rank_segment(
+        self,
+        segment: _MemorySegment,
+        layer: str,
+        query_vector: np.ndarray,
+        k: int,
+        linear_compound_func: LinearCompoundScore,
+    ) -> Tuple[List[str], List[int]]:
+        similarity_score = segment.similarity(query_vector)
+        candidate_rows = np.arange(segment.size)
+        limit = self._get_search_limit(segment.size, k)
+        if limit < segment.size:
+            candidate_rows = np.argpartition(-similarity_score, limit - 1)[:limit]
+        similarity_score = similarity_score[candidate_rows]
+        compound_score = linear_compound_func(
+            similarity_score=similarity_score,  # type: ignore
+            importance_score=self._segment_importance(segment, layer, candidate_rows),  # type: ignore
+            recency_score=self._segment_recency(segment, layer, candidate_rows),  # type: ignore
+        )
+        top = np.arange(len(candidate_rows))
+        if k < len(candidate_rows):
+            top = np.argpartition(-compound_score, k - 1)[:k]
+        # ties in compound score fall back to similarity, as in MemoryDB
+        top = top[np.lexsort((-similarity_score[top], -compound_score[top]))]
+        top_rows = candidate_rows[top]
+        return (
+            [segment.texts[r] for r in top_rows],
+            [int(segment.ids[r]) for r in top_rows],
+        )
+
+    def query_layers(
+        self,
+        query_input: Queries,
+        layers: List[str],
+        linear_compound_func: LinearCompoundScore,
+        query_vectors: Union[np.ndarray, List[List[float]], None] = None,
+    ) -> Dict[str, List[Tuple[List[str], List[int]]]]:
+        # generate embedding
+        emb_vector = _normalize_rows(
+            self._get_query_embeddings(query_input, query_vectors)
+        )
+        # search
+        query_result = {}
+        for layer in layers:
+            query_result[layer] = []
+            for cur_emb, cur_query in zip(emb_vector, query_input.query_records):
+                segment = self.segments.get((cur_query.symbol, layer))
+                if segment is None or segment.size == 0 or cur_query.k == 0:
+                    query_result[layer].append(([], []))
+                    continue
+                query_result[layer].append(
+                    self._rank_segment(
+                        segment=segment,
+                        layer=layer,
+                        query_vector=cur_emb,
+                        k=cur_query.k,
+                        linear_compound_func=linear_compound_func,
+                    )
+                )
+        return query_result
+
+    def prepare_jump(
+        self, jump_direction: JumpDirection, layer: str, threshold: float
+    ) -> List[Dict[str, Any]]:
+        jump_records = []
+        for cur_symbol, _, segment in self._iter_segments(layer=layer):
+            cur_importance = self._segment_importance(
+                segment, layer, slice(0, segment.size)
+            )
+            if jump_direction == JumpDirection.UP:
+                rows = np.flatnonzero(cur_importance >= threshold)
+            else:
+                rows = np.flatnonzero(cur_importance < threshold)
+            if len(rows) == 0:
+                continue
+            payloads = [
+                self._segment_payload(segment, r, cur_symbol, layer) for r in rows
+            ]
+            removed = segment.remove(rows)
+            for cur_id, cur_payload, cur_vector in zip(
+                removed["ids"], payloads, removed["vectors"]
+            ):
+                jump_records.append(
+                    {"id": int(cur_id), "payload": cur_payload, "vector": cur_vector}
+                )
+        return jump_records
+
+    def accept_jump(
+        self,
+        jump_dict: List[Dict[str, Any]],
+        jump_direction: JumpDirection,
+        recency_init_func: Union[ConstantRecencyInitialization, None],
+        target_layer: str,
+    ) -> None:
+        if not jump_dict:
+            return
+        if jump_direction == JumpDirection.UP and recency_init_func is None:
+            raise ValueError("recency_init_func should not be None if jump up")
+        grouped_records: Dict[str, List[Dict[str, Any]]] = {}
+        for r in jump_dict:
+            if jump_direction == JumpDirection.UP:
+                r["payload"]["recency"] = recency_init_func()  # type: ignore
+                r["payload"]["delta"] = 0
+            r["payload"]["layer"] = target_layer
+            grouped_records.setdefault(r["payload"]["symbol"], []).append(r)
+        for symbol, records in grouped_records.items():
+            self._append_payloads(
+                symbol=symbol,
+                layer=target_layer,
+                ids=[r["id"] for r in records],
+                vectors=np.stack([np.asarray(r["vector"]) for r in records]),
+                payloads=[r["payload"] for r in records],
+            )
+        self._journal_changes(updated=[r["id"] for r in jump_dict])
+
+    def _locate(
+        self, memory_id: int
+    ) -> Union[Tuple[_MemorySegment, str, str, int], None]:
+        for (symbol, layer), segment in self.segments.items():
+            if memory_id in segment.id_to_row:
+                return segment, symbol, layer, segment.id_to_row[memory_id]
+        return None
+
+    def update_access_counter_with_feedback(
+        self,
+        access_feedback: Union[AccessFeedback, AccessFeedbackMulti],
+        access_counter_update_func: ConstantAccessCounterUpdateFunction,
+    ) -> None:
+        if isinstance(access_feedback, AccessFeedback):
+            feedback_pairs = [
+                (a.id, a.feedback) for a in access_feedback.access_counter_records
+            ]
+        else:
+            feedback_pairs = [
+                (cur_id, cur_feedback)
+                for cur_asset in access_feedback.access_counter_records
+                for cur_id, cur_feedback in zip(cur_asset.id, cur_asset.feedback)
+            ]
+        for cur_id, cur_feedback in feedback_pairs:
+            location = self._locate(cur_id)
+            if location is None:
+                continue
+            segment, _, layer, row = location
+            segment.access_counter[row] += cur_feedback
+            segment.importance_base[row] = access_counter_update_func(
+                cur_importance_score=self._get_importance(
+                    segment.importance_base[row], segment.importance_step[row], layer
+                ),
+                direction=cur_feedback,
+            )
+            segment.importance_step[row] = self.decay_steps[layer]
+            self._journal_changes(updated=[cur_id])
+
+    def clean_up(
+        self, importance_threshold: float, recency_threshold: float, layer: str
+    ) -> None:
+        for _, _, segment in self._iter_segments(layer=layer):
+            live_rows = slice(0, segment.size)
+            rows = np.flatnonzero(
+                (
+                    self._segment_importance(segment, layer, live_rows)
+                    < importance_threshold
+                )
+                | (self._segment_recency(segment, layer, live_rows) < recency_threshold)
+            )
+            if len(rows) > 0:
+                removed = segment.remove(rows)
+                self._journal_changes(deleted=removed["ids"].tolist())
+
+    def _load_records(self, memories: List[Dict[str, Any]]) -> None:
+        grouped_records: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for m in memories:
+            grouped_records.setdefault(
+                (m["payload"]["symbol"], m["payload"]["layer"]), []
+            ).append(m)
+        # checkpointed vectors are already normalized, renormalizing would only
+        # add float noise between save and load
+        for (symbol, layer), records in grouped_records.items():
+            self._append_payloads(
+                symbol=symbol,
+                layer=layer,
+                ids=[r["id"] for r in records],
+                vectors=np.asarray([r["vector"] for r in records], dtype=np.float32),
+                payloads=[r["payload"] for r in records],
+            )
+
+    def _get_stored_records(
+        self, ids: List[int], with_vector: bool
+    ) -> List[Dict[str, Any]]:
+        stored_records = []
+        for cur_id in ids:
+            location = self._locate(cur_id)
+            if location is None:
+                continue
+            segment, symbol, layer, row = location
+            cur_record = {
+                "id": cur_id,
+                "payload": {
+                    "symbol": symbol,
+                    "date": segment.dates[row],
+                    "text": segment.texts[row],
+                    "layer": layer,
+                    "access_counter": int(segment.access_counter[row]),
+                    "importance_base": float(segment.importance_base[row]),
+                    "importance_step": int(segment.importance_step[row]),
+                    "recency_step": int(segment.recency_step[row]),
+                    "recency_carry": float(segment.recency_carry[row]),
+                    "recency_carry_step": int(segment.recency_carry_step[row]),
+                },
+            }
+            if with_vector:
+                cur_record["vector"] = segment.vectors[row].tolist()
+            stored_records.append(cur_record)
+        return stored_records
+
+    def _put_stored_records(self, records: List[Dict[str, Any]]) -> None:
+        for r in records:
+            cur_vector = r.get("vector")
+            # existing records are moved, their layer may have changed
+            location = self._locate(r["id"])
+            if location is not None:
+                segment, _, _, row = location
+                removed = segment.remove(np.asarray([row]))
+                if cur_vector is None:
+                    cur_vector = removed["vectors"][0]
+            if cur_vector is None:
+                continue
+            cur_payload = r["payload"]
+            self._get_segment(cur_payload["symbol"], cur_payload["layer"]).append(
+                ids=[r["id"]],
+                vectors=np.asarray([cur_vector], dtype=np.float32),
+                dates=[cur_payload["date"]],
+                texts=[cur_payload["text"]],
+                importance_base=[cur_payload["importance_base"]],
+                importance_step=[cur_payload["importance_step"]],
+                recency_step=[cur_payload["recency_step"]],
+                # log entries written before recency carries were stored
+                recency_carry=[cur_payload.get("recency_carry", 0.0)],
+                recency_carry_step=[
+                    cur_payload.get("recency_carry_step", _NO_CARRY_STEP)
+                ],
+                access_counter=[cur_payload["access_counter"]],
+            )
+
+    def _delete_records(self, ids: List[int]) -> None:
+        for cur_id in ids:
+            location = self._locate(cur_id)
+            if location is not None:
+                segment, _, _, row = location
+                segment.remove(np.asarray([row]))
+
+
+def _get_memory_db_cls(memory_db_config: Dict[str, Any]) -> Type[MemoryDBBase]:
+    memory_db_backend = memory_db_config.get("memory_db_backend", "qdrant")
+    if memory_db_backend == "qdrant":
+        return MemoryDB
+    elif memory_db_backend == "numpy":
+        return NumpyMemoryDB
+    else:
+        logger.error(f"SYS-Memory db backend {memory_db_backend} not implemented")
+        raise NotImplementedError(
+            f"Memory db backend {memory_db_backend} not implemented"
+        )
+
+
+def construct_memory_db(
+    agent_config: Dict[str, Any], emb_config: Dict[str, Any]
+) -> MemoryDBBase:
+    memory_db_cls = _get_memory_db_cls(agent_config["memory_db_config"])
+    return memory_db_cls(agent_config=agent_config, emb_config=emb_config)
+
+
+def load_memory_db_checkpoint(path: str) -> MemoryDBBase:
+    load_path = get_committed_dir(os.path.join(path, "brain"))
+    with open(os.path.join(load_path, "agent_config.json"), "r") as f:
+        agent_config = orjson.loads(f.read())
+    memory_db_cls = _get_memory_db_cls(agent_config["memory_db_config"])
+    return memory_db_cls.load_checkpoint(path)
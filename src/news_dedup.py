@@ -0,0 +1,120 @@
+import hashlib
+import re
+from collections import deque
+from typing import Deque, Dict, List
+
+import numpy as np
+from loguru import logger
+
+# universal hashing (a * x + b) mod p on 32 bit shingle hashes, as in minhash
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+class NewsDeduplicator:
+    """Drops news that nearly repeat a news item of the same symbol.
+
+    Every text is reduced to a MinHash signature of its word shingles. The
+    share of equal signature entries estimates the Jaccard similarity of two
+    shingle sets, so near-duplicates are found without embedding the texts.
+    A news item is compared with the kept news of the same batch and of the
+    last ``window - 1`` batches of its symbol.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        num_perm: int = 64,
+        shingle_size: int = 3,
+        window: int = 1,
+        seed: int = 0,
+    ) -> None:
+        logger.trace(
+            f"SYS-Initializing NewsDeduplicator, threshold: {threshold}, num_perm: {num_perm}, shingle_size: {shingle_size}, window: {window}"
+        )
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.window = window
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.perm_a = rng.integers(1, _MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.perm_b = rng.integers(0, _MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.history: Dict[str, Deque[List[str]]] = {}
+        self.signatures: Dict[str, np.ndarray] = {}
+
+    def _shingle_hashes(self, text: str) -> np.ndarray:
+        words = re.findall(r"\w+", text.lower())
+        shingles = {
+            " ".join(words[i : i + self.shingle_size])
+            for i in range(max(len(words) - self.shingle_size + 1, 1))
+        }
+        return np.array(
+            [
+                int.from_bytes(
+                    hashlib.blake2b(s.encode(), digest_size=4).digest(), "little"
+                )
+                for s in shingles
+            ],
+            dtype=np.uint64,
+        )
+
+    def signature(self, text: str) -> np.ndarray:
+        if text not in self.signatures:
+            hashes = self._shingle_hashes(text)
+            # a, b and x are below 2 ** 32, so a * x + b does not overflow
+            permuted = (
+                np.outer(hashes, self.perm_a) + self.perm_b
+            ) % _MERSENNE_PRIME & _MAX_HASH
+            self.signatures[text] = permuted.min(axis=0)
+        return self.signatures[text]
+
+    def __call__(self, symbol: str, news: List[str]) -> List[str]:
+        if symbol not in self.history:
+            self.history[symbol] = deque(maxlen=max(self.window - 1, 0))
+        kept_signatures = [
+            self.signature(n) for batch in self.history[symbol] for n in batch
+        ]
+        kept = []
+        for cur_news in news:
+            cur_signature = self.signature(cur_news)
+            if kept_signatures and (
+                np.max(np.mean(np.stack(kept_signatures) == cur_signature, axis=1))
+                >= self.threshold
+            ):
+                logger.trace(f"AGENT-Dropped near-duplicate news: {cur_news}")
+                continue
+            kept.append(cur_news)
+            kept_signatures.append(cur_signature)
+        if self.history[symbol].maxlen:
+            self.history[symbol].append(kept)
+        # only signatures of news that can still be compared with are kept
+        self.signatures = {
+            n: self.signatures[n]
+            for batches in self.history.values()
+            for batch in batches
+            for n in batch
+        }
+        return kept
+
+    def save_checkpoint(self) -> Dict[str, List[List[str]]]:
+        return {symbol: list(batches) for symbol, batches in self.history.items()}
+
+    @classmethod
+    def load_checkpoint(
+        cls,
+        history: Dict[str, List[List[str]]],
+        threshold: float,
+        num_perm: int = 64,
+        shingle_size: int = 3,
+        window: int = 1,
+    ) -> "NewsDeduplicator":
+        news_dedup = cls(
+            threshold=threshold,
+            num_perm=num_perm,
+            shingle_size=shingle_size,
+            window=window,
+        )
+        for symbol, batches in history.items():
+            news_dedup.history[symbol] = deque(batches, maxlen=max(window - 1, 0))
+        return news_dedup
@@ -12,6 +12,7 @@ import orjson
 from loguru import logger
 from pydantic import BaseModel, NonNegativeInt
 
+from .checkpoint import CheckpointOp, write_checkpoint_ops
 from .memory_db import AccessFeedback, AccessFeedbackMulti, AccessMulti, AccessSingle
 from .portfolio_tools import PortfolioOptimizer
 
@@ -104,9 +105,12 @@ class PortfolioBase(ABC):
         pass
 
     @abstractmethod
-    def save_checkpoint(self, path: str) -> None:
+    def checkpoint_ops(self, path: str) -> List[CheckpointOp]:
         pass
 
+    def save_checkpoint(self, path: str) -> None:
+        write_checkpoint_ops(self.checkpoint_ops(path))
+
     @classmethod
     @abstractmethod
     def load_checkpoint(cls, path: str) -> "PortfolioBase":
@@ -229,7 +233,7 @@ class PortfolioSingleAsset(PortfolioBase):
         else:
             return AssetPosition.NEUTRAL
 
-    def save_checkpoint(self, path: str) -> None:
+    def checkpoint_ops(self, path: str) -> List[CheckpointOp]:
         # create a dump object
         dump = SinglePortfolioDump(
             position=self.position,
@@ -243,10 +247,13 @@ class PortfolioSingleAsset(PortfolioBase):
             price_deque=list(self.price_deque),
             evidence_deque=list(self.evidence_deque),
         )
-        with open(
-            os.path.join(path, "single_asset_portfolio_checkpoint.json"), "w"
-        ) as f:
-            f.write(orjson.dumps(dump.dict()).decode())
+        return [
+            CheckpointOp(
+                kind="write",
+                path=os.path.join(path, "single_asset_portfolio_checkpoint.json"),
+                data=orjson.dumps(dump.dict()),
+            )
+        ]
 
     @classmethod
     def load_checkpoint(cls, path: str) -> "PortfolioSingleAsset":
@@ -472,7 +479,7 @@ class PortfolioMultiAsset(PortfolioBase):
             "position": [1 for _ in range(len(self.trading_dates))],
         }
 
-    def save_checkpoint(self, path: str) -> None:
+    def checkpoint_ops(self, path: str) -> List[CheckpointOp]:
         dump = MultiPortfolioDump(
             symbols=self.trading_symbols,
             buying_power=self.buying_power,
@@ -488,10 +495,13 @@ class PortfolioMultiAsset(PortfolioBase):
             cur_portfolio_value=self.cur_portfolio_value,
             portfolio_config=self.portfolio_config,  # type: ignore
         )
-        with open(
-            os.path.join(path, "multi_asset_portfolio_checkpoint.json"), "w"
-        ) as f:
-            f.write(orjson.dumps(dump.dict()).decode())
+        return [
+            CheckpointOp(
+                kind="write",
+                path=os.path.join(path, "multi_asset_portfolio_checkpoint.json"),
+                data=orjson.dumps(dump.dict()),
+            )
+        ]
 
     @classmethod
     def load_checkpoint(
@@ -0,0 +1,233 @@
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterator, List, Union
+
+import httpx
+from loguru import logger
+
+# status codes that ask the client to slow down and retry
+RETRY_STATUS_CODES = {429, 503, 529}
+# request and token limit headers of OpenAI and Anthropic
+REQUEST_LIMIT_HEADERS = [
+    "x-ratelimit-limit-requests",
+    "anthropic-ratelimit-requests-limit",
+]
+REQUEST_REMAINING_HEADERS = [
+    "x-ratelimit-remaining-requests",
+    "anthropic-ratelimit-requests-remaining",
+]
+REQUEST_RESET_HEADERS = [
+    "x-ratelimit-reset-requests",
+    "anthropic-ratelimit-requests-reset",
+]
+TOKEN_REMAINING_HEADERS = [
+    "x-ratelimit-remaining-tokens",
+    "anthropic-ratelimit-tokens-remaining",
+]
+TOKEN_RESET_HEADERS = ["x-ratelimit-reset-tokens", "anthropic-ratelimit-tokens-reset"]
+
+
+def _parse_reset(value: str, now: float) -> Union[float, None]:
+    """Seconds until a limit resets, from "1m30s" / "20ms" or a timestamp."""
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+        return sum(float(n) * scale[u] for n, u in parts)
+    try:
+        reset_time = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            reset_time = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    return max(reset_time.timestamp() - now, 0.0)
+
+
+def _get_header(response: httpx.Response, names: List[str]) -> Union[str, None]:
+    for name in names:
+        if name in response.headers:
+            return response.headers[name]
+    return None
+
+
+class RateController:
+    """Paces requests to one endpoint from its rate limit headers.
+
+    Requests take a token from a bucket that is synced with the remaining
+    requests reported by the server and refilled at the reported limit per
+    minute. Concurrency follows AIMD: it starts at one request, grows by one
+    per success until the first throttled response and by one per window of
+    successes afterwards, and halves on every throttled response, up to
+    ``max_concurrency``. A throttled request waits for Retry-After, or an
+    exponential backoff without it, and is sent again.
+    """
+
+    def __init__(
+        self, name: str, max_concurrency: int = 1, max_retries: int = 5
+    ) -> None:
+        logger.trace(
+            f"SYS-Initializing RateController for {name}, max concurrency: {max_concurrency}, max retries: {max_retries}"
+        )
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.condition = threading.Condition()
+        self.concurrency = 1.0
+        self.slow_start = True
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        # token bucket, unknown until the first response with limit headers
+        self.bucket_tokens: Union[float, None] = None
+        self.bucket_rate: Union[float, None] = None
+        self.bucket_capacity: Union[float, None] = None
+        self.bucket_time = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.bucket_tokens is not None and self.bucket_rate is not None:
+            self.bucket_tokens = min(
+                self.bucket_capacity,  # type: ignore
+                self.bucket_tokens + (now - self.bucket_time) * self.bucket_rate,
+            )
+        self.bucket_time = now
+
+    def _wait_time(self, now: float) -> float:
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.bucket_tokens is not None and self.bucket_tokens < 1.0:
+            if not self.bucket_rate:
+                return 1.0
+            return (1.0 - self.bucket_tokens) / self.bucket_rate
+        return 0.0
+
+    @contextmanager
+    def acquire(self) -> Iterator[None]:
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self.in_flight < int(self.concurrency):
+                    wait_time = self._wait_time(now)
+                    if wait_time <= 0:
+                        break
+                    self.condition.wait(timeout=wait_time)
+                else:
+                    self.condition.wait()
+            self.in_flight += 1
+            if self.bucket_tokens is not None:
+                self.bucket_tokens -= 1.0
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def update(self, response: httpx.Response, attempt: int = 0) -> None:
+        now_wall = time.time()
+        with self.condition:
+            now = time.monotonic()
+            self._refill(now)
+            limit = _get_header(response, REQUEST_LIMIT_HEADERS)
+            remaining = _get_header(response, REQUEST_REMAINING_HEADERS)
+            if limit is not None and remaining is not None:
+                try:
+                    # both providers state request limits per minute
+                    self.bucket_capacity = max(float(limit), 1.0)
+                    self.bucket_rate = self.bucket_capacity / 60.0
+                    self.bucket_tokens = float(remaining)
+                except ValueError:
+                    pass
+            # wait for the window to reset once requests or tokens run out
+            for remaining_headers, reset_headers in [
+                (REQUEST_REMAINING_HEADERS, REQUEST_RESET_HEADERS),
+                (TOKEN_REMAINING_HEADERS, TOKEN_RESET_HEADERS),
+            ]:
+                remaining = _get_header(response, remaining_headers)
+                reset = _get_header(response, reset_headers)
+                if remaining is not None and reset is not None:
+                    reset_time = _parse_reset(reset, now_wall)
+                    if reset_time is not None and remaining.strip() in ["0", "0.0"]:
+                        self.blocked_until = max(self.blocked_until, now + reset_time)
+
+            if response.status_code in RETRY_STATUS_CODES:
+                retry_after = None
+                if "retry-after-ms" in response.headers:
+                    retry_after = _parse_reset(response.headers["retry-after-ms"], 0.0)
+                    retry_after = None if retry_after is None else retry_after / 1000
+                elif "retry-after" in response.headers:
+                    retry_after = _parse_reset(
+                        response.headers["retry-after"], now_wall
+                    )
+                if retry_after is None:
+                    retry_after = min(2.0**attempt, 60.0) * random.uniform(0.5, 1.0)
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.slow_start = False
+                logger.warning(
+                    f"SYS-Throttled by {self.name} with status {response.status_code}, waiting {retry_after:.2f}s, concurrency: {int(self.concurrency)}"
+                )
+            elif response.is_success:
+                increase = 1.0 if self.slow_start else 1.0 / self.concurrency
+                self.concurrency = min(
+                    float(self.max_concurrency), self.concurrency + increase
+                )
+            self.condition.notify_all()
+
+    def request(self, send: Callable[[], httpx.Response]) -> httpx.Response:
+        attempt = 0
+        while True:
+            with self.acquire():
+                response = send()
+            self.update(response, attempt=attempt)
+            if (
+                response.status_code not in RETRY_STATUS_CODES
+                or attempt >= self.max_retries
+            ):
+                return response
+            attempt += 1
+
+
+rate_controllers: Dict[str, RateController] = {}
+rate_controllers_lock = threading.Lock()
+
+
+def get_rate_controller(
+    name: str, max_concurrency: int = 1, max_retries: int = 5
+) -> RateController:
+    """Returns the controller of an endpoint, shared by all of its clients.
+
+    The server limits the endpoint as a whole, so clients asking for different
+    limits share one controller with the stricter of them.
+    """
+    with rate_controllers_lock:
+        if name not in rate_controllers:
+            rate_controllers[name] = RateController(
+                name=name, max_concurrency=max_concurrency, max_retries=max_retries
+            )
+        controller = rate_controllers[name]
+    with controller.condition:
+        if (
+            max_concurrency != controller.max_concurrency
+            or max_retries != controller.max_retries
+        ):
+            logger.warning(
+                f"SYS-RateController for {name} requested with max concurrency: {max_concurrency}, max retries: {max_retries}, but has max concurrency: {controller.max_concurrency}, max retries: {controller.max_retries}, using the lower of each"
+            )
+            controller.max_concurrency = min(
+                controller.max_concurrency, max_concurrency
+            )
+            controller.max_retries = min(controller.max_retries, max_retries)
+            controller.concurrency = min(
+                controller.concurrency, float(controller.max_concurrency)
+            )
+    return controller